@@ -1,7 +1,8 @@
 """ analytic_reference script """
 from common import info, info_split, info_cyan, info_error
-from postprocess import get_step_and_info, rank, compute_norms
+from postprocess import get_step_and_info, rank, output_norms
 import dolfin as df
+import numpy as np
 import os
 from utilities.plot import plot_any_field
 import importlib
@@ -12,75 +13,119 @@ def description(ts, **kwargs):
 This is done by importing the function "reference" in the problem module.""")
 
 
-def method(ts, time=None, step=0, show=False,
-           save_fig=False, **kwargs):
-    """ Compare to analytic reference expression at given timestep.
-    This is done by importing the function "reference" in the problem module.
-    """
-    info_cyan("Comparing to analytic reference at given time or step.")
-    step, time = get_step_and_info(ts, time, step)
-    parameters = ts.get_parameters(time=time)
+def error_norms(ts, steps_times, show=False, save_fig=False):
+    """ Error norms of ts compared to the analytic reference of the problem
+    at the given (step, time) pairs. Returns dict from field to the norms
+    (norm type to an array over times). """
+    parameters = ts.get_parameters(time=steps_times[0][1])
     problem = parameters.get("problem", "intrusion_bulk")
     try:
         module = importlib.import_module("problems.{}".format(problem))
         reference = module.reference
     except:
         info_error("No analytic reference available.")
-    ref_exprs = reference(t=time, **parameters)
+    ref_exprs = reference(t=steps_times[0][1], **parameters)
 
     info("Comparing to analytic solution.")
     info_split("Problem:", "{}".format(problem))
-    info_split("Time:", "{}".format(time))
 
     f = ts.functions(ref_exprs.keys())
 
+    # The higher order spaces, and the operators for interpolation and
+    # norms in them, are set up once and used for all times.
     err = dict()
-    f_int = dict()
     f_ref = dict()
+    transfer = dict()
+    mass = dict()
+    stiffness = dict()
+    norms = dict()
     for field in ref_exprs.keys():
-        el = f[field].function_space().ufl_element()
+        V = f[field].function_space()
+        el = V.ufl_element()
         degree = el.degree()
         if bool(el.value_size() != 1):
             W = df.VectorFunctionSpace(ts.mesh, "CG", degree+3)
         else:
             W = df.FunctionSpace(ts.mesh, "CG", degree+3)
         err[field] = df.Function(W)
-        f_int[field] = df.Function(W)
         f_ref[field] = df.Function(W)
+        transfer[field] = df.PETScDMCollection.create_transfer_matrix(V, W)
+
+        u = df.TrialFunction(W)
+        v = df.TestFunction(W)
+        mass[field] = df.assemble(df.inner(u, v)*df.dx)
+        stiffness[field] = df.assemble(
+            df.inner(df.grad(u), df.grad(v))*df.dx)
+
+        norms[field] = dict([(norm_type, np.zeros(len(steps_times)))
+                             for norm_type in ["l2", "linf", "L2", "H1"]])
+
+    for i, (step, time) in enumerate(steps_times):
+        info_split("Time:", "{}".format(time))
+        for field, ref_expr in ref_exprs.items():
+            ref_expr.t = time
+            # Update numerical solution f
+            ts.update(f[field], field, step)
+
+            # Interpolate f_ref to higher space
+            f_ref[field].interpolate(ref_expr)
+
+            # Interpolate f to higher space, and subtract the reference
+            e = err[field].vector()
+            transfer[field].mult(f[field].vector(), e)
+            e.axpy(-1., f_ref[field].vector())
+
+            L2_sq = e.inner(mass[field]*e)
+            H1_semi_sq = e.inner(stiffness[field]*e)
+            norms[field]["l2"][i] = e.norm("l2")
+            norms[field]["linf"][i] = e.norm("linf")
+            norms[field]["L2"][i] = np.sqrt(L2_sq)
+            norms[field]["H1"][i] = np.sqrt(L2_sq + H1_semi_sq)
+
+            if show or save_fig:
+                # Interpolate the error to low order space for
+                # visualisation.
+                err_int = df.interpolate(err[field],
+                                         f[field].function_space())
+                err_arr = ts.nodal_values(err_int)
+                label = "Error in " + field
+
+                if rank == 0:
+                    save_fig_file = None
+                    if save_fig:
+                        save_fig_file = os.path.join(
+                            ts.plots_folder,
+                            "error_{}_time{}_analytic.png".format(
+                                field, time))
+
+                    plot_any_field(ts.nodes, ts.elems, err_arr,
+                                   save=save_fig_file, show=show,
+                                   label=label)
+    return norms
+
+
+def method(ts, time=None, step=0, show=False,
+           save_fig=False, **kwargs):
+    """ Compare to analytic reference expression at given timestep(s).
+    This is done by importing the function "reference" in the problem module.
+    Several times can be given as a list, time=[t1,t2,...].
+    """
+    info_cyan("Comparing to analytic reference at given time or step.")
+    if isinstance(time, list):
+        steps_times = [get_step_and_info(ts, time_i) for time_i in time]
+    else:
+        steps_times = [get_step_and_info(ts, time, step)]
+
+    norms = error_norms(ts, steps_times, show=show, save_fig=save_fig)
 
-    for field, ref_expr in ref_exprs.items():
-        ref_expr.t = time
-        # Update numerical solution f
-        ts.update(f[field], field, step)
-
-        # Interpolate f to higher space
-        f_int[field].assign(df.interpolate(
-            f[field], f_int[field].function_space()))
-
-        # Interpolate f_ref to higher space
-        f_ref[field].assign(df.interpolate(
-            ref_expr, f_ref[field].function_space()))
-
-        err[field].vector()[:] = (f_int[field].vector().get_local() -
-                                  f_ref[field].vector().get_local())
-
-        if show or save_fig:
-            # Interpolate the error to low order space for visualisation.
-            err_int = df.interpolate(err[field], f[field].function_space())
-            err_arr = ts.nodal_values(err_int)
-            label = "Error in " + field
-
-            if rank == 0:
-                save_fig_file = None
-                if save_fig:
-                    save_fig_file = os.path.join(
-                        ts.plots_folder, "error_{}_time{}_analytic.png".format(
-                            field, time))
-
-                plot_any_field(ts.nodes, ts.elems, err_arr,
-                               save=save_fig_file, show=show, label=label)
-
-    save_file = os.path.join(ts.analysis_folder,
-                             "errornorms_time{}_analytic.dat".format(
-                                 time))
-    compute_norms(err, save=save_file)
+    vector_norms = ["l2", "linf"]
+    function_norms = ["L2", "H1"]
+    headers = ["Fields"] + vector_norms + function_norms
+    for i, (step, time) in enumerate(steps_times):
+        table = [[field] + [norms[field][norm_type][i]
+                            for norm_type in vector_norms + function_norms]
+                 for field in sorted(norms.keys())]
+        save_file = os.path.join(ts.analysis_folder,
+                                 "errornorms_time{}_analytic.dat".format(
+                                     time))
+        output_norms(table, headers, save=save_file)
@@ -1,73 +1,76 @@
 """ value_in_time script
 
 """
-from common import info, info_cyan, info_blue
-from postprocess import get_steps, rank
+from common import info, info_cyan
+from postprocess import Analysis, run_analyses
 import numpy as np
-import dolfin as df
-import os
-from analysis_scripts.flux_in_time import fetch_boundaries
+from analysis_scripts.flux_in_time import fetch_boundaries, \
+    facet_integrand, QuadraticFunctional
 
 
 def description(ts, **kwargs):
     info("Plot field value in time at a boundaries.")
 
 
-def method(ts, dt=0, extra_boundaries="", **kwargs):
-    """ Plot value in time. """
-    info_cyan("Plot value at boundary in time.")
-
-    params = ts.get_parameters()
-    steps = get_steps(ts, dt)
-
-    problem = params["problem"]
-    info("Problem: {}".format(problem))
-
-    boundary_to_mark, ds = fetch_boundaries(
-        ts, problem, params, extra_boundaries)
+class BoundaryValueInTime(Analysis):
+    def __init__(self, ts, x_, dt=0, extra_boundaries="", cross_sections="",
+                 **kwargs):
+        Analysis.__init__(self, ts, x_, dt=dt,
+                          extra_boundaries=extra_boundaries,
+                          cross_sections=cross_sections)
 
-    x_ = ts.functions()
-
-    fields = dict()
-    for field, f in x_.items():
-        if field == "u":
-            fields["u_x"] = f[0]
-            fields["u_y"] = f[1]
-        else:
-            fields[field] = f
+        params = ts.get_parameters()
 
-    t = np.zeros(len(steps))
-    data = dict()
-    for boundary_name in boundary_to_mark:
-        data[boundary_name] = dict()
-        for field in fields:
-            data[boundary_name][field] = np.zeros(len(steps))
+        problem = params["problem"]
+        info("Problem: {}".format(problem))
 
-    for i, step in enumerate(steps):
-        info("Step {} of {}".format(step, len(ts)))
+        boundary_to_mark, ds, _ = fetch_boundaries(
+            ts, problem, params, extra_boundaries, cross_sections)
 
-        for field in x_:
-            ts.update(x_[field], field, step)
+        fields = dict()
+        for field, f in x_.items():
+            if field == "u":
+                fields["u_x"] = f[0]
+                fields["u_y"] = f[1]
+            else:
+                fields[field] = f
+        self.field_keys = sorted(fields.keys())
 
+        self.functionals = dict()
         for boundary_name, (mark, k) in boundary_to_mark.items():
-            for field, f in fields.items():
-                data[boundary_name][field][i] = df.assemble(
-                    f*ds[k](mark))
-
-        t[i] = ts.times[step]
-
-    savedata = dict()
-    field_keys = sorted(fields.keys())
-    for boundary_name in boundary_to_mark:
-        savedata[boundary_name] = np.array(
-            list(zip(steps, t, *[data[boundary_name][field]
-                                 for field in field_keys])))
-
-    if rank == 0:
-        header = "Step\tTime\t"+"\t".join(field_keys)
-        for boundary_name in boundary_to_mark:
-            with open(os.path.join(
-                    ts.analysis_folder,
-                    "value_in_time_{}.dat".format(boundary_name)),
-                      "w") as outfile:
-                np.savetxt(outfile, savedata[boundary_name], header=header)
+            self.functionals[boundary_name] = [
+                QuadraticFunctional(
+                    facet_integrand(fields[field], ds[k])*ds[k](mark), x_)
+                for field in self.field_keys]
+
+    def process(self, step):
+        return dict([(boundary_name, [functional()
+                                      for functional in functionals])
+                     for boundary_name, functionals
+                     in self.functionals.items()])
+
+    def tables(self, results):
+        steps = sorted(results.keys())
+        header = "Step\tTime\t"+"\t".join(self.field_keys)
+        tables = dict()
+        for boundary_name in self.functionals:
+            data = np.array([[step, self.ts.times[step]]
+                             + results[step][boundary_name]
+                             for step in steps])
+            tables["value_in_time_{}.dat".format(boundary_name)] = (
+                header, data)
+        return tables
+
+
+def analysis(ts, x_, **kwargs):
+    return BoundaryValueInTime(ts, x_, **kwargs)
+
+
+def method(ts, dt=0, extra_boundaries="", cross_sections="", **kwargs):
+    """ Plot value in time. """
+    info_cyan("Plot value at boundary in time.")
+    x_ = ts.functions()
+    run_analyses(ts, x_, [analysis(ts, x_, dt=dt,
+                                   extra_boundaries=extra_boundaries,
+                                   cross_sections=cross_sections,
+                                   **kwargs)])
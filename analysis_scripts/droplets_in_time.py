@@ -0,0 +1,142 @@
+""" droplets_in_time script """
+from common import info, info_cyan, info_warning
+import os
+import numpy as np
+from postprocess import index2letter, rank, Analysis, run_analyses
+from utilities.droplets import DropletTracker
+
+
+def description(ts, **kwargs):
+    info("""Track the individual droplets in time.
+
+The dispersed phase (phi < 0) is split into droplets (connected components
+on the mesh), which are followed from step to step by their overlap. Their
+volume, centre of mass, velocity and charge are stored per step.""")
+
+
+class DropletsInTime(Analysis):
+    """ The droplets are tracked in process, along chains of consecutive
+    steps analyzed by the same process, and only per-droplet summaries are
+    kept. The ids within a chain are local; tables maps them to global ids,
+    linking each chain to the step before it, which is labeled again at the
+    start of the chain. """
+    def __init__(self, ts, x_, dt=0, **kwargs):
+        # Works directly on the nodal data; needs no fields in x_.
+        Analysis.__init__(self, ts, x_, dt=dt, fields=[])
+        self.tracker = DropletTracker(ts.nodes, ts.elems)
+        self.sorted_steps = []
+        self.last_step = None
+        self.chain = None
+        # Global ids: the local to global map of each chain, the ids of the
+        # last step by label, and the next free id.
+        self.mappings = dict()
+        self.last = None
+        self.next_id = 0
+        # The ids of the last step are stored, so that the identities are
+        # kept when the analysis is continued incrementally.
+        self.tracker_file = os.path.join(ts.analysis_folder,
+                                         ".DropletsInTime.npz")
+
+    def previous_step(self, step):
+        if step not in self.sorted_steps:
+            self.sorted_steps = sorted(set(self.steps))
+        i = self.sorted_steps.index(step)
+        return self.sorted_steps[i-1] if i > 0 else None
+
+    def label(self, step):
+        phi = self.ts["phi", step][:, 0]
+        elements, labels = self.tracker.label(phi)
+        return phi, elements, labels
+
+    def process(self, step):
+        ts = self.ts
+        prev = self.previous_step(step)
+        link = None
+        if prev is None or prev != self.last_step:
+            # Start a new chain; the droplets of the previous step get the
+            # local ids 0, 1, ... in the order of their labels.
+            self.tracker.reset()
+            self.chain = step
+            if prev is not None:
+                _, elements, labels = self.label(prev)
+                self.tracker.track(elements, labels)
+                link = prev
+
+        phi, elements, labels = self.label(step)
+        props = self.tracker.properties(
+            elements, labels, phi,
+            u=ts["u", step] if "u" in ts else None,
+            charge=ts["charge", step] if "charge" in ts else None)
+        ids = self.tracker.track(elements, labels)
+        self.last_step = step
+        return dict(chain=self.chain, link=link, ids=ids, **props)
+
+    def link_ids(self, link):
+        """ Global ids, by label, of the droplets at the step link. """
+        if self.last is not None and self.last[0] == link:
+            return self.last[1]
+        if os.path.exists(self.tracker_file):
+            last = np.load(self.tracker_file)
+            if int(last["step"]) == link:
+                self.next_id = max(self.next_id, int(last["next_id"]))
+                return last["ids"]
+        return np.zeros(0, dtype=int)
+
+    def tables(self, results):
+        steps = sorted(results.keys())
+        rows = []
+        for step in steps:
+            r = results[step]
+            if r["chain"] not in self.mappings:
+                self.mappings[r["chain"]] = dict(
+                    enumerate(self.link_ids(r["link"]))
+                    if r["link"] is not None else [])
+            mapping = self.mappings[r["chain"]]
+            for i in sorted(set(r["ids"]) - set(mapping.keys())):
+                mapping[i] = self.next_id
+                self.next_id += 1
+            ids = np.array([mapping[i] for i in r["ids"]], dtype=int)
+            self.last = (step, ids)
+
+            for i in np.argsort(ids):
+                rows.append([step, self.ts.times[step], ids[i],
+                             r["volume"][i]] + list(r["centroid"][i])
+                            + list(r["velocity"][i]) + [r["charge"][i]])
+            info("Step {}: {} droplets.".format(step, len(ids)))
+
+        if rank == 0:
+            np.savez(self.tracker_file, step=self.last[0], ids=self.last[1],
+                     next_id=self.next_id)
+
+        header = "\t".join(
+            ["Timestep", "Time", "Id", "Volume"]
+            + ["CoM_" + index2letter(d) for d in range(self.ts.dim)]
+            + ["U_" + index2letter(d) for d in range(self.ts.dim)]
+            + ["Charge"])
+        data = np.array(rows).reshape(-1, 5+2*self.ts.dim)
+        return {"droplets.dat": (header, data)}
+
+
+def analysis(ts, x_, **kwargs):
+    if not ts.get_parameter("enable_PF"):
+        info_warning("Phase field not enabled.")
+        return None
+    return DropletsInTime(ts, x_, **kwargs)
+
+
+def method(ts, dt=0, **kwargs):
+    """ Track the individual droplets in time.
+
+    Each row of droplets.dat holds one droplet at one step, identified by
+    an id that is kept as long as the droplet overlaps itself between the
+    analyzed steps. At breakup, the largest part keeps the id; at
+    coalescence, the id of the droplet that overlaps the result the most is
+    kept.
+    """
+    info_cyan("Tracking the droplets through time.")
+
+    a = analysis(ts, None, dt=dt, **kwargs)
+    if a is None:
+        return False
+
+    run_analyses(ts, None, [a])
@@ -1,9 +1,8 @@
 """ energy_in_time script """
 from common import info, info_cyan
-from postprocess import get_steps, rank
+from postprocess import Analysis, run_analyses
 import numpy as np
 import dolfin as df
-import os
 import importlib
 
 
@@ -11,47 +10,41 @@ def description(ts, **kwargs):
     info("Plot energy in time.")
 
 
-def method(ts, dt=0, **kwargs):
-    """ Plot energy in time. """
-    info_cyan("Plot energy in time.")
-
-    params = ts.get_parameters()
-    steps = get_steps(ts, dt)
-
-    problem = params["problem"]
-    info("Problem: {}".format(problem))
+class EnergyInTime(Analysis):
+    def __init__(self, ts, x_, dt=0, **kwargs):
+        Analysis.__init__(self, ts, x_, dt=dt)
 
-    solver = params["solver"]
-    info("Solver:  {}".format(solver))
+        params = ts.get_parameters()
 
-    solver_module = importlib.import_module("solvers.{}".format(solver))
-    discrete_energy = solver_module.discrete_energy
+        problem = params["problem"]
+        info("Problem: {}".format(problem))
 
-    t = np.zeros(len(steps))
+        solver = params["solver"]
+        info("Solver:  {}".format(solver))
 
-    x_ = ts.functions()
+        solver_module = importlib.import_module("solvers.{}".format(solver))
+        discrete_energy = solver_module.discrete_energy
 
-    F_keys = discrete_energy(None, **params)
-    F = []
-    for i in range(len(F_keys)):
-        F.append(np.zeros(len(steps)))
+        self.F_keys = discrete_energy(None, **params)
+        self.fs = discrete_energy(x_, **params)
 
-    for i, step in enumerate(steps):
-        info("Step {} of {}".format(step, len(ts)))
+    def process(self, step):
+        return [df.assemble(f*df.dx) for f in self.fs]
 
-        for field in x_:
-            ts.update(x_[field], field, step)
+    def tables(self, results):
+        steps = sorted(results.keys())
+        data = np.array([[step, self.ts.times[step]] + results[step]
+                         for step in steps])
+        return {"energy_in_time.dat":
+                ("Step\tTime\t"+"\t".join(self.F_keys), data)}
 
-        fs = discrete_energy(x_, **params)
-        for j in range(len(F_keys)):
-            F[j][i] = df.assemble(fs[j]*df.dx)
 
-        t[i] = ts.times[step]
+def analysis(ts, x_, **kwargs):
+    return EnergyInTime(ts, x_, **kwargs)
 
-    data = np.array(list(zip(steps, t, *F)))
 
-    if rank == 0:
-        with open(os.path.join(ts.analysis_folder,
-                               "energy_in_time.dat"),
-                  "w") as outfile:
-            np.savetxt(outfile, data, header="Step\tTime\t"+"\t".join(F_keys))
+def method(ts, dt=0, **kwargs):
+    """ Plot energy in time. """
+    info_cyan("Plot energy in time.")
+    x_ = ts.functions()
+    run_analyses(ts, x_, [analysis(ts, x_, dt=dt, **kwargs)])
@@ -1,12 +1,12 @@
 """ flux_in_time script """
-from common import info, info_cyan, info_blue
-from postprocess import get_steps, rank
+from common import info, info_cyan, info_blue, info_warning
+from postprocess import Analysis, run_analyses
 import numpy as np
 import dolfin as df
-import os
 from common.functions import ramp, dramp, diff_pf_potential_linearised, \
     unit_interval_filter
 import importlib
+from ufl.algorithms import expand_derivatives
 
 
 def description(ts, **kwargs):
@@ -23,6 +23,97 @@ class CrossSection(df.SubDomain):
         return df.near(x[self.dim], self.x0) and on_boundary
 
 
+class InteriorCrossSection(df.SubDomain):
+    """ Plane x[dim] = x0 through the interior of the domain. Only facets
+    that lie in the plane are marked, i.e. the mesh must conform to it. """
+    def __init__(self, x0, dim, tol=1e-8):
+        self.x0 = x0
+        self.dim = dim
+        self.tol = tol
+        df.SubDomain.__init__(self)
+
+    def inside(self, x, on_boundary):
+        return df.near(x[self.dim], self.x0, self.tol)
+
+
+class QuadraticFunctional:
+    """ Functional of the fields in x_ which is at most quadratic in their
+    degrees of freedom.
+
+    The functional is expanded around the zero state,
+
+        F(x) = F(0) + sum_i b_i . x_i + 1/2 sum_ij x_i . H_ij x_j,
+
+    where the vectors b_i and matrices H_ij are assembled once. Evaluating
+    the functional at a new state is then a few sparse matrix-vector
+    products instead of a full assembly. Functionals which are not at most
+    quadratic are assembled directly at every evaluation.
+
+    NB: Must be constructed while all functions in x_ are zero.
+    """
+    def __init__(self, form, x_):
+        self.form = form
+        counts = [coefficient.count() for coefficient in form.coefficients()]
+        self.fields = [f for f in x_.values() if f.count() in counts]
+
+        self.is_quadratic = is_at_most_quadratic(form, self.fields)
+        if not self.is_quadratic:
+            return
+
+        self.F0 = df.assemble(form)
+        self.b = []
+        self.H = []
+        for i, f_i in enumerate(self.fields):
+            dF_i = df.derivative(form, f_i)
+            if not expand_derivatives(dF_i).empty():
+                self.b.append((f_i, df.assemble(dF_i)))
+            for j, f_j in enumerate(self.fields[i:], i):
+                ddF_ij = df.derivative(dF_i, f_j)
+                if not expand_derivatives(ddF_ij).empty():
+                    # Off-diagonal blocks appear twice in the sum.
+                    factor = 0.5 if i == j else 1.0
+                    self.H.append((f_i, f_j, factor, df.assemble(ddF_ij)))
+
+    def __call__(self):
+        """ Evaluate the functional at the current state of x_. """
+        if not self.is_quadratic:
+            return df.assemble(self.form)
+        value = self.F0
+        for f_i, b_i in self.b:
+            value += b_i.inner(f_i.vector())
+        for f_i, f_j, factor, H_ij in self.H:
+            value += factor*f_i.vector().inner(H_ij*f_j.vector())
+        return value
+
+
+def is_at_most_quadratic(form, fields):
+    """ Check whether all third derivatives of the functional with respect
+    to the given fields vanish identically. """
+    for i, f_i in enumerate(fields):
+        dF_i = df.derivative(form, f_i)
+        for j, f_j in enumerate(fields[i:], i):
+            ddF_ij = df.derivative(dF_i, f_j)
+            for f_k in fields[j:]:
+                dddF_ijk = df.derivative(ddF_ij, f_k)
+                if not expand_derivatives(dddF_ijk).empty():
+                    return False
+    return True
+
+
+def get_cross_sections_list(cross_sections_keys, dim):
+    """ Parse specifications like 'x:0.5,y:1.0' to interior cross sections,
+    named e.g. 'cross_x0.5'. """
+    cross_sections = []
+    for key in cross_sections_keys:
+        d_str, x0_str = key.split(":")
+        d = ("x", "y", "z").index(d_str)
+        assert(d < dim)
+        cross_sections.append(
+            ("cross_" + d_str + x0_str,
+             [InteriorCrossSection(float(x0_str), d)]))
+    return cross_sections
+
+
 def get_boundaries_list(boundaries, pbc, extra_boundaries_keys, nodes):
     boundaries = list(boundaries.items())
     if pbc is not None:
@@ -58,7 +149,19 @@ def get_boundary_to_mark(subdomains, boundaries_list):
     return boundary_to_mark
 
 
-def fetch_boundaries(ts, problem, params, extra_boundaries):
+def facet_integrand(expr, measure):
+    """ Restrict integrand to the facets if measure is over interior
+    facets. """
+    if measure.integral_type() == "interior_facet":
+        return df.avg(expr)
+    return expr
+
+
+def fetch_boundaries(ts, problem, params, extra_boundaries,
+                     cross_sections=""):
+    """ Mark boundaries (and interior cross sections) and return a dict
+    from name to (mark, k), the list of measures indexed by k, and a dict
+    from name to the normal vector used for fluxes. """
     problem_module = importlib.import_module("problems.{}".format(problem))
     constrained_domain = problem_module.constrained_domain
     create_bcs = problem_module.create_bcs
@@ -70,6 +173,14 @@ def fetch_boundaries(ts, problem, params, extra_boundaries):
 
     boundaries_list = get_boundaries_list(
         boundaries, pbc, extra_boundaries_keys, ts.nodes)
+    integral_types = ["ds" for _ in boundaries_list]
+
+    cross_sections_keys = [s.lower() for s in cross_sections.split(",")
+                           if s != ""]
+    if len(cross_sections_keys) > 0:
+        boundaries_list.append(get_cross_sections_list(
+            cross_sections_keys, ts.dim))
+        integral_types.append("dS")
 
     subdomains = [df.MeshFunction("size_t", ts.mesh,
                                   ts.mesh.topology().dim()-1)
@@ -78,127 +189,149 @@ def fetch_boundaries(ts, problem, params, extra_boundaries):
     for subdomain in subdomains:
         subdomain.set_all(0)
 
-    ds = [df.Measure("ds", domain=ts.mesh, subdomain_data=subdomain)
-          for subdomain in subdomains]
+    ds = [df.Measure(integral_type, domain=ts.mesh,
+                     subdomain_data=subdomain)
+          for integral_type, subdomain in zip(integral_types, subdomains)]
 
     boundary_to_mark = get_boundary_to_mark(subdomains, boundaries_list)
 
-    return boundary_to_mark, ds
-
-
-def method(ts, dt=0, extra_boundaries="", **kwargs):
-    """ Plot flux in time. """
-    info_cyan("Plot flux in time.")
-
-    params = ts.get_parameters()
-    steps = get_steps(ts, dt)
-
-    problem = params["problem"]
-    info("Problem: {}".format(problem))
-
-    boundary_to_mark, ds = fetch_boundaries(
-        ts, problem, params, extra_boundaries)
-    
-    x_ = ts.functions()
+    n = df.FacetNormal(ts.mesh)
+    normals = dict()
+    for boundary_name, (mark, k) in boundary_to_mark.items():
+        if integral_types[k] == "dS":
+            num_facets = df.MPI.sum(ts.mesh.mpi_comm(), float(
+                (subdomains[k].array() == mark).sum()))
+            if num_facets == 0:
+                info_warning("No facets found on cross section " +
+                             boundary_name + ".")
+            d = boundaries_list[k][mark-1][1][0].dim
+            normals[boundary_name] = df.Constant(
+                tuple(float(d == i) for i in range(ts.dim)))
+        else:
+            normals[boundary_name] = n
+
+    return boundary_to_mark, ds, normals
+
+
+class FluxInTime(Analysis):
+    def __init__(self, ts, x_, dt=0, extra_boundaries="", cross_sections="",
+                 **kwargs):
+        Analysis.__init__(self, ts, x_, dt=dt,
+                          extra_boundaries=extra_boundaries,
+                          cross_sections=cross_sections)
+
+        params = ts.get_parameters()
+
+        problem = params["problem"]
+        info("Problem: {}".format(problem))
+
+        boundary_to_mark, ds, normals = fetch_boundaries(
+            ts, problem, params, extra_boundaries, cross_sections)
+
+        if params["enable_NS"]:
+            u = x_["u"]
+        else:
+            u = df.Constant(0.)
 
-    if params["enable_NS"]:
-        u = x_["u"]
-    else:
-        u = df.Constant(0.)
-
-    if params["enable_PF"]:
-        phi = x_["phi"]
-        g = x_["g"]
-        exec("from problems.{} import pf_mobility".format(problem))
-        M = pf_mobility(phi, params["pf_mobility_coeff"])
-    else:
-        phi = 1.
-        g = df.Constant(0.)
-        M = df.Constant(0.)
-
-    solutes = params["solutes"]
-    c = []
-    c_grad_g_c = []
-    if params["enable_EC"]:
-        V = x_["V"]
-    else:
-        V = df.Constant(0.)
-
-    dbeta = []  # Diff. in beta
-    z = []  # Charge z[species]
-    K = []  # Diffusivity K[species]
-    beta = []  # Conc. jump func. beta[species]
-
-    for solute in solutes:
-        ci = x_[solute[0]]
-        dbetai = dramp([solute[4], solute[5]])
-        c.append(ci)
-        z.append(solute[1])
-        K.append(ramp(phi, [solute[2], solute[3]]))
-        beta.append(ramp(phi, [solute[4], solute[5]]))
-        dbeta.append(dbetai)
-        # THIS HAS NOT BEEN GENERALIZED!
-        c_grad_g_ci = df.grad(ci) + solute[1]*ci*df.grad(V)
         if params["enable_PF"]:
-            c_grad_g_ci += dbetai*df.grad(phi)
-        c_grad_g_c.append(c_grad_g_ci)
-
-    nu = ramp(phi, params["viscosity"])
-    veps = ramp(phi, params["permittivity"])
-    rho = ramp(phi, params["density"])
-
-    dveps = dramp(params["permittivity"])
-    drho = dramp(params["density"])
-
-    t = np.zeros(len(steps))
-
-    # Define the fluxes
-    fluxes = dict()
-    fluxes["Velocity"] = u
-    fluxes["Phase"] = phi*u
-    fluxes["Mass"] = rho*x_["u"]
-    if params["enable_PF"]:
-        fluxes["Phase"] += -M*df.grad(g)
-        fluxes["Mass"] += -drho*M*df.grad(g)
-
-    if params["enable_EC"]:
-        for i, solute in enumerate(solutes):
-            fluxes["Solute {}".format(solute[0])] = K[i]*c_grad_g_c[i]
-        fluxes["E-field"] = -df.grad(V)
-
-    data = dict()
-    for boundary_name in boundary_to_mark:
-        data[boundary_name] = dict()
-        for flux_name in fluxes:
-            data[boundary_name][flux_name] = np.zeros(len(steps))
-
-    n = df.FacetNormal(ts.mesh)
+            phi = x_["phi"]
+            g = x_["g"]
+            problem_module = importlib.import_module(
+                "problems.{}".format(problem))
+            M = problem_module.pf_mobility(phi, params["pf_mobility_coeff"])
+        else:
+            phi = 1.
+            g = df.Constant(0.)
+            M = df.Constant(0.)
+
+        solutes = params["solutes"]
+        c = []
+        c_grad_g_c = []
+        if params["enable_EC"]:
+            V = x_["V"]
+        else:
+            V = df.Constant(0.)
+
+        dbeta = []  # Diff. in beta
+        z = []  # Charge z[species]
+        K = []  # Diffusivity K[species]
+        beta = []  # Conc. jump func. beta[species]
+
+        for solute in solutes:
+            ci = x_[solute[0]]
+            dbetai = dramp([solute[4], solute[5]])
+            c.append(ci)
+            z.append(solute[1])
+            K.append(ramp(phi, [solute[2], solute[3]]))
+            beta.append(ramp(phi, [solute[4], solute[5]]))
+            dbeta.append(dbetai)
+            # THIS HAS NOT BEEN GENERALIZED!
+            c_grad_g_ci = df.grad(ci) + solute[1]*ci*df.grad(V)
+            if params["enable_PF"]:
+                c_grad_g_ci += dbetai*df.grad(phi)
+            c_grad_g_c.append(c_grad_g_ci)
+
+        rho = ramp(phi, params["density"])
+        drho = dramp(params["density"])
+
+        # Define the fluxes
+        fluxes = dict()
+        fluxes["Velocity"] = u
+        fluxes["Phase"] = phi*u
+        fluxes["Mass"] = rho*x_["u"]
+        if params["enable_PF"]:
+            fluxes["Phase"] += -M*df.grad(g)
+            fluxes["Mass"] += -drho*M*df.grad(g)
 
-    for i, step in enumerate(steps):
-        info("Step {} of {}".format(step, len(ts)))
+        if params["enable_EC"]:
+            for i, solute in enumerate(solutes):
+                fluxes["Solute {}".format(solute[0])] = K[i]*c_grad_g_c[i]
+            fluxes["E-field"] = -df.grad(V)
 
-        for field in x_:
-            ts.update(x_[field], field, step)
+        self.flux_keys = sorted(fluxes.keys())
 
+        # The functions in x_ are still zero, as required for the expansion.
+        self.functionals = dict()
         for boundary_name, (mark, k) in boundary_to_mark.items():
-            for flux_name, flux in fluxes.items():
-                data[boundary_name][flux_name][i] = df.assemble(
-                    df.dot(flux, n)*ds[k](mark))
-
-        t[i] = ts.times[step]
-
-    savedata = dict()
-    flux_keys = sorted(fluxes.keys())
-    for boundary_name in boundary_to_mark:
-        savedata[boundary_name] = np.array(
-            list(zip(steps, t, *[data[boundary_name][flux_name]
-                                 for flux_name in flux_keys])))
-
-    if rank == 0:
-        header = "Step\tTime\t"+"\t".join(flux_keys)
-        for boundary_name in boundary_to_mark:
-            with open(os.path.join(
-                    ts.analysis_folder,
-                    "flux_in_time_{}.dat".format(boundary_name)),
-                      "w") as outfile:
-                np.savetxt(outfile, savedata[boundary_name], header=header)
+            n = normals[boundary_name]
+            self.functionals[boundary_name] = [
+                QuadraticFunctional(facet_integrand(
+                    df.dot(fluxes[flux_name], n), ds[k])*ds[k](mark), x_)
+                for flux_name in self.flux_keys]
+        num_quadratic = sum([functional.is_quadratic
+                             for functionals in self.functionals.values()
+                             for functional in functionals])
+        info("Precomputed operators for {} of {} fluxes.".format(
+            num_quadratic, len(boundary_to_mark)*len(fluxes)))
+
+    def process(self, step):
+        return dict([(boundary_name, [functional()
+                                      for functional in functionals])
+                     for boundary_name, functionals
+                     in self.functionals.items()])
+
+    def tables(self, results):
+        steps = sorted(results.keys())
+        header = "Step\tTime\t"+"\t".join(self.flux_keys)
+        tables = dict()
+        for boundary_name in self.functionals:
+            data = np.array([[step, self.ts.times[step]]
+                             + results[step][boundary_name]
+                             for step in steps])
+            tables["flux_in_time_{}.dat".format(boundary_name)] = (
+                header, data)
+        return tables
+
+
+def analysis(ts, x_, **kwargs):
+    return FluxInTime(ts, x_, **kwargs)
+
+
+def method(ts, dt=0, extra_boundaries="", cross_sections="", **kwargs):
+    """ Plot flux in time. """
+    info_cyan("Plot flux in time.")
+    x_ = ts.functions()
+    run_analyses(ts, x_, [analysis(ts, x_, dt=dt,
+                                   extra_boundaries=extra_boundaries,
+                                   cross_sections=cross_sections,
+                                   **kwargs)])
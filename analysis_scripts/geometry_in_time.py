@@ -2,72 +2,83 @@ import dolfin as df
 from common import info, makedirs_safe, info_cyan, info_warning
 import os
 import numpy as np
-from utilities.plot import zero_level_set
-from postprocess import get_steps, path_length, rank
+from utilities.level_set import level_set_geometry, save_level_set
+from postprocess import index2letter, Analysis, run_analyses, rank
 
 
 def description(ts, **kwargs):
     info("Analyze geometry in time.")
 
 
-def method(ts, dt=0, **kwargs):
-    """ Analyze geometry in time."""
-
-    info_cyan("Analyzing the evolution of the geometry through time.")
+class GeometryInTime(Analysis):
+    def __init__(self, ts, x_, dt=0, **kwargs):
+        # Works directly on the nodal data; needs no fields in x_.
+        Analysis.__init__(self, ts, x_, dt=dt, fields=[])
 
-    if not ts.get_parameter("enable_PF"):
-        info_warning("Phase field not enabled.")
-        return False
-
-    f_mask = df.Function(ts.function_space)
-    f_mask_x = []
-    f_mask_u = []
-    for d in range(ts.dim):
-        f_mask_x.append(df.Function(ts.function_space))
-        f_mask_u.append(df.Function(ts.function_space))
-
-    length = np.zeros(len(ts))
-    area = np.zeros(len(ts))
-    com = np.zeros((len(ts), ts.dim))
-    u = np.zeros((len(ts), ts.dim))
-
-    makedirs_safe(os.path.join(ts.analysis_folder, "contour"))
-
-    steps = get_steps(ts, dt)
+        self.f_mask = df.Function(ts.function_space)
+        self.f_mask_x = []
+        self.f_mask_u = []
+        for d in range(ts.dim):
+            self.f_mask_x.append(df.Function(ts.function_space))
+            self.f_mask_u.append(df.Function(ts.function_space))
 
-    for step in steps:
-        info("Step " + str(step) + " of " + str(len(ts)))
+        makedirs_safe(os.path.join(ts.analysis_folder, "contour"))
 
+    def process(self, step):
+        ts = self.ts
         phi = ts["phi", step][:, 0]
         mask = 0.5*(1.-phi)  # 0.5*(1.-np.sign(phi))
-        ts.set_val(f_mask, mask)
+        ts.set_val(self.f_mask, mask)
         for d in range(ts.dim):
-            ts.set_val(f_mask_x[d], mask*ts.nodes[:, d])
-            ts.set_val(f_mask_u[d], mask*ts["u", step][:, d])
+            ts.set_val(self.f_mask_x[d], mask*ts.nodes[:, d])
+            ts.set_val(self.f_mask_u[d], mask*ts["u", step][:, d])
 
         contour_file = os.path.join(ts.analysis_folder, "contour",
                                     "contour_{:06d}.dat".format(step))
-        paths = zero_level_set(ts.nodes, ts.elems, phi,
-                               save_file=contour_file)
+        interface = level_set_geometry(ts.nodes, ts.elems, phi)
+        # The processes sharing the step extract the same interface
+        if ts.parallel_time or rank == 0:
+            save_level_set(contour_file, interface)
+
+        area = df.assemble(self.f_mask*df.dx)
+        com = [df.assemble(self.f_mask_x[d]*df.dx)/area
+               for d in range(ts.dim)]
+        u = [df.assemble(self.f_mask_u[d]*df.dx)/area
+             for d in range(ts.dim)]
+        return ([interface["measure"], area] + com + u
+                + [interface["volume"]])
+
+    def tables(self, results):
+        steps = sorted(results.keys())
+        data = np.array([[step, self.ts.times[step]] + results[step]
+                         for step in steps])
+        header = "\t".join(
+            ["Timestep", "Time", "Length", "Area"]
+            + ["CoM_" + index2letter(d) for d in range(self.ts.dim)]
+            + ["U_" + index2letter(d) for d in range(self.ts.dim)]
+            + ["Volume"])
+        return {"time_data.dat": (header, data)}
+
+
+def analysis(ts, x_, **kwargs):
+    if not ts.get_parameter("enable_PF"):
+        info_warning("Phase field not enabled.")
+        return None
+    return GeometryInTime(ts, x_, **kwargs)
 
-        length[step] = path_length(paths)
 
-        area[step] = df.assemble(f_mask*df.dx)
-        for d in range(ts.dim):
-            com[step, d] = df.assemble(f_mask_x[d]*df.dx)
-            u[step, d] = df.assemble(f_mask_u[d]*df.dx)
-
-    for d in range(ts.dim):
-        com[:, d] /= area
-        u[:, d] /= area
-
-    if rank == 0:
-        data = np.array(list(zip(np.arange(len(ts)), ts.times, length, area,
-                                 com[:, 0], com[:, 1], u[:, 0], u[:, 1])))
-        np.savetxt(os.path.join(ts.analysis_folder,
-                                "time_data.dat"),
-                   data,
-                   header=("Timestep\tTime\tLength\tArea\t"
-                           "CoM_x\tCoM_y\tU_x\tU_y"))
-
-        info("Stored.")
+def method(ts, dt=0, **kwargs):
+    """ Analyze geometry in time.
+
+    Length is that of the phase boundary (its area in 3D), extracted on the
+    mesh, and Volume is the exact volume of the region phi < 0. Area and the
+    centre of mass are integrals of the smooth mask (1-phi)/2.
+    """
+
+    info_cyan("Analyzing the evolution of the geometry through time.")
+
+    a = analysis(ts, None, dt=dt, **kwargs)
+    if a is None:
+        return False
+
+    run_analyses(ts, None, [a])
@@ -0,0 +1,191 @@
+""" interface_spectrum script """
+from common import info, info_cyan, info_warning
+import os
+import numpy as np
+from postprocess import rank, Analysis, run_analyses
+from utilities.level_set import extract_level_set
+
+
+def description(ts, **kwargs):
+    info("""Spectral analysis of the perturbations of a phase front.
+
+The front position x_f(y) (along axis, default x) is sampled at num_points
+transverse positions, from the interface extracted on the mesh
+(source=level_set) or from probe lines (source=probes). Its Fourier
+amplitudes are stored in time, and a growth rate is fitted for each
+wavenumber.""")
+
+
+def front_from_segments(points, segments, y, axis=0, front="max"):
+    """ Front position at the transverse positions y, i.e. the most advanced
+    (front=max) or least advanced (front=min) crossing of the interface
+    segments. NaN where there is no crossing. """
+    p = points[segments[:, 0]]
+    q = points[segments[:, 1]]
+    a = p[:, 1-axis, None]
+    b = q[:, 1-axis, None]
+    crossing = ((a-y)*(b-y) <= 0.) & (a != b)
+    s = (y-a)/np.where(a != b, b-a, 1.)
+    x = p[:, axis, None] + s*(q[:, axis, None]-p[:, axis, None])
+    if front == "max":
+        x_f = np.where(crossing, x, -np.inf).max(axis=0)
+    else:
+        x_f = np.where(crossing, x, np.inf).min(axis=0)
+    x_f[np.isinf(x_f)] = np.nan
+    return x_f
+
+
+def front_from_lines(phi, x, front="max"):
+    """ Front position from phi sampled along lines (..., points) at the
+    positions x, by linear interpolation at the last (front=max) or first
+    (front=min) sign change. NaN where there is none. """
+    change = (phi[..., :-1] > 0.) != (phi[..., 1:] > 0.)
+    if front == "max":
+        i = change.shape[-1]-1-np.argmax(change[..., ::-1], axis=-1)
+    else:
+        i = np.argmax(change, axis=-1)
+    phi_a = np.take_along_axis(phi, i[..., None], axis=-1)[..., 0]
+    phi_b = np.take_along_axis(phi, i[..., None]+1, axis=-1)[..., 0]
+    x_f = x[i] + (x[i+1]-x[i])*phi_a/np.where(phi_a != phi_b,
+                                                phi_a-phi_b, 1.)
+    x_f[~change.any(axis=-1)] = np.nan
+    return x_f
+
+
+def fourier_amplitudes(x_f):
+    """ Mean and amplitudes of the modes 1, 2, ... of the fronts (steps,
+    points), with a single FFT over all steps. """
+    x_hat = np.fft.rfft(x_f, axis=-1)/x_f.shape[-1]
+    return np.real(x_hat[:, 0]), 2*np.abs(x_hat[:, 1:])
+
+
+def growth_rates(t, amplitudes):
+    """ Exponential growth rate and initial amplitude of each mode, fitted
+    to the amplitudes (steps, modes) in a single least squares solve. """
+    log_amplitudes = np.log(np.maximum(amplitudes, 1e-300))
+    rate, log_initial = np.polyfit(t, log_amplitudes, 1)
+    return rate, np.exp(log_initial)
+
+
+class InterfaceSpectrum(Analysis):
+    def __init__(self, ts, x_, dt=0, axis=0, num_points=128,
+                 resolution=512, source="level_set", front="max",
+                 fit_start=None, fit_end=None, **kwargs):
+        # Works directly on the nodal data; needs no fields in x_.
+        Analysis.__init__(self, ts, x_, dt=dt, fields=[], axis=axis,
+                          num_points=num_points, resolution=resolution,
+                          source=source, front=front)
+        self.axis = axis
+        self.source = source
+        self.front = front
+        self.fit_start = fit_start
+        self.fit_end = fit_end
+
+        nodes = ts.nodes[:, :ts.dim]
+        y_min = nodes[:, 1-axis].min()
+        self.length = nodes[:, 1-axis].max()-y_min
+        # Uniform samples, as for a periodic front.
+        self.y = y_min + (np.arange(num_points)+0.5)*self.length/num_points
+        if source == "probes":
+            x_min = nodes[:, axis].min()
+            x_max = nodes[:, axis].max()
+            self.x_line = np.linspace(x_min, x_max, resolution)
+            x = np.zeros((num_points, resolution, 2))
+            x[:, :, axis] = self.x_line[None, :]
+            x[:, :, 1-axis] = self.y[:, None]
+            self.x_probes = x.reshape(-1, 2)
+
+    def process(self, step):
+        if self.source == "probes":
+            # The probe points are located once; each step is a sparse
+            # product.
+            phi = self.ts.probe(self.x_probes, fields=["phi"],
+                                steps=[step])["phi"][0, :, 0]
+            return front_from_lines(phi.reshape(len(self.y), -1),
+                                    self.x_line, self.front)
+        points, segments = extract_level_set(
+            self.ts.nodes, self.ts.elems, self.ts["phi", step][:, 0])
+        return front_from_segments(points, segments, self.y,
+                                   self.axis, self.front)
+
+    def tables(self, results):
+        steps = sorted(results.keys())
+        if rank != 0 or len(steps) == 0:
+            return dict()
+        ts = self.ts
+        x_f = np.array([results[step] for step in steps])
+        if np.isnan(x_f).any():
+            info_warning("The front is missing at some positions; "
+                         "using the mean there.")
+            mean = np.nanmean(x_f, axis=1)
+            x_f = np.where(np.isnan(x_f), mean[:, None], x_f)
+
+        mean, amplitudes = fourier_amplitudes(x_f)
+        times = np.array([ts.times[step] for step in steps])
+        num_modes = amplitudes.shape[1]
+        mode_keys = ["A_{}".format(m) for m in range(1, num_modes+1)]
+        self.fit(steps, times, amplitudes)
+
+        return {"front_position.dat": (
+                    "\t".join(["Timestep", "Time"] +
+                              ["{:.6g}".format(y) for y in self.y]),
+                    np.hstack((np.array(steps)[:, None], times[:, None],
+                               x_f))),
+                "interface_spectrum.dat": (
+                    "\t".join(["Timestep", "Time", "Mean"] + mode_keys),
+                    np.hstack((np.array(steps)[:, None], times[:, None],
+                               mean[:, None], amplitudes)))}
+
+    def fit(self, steps, times, amplitudes):
+        """ Fit and store growth rates, including the amplitudes stored
+        by a previous (incremental) run. """
+        spectrum_file = os.path.join(self.ts.analysis_folder,
+                                     "interface_spectrum.dat")
+        if os.path.exists(spectrum_file):
+            previous = np.loadtxt(spectrum_file, ndmin=2)
+            previous = previous[previous[:, 0] < steps[0]]
+            if previous.shape[1] == 3+amplitudes.shape[1]:
+                times = np.concatenate((previous[:, 1], times))
+                amplitudes = np.vstack((previous[:, 3:], amplitudes))
+        window = np.ones(len(times), dtype=bool)
+        if self.fit_start is not None:
+            window &= times >= self.fit_start
+        if self.fit_end is not None:
+            window &= times <= self.fit_end
+        if window.sum() < 2:
+            info_warning("Too few steps to fit growth rates.")
+            return
+        rate, initial = growth_rates(times[window], amplitudes[window])
+        modes = np.arange(1, amplitudes.shape[1]+1)
+        np.savetxt(os.path.join(self.ts.analysis_folder, "growth_rates.dat"),
+                   np.vstack((modes, 2*np.pi*modes/self.length,
+                              rate, initial)).T,
+                   header="Mode\tWavenumber\tGrowth_rate\tAmplitude_0")
+
+
+def analysis(ts, x_, **kwargs):
+    if not ts.get_parameter("enable_PF"):
+        info_warning("Phase field not enabled.")
+        return None
+    if ts.dim != 2:
+        info_warning("The interface spectrum is only implemented in 2D.")
+        return None
+    return InterfaceSpectrum(ts, x_, **kwargs)
+
+
+def method(ts, dt=0, **kwargs):
+    """ Spectral analysis of the perturbations of a phase front.
+
+    Options: axis (of propagation, default 0), num_points (transverse
+    samples), source (level_set or probes), resolution (points per probe
+    line), front (max or min, for multivalued fronts), fit_start and
+    fit_end (time window of the growth rate fit). Stores
+    front_position.dat, interface_spectrum.dat and growth_rates.dat.
+    """
+    info_cyan("Spectral analysis of the phase front.")
+
+    a = analysis(ts, None, dt=dt, **kwargs)
+    if a is None:
+        return False
+
+    run_analyses(ts, None, [a])
@@ -1,79 +1,109 @@
 """ line_probe script """
 from common import info, info_cyan, info_on_red, makedirs_safe
 import numpy as np
-from postprocess import get_steps, index2letter, rank
+from postprocess import index2letter, rank, Analysis, run_analyses
 from utilities.plot import plot_probes
 import os
-from utilities.generate_mesh import line_points
+from utilities.interpolation import line_points, plane_points
 
 
 def description(ts, **kwargs):
-    info("Probe along a line.")
+    info("Probe along a line, in a plane or at given points.")
 
 
-def method(ts, dx=0.1, line="[0.,0.]--[1.,1.]", time=None, dt=None,
-           skip=0, **kwargs):
-    """ Probe along a line. """
-    info_cyan("Probe along a line.")
+def parse_points(ts, pts):
+    """ Parse a list of points specified as '[x1,y1]--[x2,y2]--...'. """
     try:
-        x_a, x_b = [tuple(eval(pt)) for pt in line.split("--")]
-        assert(len(x_a) == ts.dim)
-        assert(len(x_b) == ts.dim)
+        x = [tuple(eval(pt)) for pt in pts.split("--")]
+        assert(all([len(x_i) == ts.dim for x_i in x]))
         assert(all([bool(isinstance(xd, float) or
                          isinstance(xd, int))
-                    for xd in list(x_a)+list(x_b)]))
+                    for x_i in x for xd in x_i]))
     except:
-        info_on_red("Faulty line format. Use 'line=[x1,y1]--[x2,y2]'.")
-        exit()
+        return None
+    return x
 
-    x = np.array(line_points(x_a, x_b, dx))
 
-    info("Probes {num} points from {a} to {b}".format(
-        num=len(x), a=x_a, b=x_b))
+def get_probe_points(ts, dx, line, plane, points):
+    """ Probe points from a line '[x1,y1]--[x2,y2]', a plane spanned by
+    three corners '[x1,y1,z1]--[x2,y2,z2]--[x3,y3,z3]', or a text file of
+    point coordinates. """
+    if points:
+        x = np.loadtxt(points, ndmin=2)[:, :ts.dim]
+        info("Probes {num} points from {f}".format(num=len(x), f=points))
+    elif plane:
+        corners = parse_points(ts, plane)
+        if corners is None or len(corners) != 3:
+            info_on_red("Faulty plane format. Use "
+                        "'plane=[x1,y1,z1]--[x2,y2,z2]--[x3,y3,z3]'.")
+            exit()
+        x = plane_points(corners[0], corners[1], corners[2], dx)
+        info("Probes {num} points in plane through {a}, {b} and {c}".format(
+            num=len(x), a=corners[0], b=corners[1], c=corners[2]))
+    else:
+        ends = parse_points(ts, line)
+        if ends is None or len(ends) != 2:
+            info_on_red("Faulty line format. Use 'line=[x1,y1]--[x2,y2]'.")
+            exit()
+        x = line_points(ends[0], ends[1], dx)
+        info("Probes {num} points from {a} to {b}".format(
+            num=len(x), a=ends[0], b=ends[1]))
+    return x
 
-    if rank == 0:
-        plot_probes(ts.nodes, ts.elems, x,
-                    colorbar=False, title="Probes")
 
-    f = ts.functions()
-    probes = dict()
-    from fenicstools import Probes
-    for field, func in f.items():
-        probes[field] = Probes(x.flatten(), func.function_space())
-
-    steps = get_steps(ts, dt, time)
-
-    for step in steps:
-        info("Step " + str(step) + " of " + str(len(ts)))
-        ts.update_all(f, step)
-        for field, probe in probes.items():
-            probe(f[field])
-
-    probe_arr = dict()
-    for field, probe in probes.items():
-        probe_arr[field] = probe.array()
-
-    if rank == 0:
-        for i, step in enumerate(steps):
-            chunks = [x]
-            header_list = [index2letter(d) for d in range(ts.dim)]
-            for field, chunk in probe_arr.items():
-                if chunk.ndim == 1:
-                    header_list.append(field)
-                    chunk = chunk[:].reshape(-1, 1)
-                elif chunk.ndim == 2:
-                    header_list.append(field)
-                    chunk = chunk[:, i].reshape(-1, 1)
-                elif chunk.ndim > 2:
-                    header_list.extend(
-                        [field + "_" + index2letter(d)
-                         for d in range(ts.dim)])
-                    chunk = chunk[:, :, i]
-                chunks.append(chunk)
-
-            data = np.hstack(chunks)
-            header = "\t".join(header_list)
-            makedirs_safe(os.path.join(ts.analysis_folder, "probes"))
+class LineProbe(Analysis):
+    def __init__(self, ts, x_, x, dt=None, time=None, **kwargs):
+        # Probes the stored nodal data directly; needs no fields in x_.
+        Analysis.__init__(self, ts, x_, dt=dt, time=time, fields=[],
+                          x=x.tolist())
+        self.x = x
+
+    def process(self, step):
+        # The points are located once; each step is a sparse product.
+        probes = self.ts.probe(self.x, steps=[step])
+        return dict([(field, probes[field][0]) for field in self.ts.fields])
+
+    def tables(self, results):
+        steps = sorted(results.keys())
+        if rank != 0 or len(steps) == 0:
+            return dict()
+        ts = self.ts
+        makedirs_safe(os.path.join(ts.analysis_folder, "probes"))
+
+        header_list = [index2letter(d) for d in range(ts.dim)]
+        for field in ts.fields:
+            num_comps = results[steps[0]][field].shape[1]
+            if num_comps == 1:
+                header_list.append(field)
+            else:
+                header_list.extend(
+                    [field + "_" + index2letter(d)
+                     for d in range(num_comps)])
+        header = "\t".join(header_list)
+
+        for step in steps:
             np.savetxt(os.path.join(ts.analysis_folder, "probes",
                                     "probes_{:06d}.dat".format(step)),
-                       data, header=header)
+                       np.hstack([self.x] + [results[step][field]
+                                             for field in ts.fields]),
+                       header=header)
+        return dict()
+
+
+def analysis(ts, x_, dx=0.1, line="[0.,0.]--[1.,1.]", plane=None,
+             points=None, **kwargs):
+    return LineProbe(ts, x_, get_probe_points(ts, dx, line, plane, points),
+                     **kwargs)
+
+
+def method(ts, dx=0.1, line="[0.,0.]--[1.,1.]", plane=None, points=None,
+           time=None, dt=None, skip=0, **kwargs):
+    """ Probe along a line, in a plane or at given points. """
+    info_cyan("Probe along a line, in a plane or at given points.")
+    x = get_probe_points(ts, dx, line, plane, points)
+
+    if rank == 0 and ts.dim == 2:
+        plot_probes(ts.nodes, ts.elems, x,
+                    colorbar=False, title="Probes")
+
+    run_analyses(ts, None, [LineProbe(ts, None, x, dt=dt, time=time)])
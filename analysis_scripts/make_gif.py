@@ -1,58 +1,123 @@
 """ make_gif script """
-from common import info, info_cyan
+from common import info, info_cyan, info_on_red, makedirs_safe
 from postprocess import get_steps, rank, size, comm
 import os
-from utilities.plot import plot_fancy
+from utilities.plot import plot_fancy, FancyPlotter, AnimationWriter, \
+    init_plotter, render_frame, save_image, ffmpeg_available
+from utilities.raster import RasterRenderer
 import numpy as np
+from mpi4py import MPI
+from multiprocessing import Pool
 
 
 def description(ts, **kwargs):
     info("Make a fancy gif animation.")
 
 
+def get_frame_data(ts, step, plot_u=False, inverse_phase=False):
+    """ Returns phi, charge and u at step, as needed by plot_fancy. """
+    if "phi" in ts:
+        phi = ts["phi", step][:, 0]
+    else:
+        phi = np.zeros(len(ts.nodes))-1.
+    if inverse_phase:
+        phi = -phi
+    if "charge" in ts:
+        charge = ts["charge", step][:, 0]
+    else:
+        charge = np.zeros(len(ts.nodes))
+    if plot_u and "u" in ts:
+        u = ts["u", step]
+    else:
+        u = None
+    return phi, charge, u
+
+
 def method(ts, show=False, save=True, dt=None, fps=25, skip=0,
-           delete_after=True, plot_u=False, inverse_phase=False, **kwargs):
-    """ Make fancy gif animation. """
+           plot_u=False, inverse_phase=False, procs=1, format="gif",
+           renderer="fancy", resolution=800, frames=False, **kwargs):
+    """ Make fancy gif (or mp4) animation.
+
+    With renderer=raster, frames are rendered by precomputed pixel maps
+    (with the given resolution in pixels), which is much faster for large
+    meshes but draws no streamlines. With frames=True, every frame is also
+    stored as an image file. Saving the animation needs ffmpeg.
+    """
     info_cyan("Making a fancy gif animation.")
     anim_name = "animation"
-    ts.compute_charge()
+
+    if save and not show and not ffmpeg_available():
+        info_on_red("ffmpeg was not found. It is needed to encode the "
+                    "animation; install it and make sure it is on the PATH.")
+        return False
 
     steps = get_steps(ts, dt)[::(skip+1)]
 
-    for step in steps[rank::size]:
+    def frame_data(step):
         info("Step " + str(step) + " of " + str(len(ts)))
-        if "phi" in ts:
-            phi = ts["phi", step][:, 0]
-        else:
-            phi = np.zeros(len(ts.nodes))-1.
-        if inverse_phase:
-            phi = -phi
-        charge = ts["charge", step][:, 0]
-        charge_max = max(ts.max("charge"), -ts.min("charge"))
-        charge_max = max(charge_max, 1e-8)  # Remove numerical noise
-        if plot_u and "u" in ts:
-            u = ts["u", step]
-        else:
-            u = None
-
-        if save:
-            save_file = os.path.join(ts.tmp_folder,
-                                     anim_name + "_{:06d}.png".format(step))
-        else:
-            save_file = None
-
-        plot_fancy(ts.nodes, ts.elems, phi, charge,
-                   charge_max=charge_max, show=show, u=u,
-                   save=save_file)
-
-    comm.Barrier()
-    if save and rank == 0:
-        tmp_files = os.path.join(ts.tmp_folder, anim_name + "_*.png")
-        anim_file = os.path.join(ts.plots_folder, anim_name + ".gif")
-
-        os.system(("convert -delay {delay} {tmp_files} -trim +repage"
-                   " -loop 0 {anim_file}").
-                  format(tmp_files=tmp_files,
-                         anim_file=anim_file, delay=int(100./fps)))
-        if delete_after:
-            os.system("rm {tmp_files}".format(tmp_files=tmp_files))
+        return get_frame_data(ts, step, plot_u, inverse_phase)
+
+    # Colour limits are common to all frames.
+    charge_max = 1e-8  # Remove numerical noise
+    if "charge" in ts:
+        for step in steps[rank::size]:
+            charge_max = max(charge_max, np.abs(ts["charge", step]).max())
+        charge_max = comm.allreduce(charge_max, op=MPI.MAX)
+
+    if show:
+        for step in steps[rank::size]:
+            phi, charge, u = frame_data(step)
+            plot_fancy(ts.nodes, ts.elems, phi, charge,
+                       charge_max=charge_max, show=show, u=u)
+        return
+
+    if not save:
+        return
+
+    if renderer == "raster":
+        plotter_args = (RasterRenderer, ts.nodes, ts.elems, charge_max,
+                        resolution, ts.tmp_folder)
+    else:
+        plotter_args = (FancyPlotter, ts.nodes, ts.elems, charge_max)
+    anim_file = os.path.join(ts.plots_folder, anim_name + "." + format)
+    frames_folder = os.path.join(ts.plots_folder, anim_name)
+    if frames:
+        makedirs_safe(frames_folder)
+    if rank == 0:
+        writer = AnimationWriter(anim_file, fps=fps)
+
+    def write(step, frame):
+        writer.write(frame)
+        if frames:
+            save_image(os.path.join(frames_folder,
+                                    "frame_{:06d}.png".format(step)), frame)
+
+    if size > 1:
+        # Each process renders every size-th frame; rank 0 writes them in
+        # order.
+        plotter = plotter_args[0](*plotter_args[1:])
+        for i in range(0, len(steps), size):
+            steps_i = steps[i:i+size]
+            frame = None
+            if rank < len(steps_i):
+                frame = plotter.render(*frame_data(steps_i[rank]))
+            frames_i = comm.gather(frame, root=0)
+            if rank == 0:
+                for step, frame in zip(steps_i, frames_i):
+                    write(step, frame)
+    elif procs > 1:
+        pool = Pool(procs, initializer=init_plotter,
+                    initargs=plotter_args)
+        for step, frame in zip(steps, pool.imap(
+                render_frame, (frame_data(step) for step in steps))):
+            write(step, frame)
+        pool.close()
+        pool.join()
+    else:
+        plotter = plotter_args[0](*plotter_args[1:])
+        for step in steps:
+            write(step, plotter.render(*frame_data(step)))
+
+    if rank == 0:
+        writer.close()
+        info("Saved to " + anim_file)
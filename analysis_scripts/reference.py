@@ -2,24 +2,63 @@
 from common import info, info_split, info_on_red, info_cyan
 from utilities.TimeSeries import TimeSeries
 import os
-from postprocess import rank, compute_norms
-import dolfin as df
+from postprocess import rank, output_norms, nodal_norms
+import numpy as np
 from utilities.plot import plot_any_field
+from utilities.interpolation import mass_stiffness_matrices
 
 
 def description(ts, **kwargs):
-    info("""Compare to numerical reference at given timestep.
-
-The reference solution is assumed to be on a finer mesh, so the reference
-solution is interpolated to the coarser mesh, where the comparison is made.""")
+    info("""Compare to numerical reference at given timestep(s).
+
+The solution is interpolated to the mesh of the reference (assumed to be
+finer), where the comparison is made. Several times can be given as a list,
+time=[t1,t2,...].""")
+
+
+def error_norms(ts, ts_ref, times):
+    """ Error norms of ts compared to ts_ref at the given times, on the mesh
+    of the reference. Returns dicts from field to the norms (norm type to
+    an array over times) and to the nodal errors (nodes, times,
+    components). """
+    steps = []
+    steps_ref = []
+    for time in times:
+        step, time_0 = ts.get_nearest_step_and_time(time)
+        step_ref, time_ref = ts_ref.get_nearest_step_and_time(
+            time, dataset_str="reference")
+        info("Dataset:   Time = {}, timestep = {}.".format(time_0, step))
+        info("Reference: Time = {}, timestep = {}.".format(time_ref,
+                                                           step_ref))
+        steps.append(step)
+        steps_ref.append(step_ref)
+
+    # Interpolation from the mesh of the solution to the reference mesh
+    P = ts.transfer_operator(ts_ref)
+    M, K = mass_stiffness_matrices(ts_ref.nodes, ts_ref.elems)
+
+    norms = dict()
+    errs = dict()
+    for field in ts_ref.fields:
+        if field not in ts:
+            continue
+        num_comps = ts.dim if field == "u" else 1
+        data = np.stack([ts[field, step][:, :num_comps]
+                         for step in steps], axis=1)
+        data_ref = np.stack([ts_ref[field, step_ref][:, :num_comps]
+                             for step_ref in steps_ref], axis=1)
+        errs[field] = (P*data.reshape(len(ts.nodes), -1)).reshape(
+            data_ref.shape) - data_ref
+        norms[field] = nodal_norms(errs[field], M, K)
+    return norms, errs
 
 
 def method(ts, ref=None, time=1., show=False, save_fig=False, **kwargs):
-    """Compare to numerical reference at given timestep.
+    """Compare to numerical reference at given timestep(s).
 
-    The reference solution is assumed to be on a finer mesh, so the
-    reference solution is interpolated to the coarser mesh, where the
-    comparison is made.
+    The solution is interpolated to the mesh of the reference, where the
+    comparison is made. The interpolation matrix is stored and reused, and
+    the errors at all given times are computed at once.
     """
     info_cyan("Comparing to numerical reference.")
     if not isinstance(ref, str):
@@ -34,47 +73,30 @@ def method(ts, ref=None, time=1., show=False, save_fig=False, **kwargs):
                              os.path.join(ts.folder, "../")).replace(
                                  "../", "-").replace("/", "+")
 
-    step, time_0 = ts.get_nearest_step_and_time(time)
-
-    step_ref, time_ref = ts_ref.get_nearest_step_and_time(
-        time, dataset_str="reference")
-
-    info("Dataset:   Time = {}, timestep = {}.".format(time_0, step))
-    info("Reference: Time = {}, timestep = {}.".format(time_ref, step_ref))
-
-    # from fenicstools import interpolate_nonmatching_mesh
-
-    f = ts.functions()
-    f_ref = ts_ref.functions()
-    err = ts_ref.functions()
+    times = time if isinstance(time, list) else [time]
+    norms, errs = error_norms(ts, ts_ref, times)
 
-    ts.update_all(f, step=step)
-    ts_ref.update_all(f_ref, step=step_ref)
-
-    for field in ts_ref.fields:
-        # Interpolate solution to the reference mesh.
-        f_int = df.interpolate(
-            f[field], err[field].function_space())
-
-        err[field].vector().set_local(
-            f_int.vector().get_local() - f_ref[field].vector().get_local())
-
-        if show or save_fig:
-            err_arr = ts_ref.nodal_values(err[field])
-            label = "Error in " + field
-
-            if rank == 0:
+    if rank == 0 and (show or save_fig):
+        for field, err in errs.items():
+            for i, time in enumerate(times):
+                label = "Error in " + field
                 save_fig_file = None
                 if save_fig:
                     save_fig_file = os.path.join(
                         ts.plots_folder, "error_{}_time{}_ref{}.png".format(
                             field, time, ref_id))
 
-                plot_any_field(ts_ref.nodes, ts_ref.elems, err_arr,
+                plot_any_field(ts_ref.nodes, ts_ref.elems, err[:, i, :],
                                save=save_fig_file, show=show, label=label)
 
-    save_file = os.path.join(ts.analysis_folder,
-                             "errornorms_time{}_ref{}.dat".format(
-                                 time, ref_id))
-
-    compute_norms(err, save=save_file)
+    vector_norms = ["l2", "linf"]
+    function_norms = ["L2", "H1"]
+    headers = ["Fields"] + vector_norms + function_norms
+    for i, time in enumerate(times):
+        table = [[field] + [norms[field][norm_type][i]
+                            for norm_type in vector_norms + function_norms]
+                 for field in sorted(norms.keys())]
+        save_file = os.path.join(ts.analysis_folder,
+                                 "errornorms_time{}_ref{}.dat".format(
+                                     time, ref_id))
+        output_norms(table, headers, save=save_file)
@@ -1,60 +1,50 @@
 """ energy_in_time script """
 from common import info, info_cyan
-from postprocess import get_steps, rank
+from postprocess import Analysis, run_analyses
 import numpy as np
 import dolfin as df
-import os
 
 
 def description(ts, **kwargs):
     info("Plot mean field values in time.")
 
 
-def method(ts, dt=0, **kwargs):
-    """ Plot mean field values in time. """
-    info_cyan("Plot mean field values in time.")
-
-    params = ts.get_parameters()
-    steps = get_steps(ts, dt)
+class ValueInTime(Analysis):
+    def __init__(self, ts, x_, dt=0, **kwargs):
+        Analysis.__init__(self, ts, x_, dt=dt)
 
-    problem = params["problem"]
-    info("Problem: {}".format(problem))
-
-    t = np.zeros(len(steps))
-
-    x_ = ts.functions()
+        params = ts.get_parameters()
 
-    fields = dict()
-    for field, f in x_.items():
-        if field == "u":
-            fields["u_x"] = f[0]
-            fields["u_y"] = f[1]
-        else:
-            fields[field] = f
+        problem = params["problem"]
+        info("Problem: {}".format(problem))
 
-    data = dict()
+        self.fields_mean = dict()
+        for field, f in x_.items():
+            if field == "u":
+                self.fields_mean["u_x"] = f[0]
+                self.fields_mean["u_y"] = f[1]
+            else:
+                self.fields_mean[field] = f
+        self.field_keys = sorted(self.fields_mean.keys())
 
-    for field in fields:
-        data[field] = np.zeros(len(steps))
+    def process(self, step):
+        return [df.assemble(self.fields_mean[field]*df.dx)
+                for field in self.field_keys]
 
-    for i, step in enumerate(steps):
-        info("Step {} of {}".format(step, len(ts)))
+    def tables(self, results):
+        steps = sorted(results.keys())
+        data = np.array([[step, self.ts.times[step]] + results[step]
+                         for step in steps])
+        header = "Step\tTime\t"+"\t".join(self.field_keys)
+        return {"value_in_time.dat": (header, data)}
 
-        for field in x_.keys():
-            ts.update(x_[field], field, step)
 
-        for field, f in fields.items():
-            data[field][i] = df.assemble(f*df.dx)
+def analysis(ts, x_, **kwargs):
+    return ValueInTime(ts, x_, **kwargs)
 
-        t[i] = ts.times[step]
 
-    field_keys = sorted(fields.keys())
-
-    savedata = np.array(
-        list(zip(steps, t, *[data[field] for field in field_keys])))
-
-    if rank == 0:
-        header = "Step\tTime\t"+"\t".join(field_keys)
-        with open(os.path.join(ts.analysis_folder, "value_in_time.dat"),
-                  "w") as outfile:
-            np.savetxt(outfile, savedata, header=header)
+def method(ts, dt=0, **kwargs):
+    """ Plot mean field values in time. """
+    info_cyan("Plot mean field values in time.")
+    x_ = ts.functions()
+    run_analyses(ts, x_, [analysis(ts, x_, dt=dt, **kwargs)])
@@ -0,0 +1,137 @@
+"""
+Interface-adaptive meshes.
+
+Every adapt_intv timesteps, the mesh is rebuilt by refining the base mesh
+(the mesh given by the problem) up to adapt_levels times, marking the cells
+where the diffuse interface or steep concentration gradients are, or where
+a residual indicator (the jumps of the normal gradients of phi and the
+concentrations across the facets) is large. Since
+the refinement always starts from the base mesh, regions that are no
+longer marked are coarsened. The solution is then interpolated to the new
+mesh, and the function spaces, boundary conditions and solvers are rebuilt.
+"""
+import numpy as np
+import dolfin as df
+from .cmd import info_cyan
+from .discretization import rebuild_on_mesh
+
+__all__ = ["residual_indicators", "refinement_markers", "adapted_mesh",
+           "adapt_mesh"]
+
+
+def cell_gradient_norms(mesh, values):
+    """ Norm of the gradient in each cell of a P1 field given by its
+    vertex values. """
+    dim = mesh.topology().dim()
+    x = mesh.coordinates()[mesh.cells()][:, :, :dim]
+    v = values[mesh.cells()]
+    jacobian = x[:, 1:, :]-x[:, :1, :]
+    grad = np.linalg.solve(jacobian, (v[:, 1:]-v[:, :1])[:, :, None])
+    return np.linalg.norm(grad[:, :, 0], axis=1)
+
+
+def residual_indicators(f):
+    """ Residual indicator of a P1 field on each cell: the jumps of the
+    normal gradient across the facets of the cell, scaled by the cell
+    size. """
+    mesh = f.function_space().mesh()
+    DG0 = df.FunctionSpace(mesh, "DG", 0)
+    w = df.TestFunction(DG0)
+    h = df.CellDiameter(mesh)
+    n = df.FacetNormal(mesh)
+    eta2 = df.assemble(2*df.avg(w)*df.avg(h)*df.jump(df.grad(f), n)**2*df.dS)
+    dofmap = DG0.dofmap()
+    cell_dofs = np.array([dofmap.cell_dofs(cell)[0]
+                          for cell in range(mesh.num_cells())], dtype=int)
+    return np.sqrt(np.maximum(eta2.get_local()[cell_dofs], 0.))
+
+
+def refinement_markers(mesh, phi=None, solutes=[], phi_threshold=0.9,
+                       grad_c_threshold=None, residual_fraction=None):
+    """ Mark the cells in the diffuse interface, i.e. those with a vertex
+    where |phi| < phi_threshold or where phi changes sign, those where
+    the gradient of any of the solutes exceeds grad_c_threshold, and those
+    where the residual indicator of phi or any of the solutes exceeds
+    residual_fraction times its maximum. """
+    marked = np.zeros(mesh.num_cells(), dtype=bool)
+    if phi is not None:
+        phi_v = phi.compute_vertex_values(mesh)[mesh.cells()]
+        marked |= np.abs(phi_v).min(axis=1) < phi_threshold
+        marked |= (phi_v.max(axis=1) > 0.) & (phi_v.min(axis=1) < 0.)
+    if grad_c_threshold is not None:
+        for c in solutes:
+            marked |= cell_gradient_norms(
+                mesh, c.compute_vertex_values(mesh)) > grad_c_threshold
+    if residual_fraction is not None:
+        for f in [phi] + list(solutes):
+            if f is None:
+                continue
+            eta = residual_indicators(f)
+            eta_max = df.MPI.max(mesh.mpi_comm(),
+                                 float(eta.max()) if len(eta) else 0.)
+            marked |= eta > residual_fraction*eta_max
+    markers = df.MeshFunction("bool", mesh, mesh.topology().dim())
+    markers.array()[:] = marked
+    return markers
+
+
+def adapted_mesh(base_mesh, phi=None, solutes=[], levels=1,
+                 phi_threshold=0.9, grad_c_threshold=None,
+                 residual_fraction=None):
+    """ Refine base_mesh where the fields phi and solutes (given on any
+    mesh) are marked, up to levels times. """
+    mesh = base_mesh
+    for level in range(levels):
+        V = df.FunctionSpace(mesh, "CG", 1)
+        fields = []
+        for f in [phi] + list(solutes):
+            if f is None:
+                fields.append(None)
+                continue
+            f_level = df.Function(V)
+            df.LagrangeInterpolator.interpolate(f_level, f)
+            fields.append(f_level)
+        markers = refinement_markers(mesh, fields[0], fields[1:],
+                                     phi_threshold, grad_c_threshold,
+                                     residual_fraction)
+        if df.MPI.sum(mesh.mpi_comm(), float(markers.array().sum())) == 0:
+            break
+        mesh = df.refine(mesh, markers)
+    return mesh
+
+
+def collapsed_field(w_, field_to_subproblem, field):
+    """ A copy of a field in its own (collapsed) function space. """
+    name, i = field_to_subproblem[field]
+    if i == -1:
+        return w_[name]
+    return w_[name].split(deepcopy=True)[i]
+
+
+def adapt_mesh(base_mesh, mesh, w_, field_to_subproblem, solutes,
+               adapt_levels, adapt_phi_threshold, adapt_grad_c,
+               enable_PF, enable_EC, adapt_residual=None, **namespace):
+    """ Adapt the mesh to the current solution, and rebuild everything that
+    depends on it. Returns the updated namespace. """
+    phi = None
+    if enable_PF:
+        phi = collapsed_field(w_, field_to_subproblem, "phi")
+    c = []
+    if enable_EC and (adapt_grad_c is not None or
+                      adapt_residual is not None):
+        c = [collapsed_field(w_, field_to_subproblem, solute[0])
+             for solute in solutes]
+    mesh_new = adapted_mesh(base_mesh, phi, c, adapt_levels,
+                            adapt_phi_threshold, adapt_grad_c,
+                            adapt_residual)
+    info_cyan("Adapted mesh: {} cells (was {}).".format(
+        int(df.MPI.sum(mesh.mpi_comm(), float(mesh_new.num_cells()))),
+        int(df.MPI.sum(mesh.mpi_comm(), float(mesh.num_cells())))))
+
+    return rebuild_on_mesh(
+        mesh_new, w_, base_mesh=base_mesh,
+        field_to_subproblem=field_to_subproblem, solutes=solutes,
+        adapt_levels=adapt_levels, adapt_phi_threshold=adapt_phi_threshold,
+        adapt_grad_c=adapt_grad_c, adapt_residual=adapt_residual,
+        enable_PF=enable_PF, enable_EC=enable_EC,
+        **namespace)
@@ -45,6 +45,29 @@ class NoSlip(Fixed):
         Fixed.__init__(self, (0., 0.))  # To be generalized for arbitrary dim.
 
 
+class LabFixed(Fixed):
+    """ Velocity fixed in the lab frame, e.g. a wall at rest. In a frame
+    moving at the comoving velocity U, the imposed value is value - U. """
+    def __init__(self, value):
+        self.lab_value = np.array(value, dtype=float)
+        Fixed.__init__(self, tuple(self.lab_value))
+
+    def set_frame_velocity(self, velocity):
+        frame_velocity = np.array(velocity[:len(self.lab_value)],
+                                  dtype=float)
+        self.value.assign(Constant(tuple(self.lab_value-frame_velocity)))
+
+
+def set_frame_velocity(bcs, velocity):
+    """ Impose the lab-frame boundary conditions (LabFixed) in the frame
+    moving at velocity. The constants are assigned in place, so the
+    DirichletBCs made from them follow. """
+    for bcs_fields in bcs.values():
+        for bc in bcs_fields.values():
+            if isinstance(bc, LabFixed):
+                bc.set_frame_velocity(velocity)
+
+
 class FreeSlip(GenericBC):
     # Class for implementing free slip in a certain direction
     def __init__(self, value, dim):
@@ -0,0 +1,257 @@
+"""
+Function spaces, functions and boundary conditions on a given mesh.
+
+These are set up by sauce.py at the start of a simulation, and again
+whenever the mesh changes (see common/adaptivity.py).
+"""
+import dolfin as df
+from .cmd import info_on_red
+
+__all__ = ["create_spaces", "create_functions",
+           "create_boundary_conditions", "initialize_solutions",
+           "interpolate_solutions", "rebuild_on_mesh",
+           "check_mesh_changes"]
+
+
+def create_spaces(mesh, subproblems, base_elements, constrained_domain,
+                  **namespace):
+    """ Declare finite elements and function spaces, and map the fields to
+    their subspaces and subproblems. """
+    elements = dict()
+    for name, (family, degree, is_vector) in base_elements.items():
+        if is_vector:
+            elements[name] = df.VectorElement(family, mesh.ufl_cell(), degree)
+        else:
+            elements[name] = df.FiniteElement(family, mesh.ufl_cell(),
+                                              degree)
+
+    namespace_mesh = dict(namespace, mesh=mesh, subproblems=subproblems,
+                          base_elements=base_elements)
+    spaces = dict()
+    for name, subproblem in subproblems.items():
+        if len(subproblem) > 1:
+            spaces[name] = df.FunctionSpace(
+                mesh, df.MixedElement(
+                    [elements[s["element"]] for s in subproblem]),
+                constrained_domain=constrained_domain(**namespace_mesh))
+        # If there is only one field in the subproblem, don't bother with
+        # the MixedElement.
+        elif len(subproblem) == 1:
+            spaces[name] = df.FunctionSpace(
+                mesh, elements[subproblem[0]["element"]],
+                constrained_domain=constrained_domain(**namespace_mesh))
+        else:
+            info_on_red("Something went wrong here!")
+            exit("")
+
+    # dim = mesh.topology().dim()  # In case the velocity fields should be
+    #                              # segregated at some point
+    fields = []
+    field_to_subspace = dict()
+    field_to_subproblem = dict()
+    for name, subproblem in subproblems.items():
+        if len(subproblem) > 1:
+            for i, s in enumerate(subproblem):
+                field = s["name"]
+                fields.append(field)
+                field_to_subspace[field] = spaces[name].sub(i)
+                field_to_subproblem[field] = (name, i)
+        else:
+            field = subproblem[0]["name"]
+            fields.append(field)
+            field_to_subspace[field] = spaces[name]
+            field_to_subproblem[field] = (name, -1)
+
+    return dict(elements=elements, spaces=spaces, fields=fields,
+                field_to_subspace=field_to_subspace,
+                field_to_subproblem=field_to_subproblem)
+
+
+def create_functions(subproblems, spaces, **namespace):
+    """ Create test and trial functions, the work functions of all
+    subproblems, and shortcuts to the fields. """
+    test_functions = dict()
+    trial_functions = dict()
+    for name, subproblem in subproblems.items():
+        if len(subproblem) > 1:
+            test_functions[name] = df.TestFunctions(spaces[name])
+            trial_functions[name] = df.TrialFunctions(spaces[name])
+        else:
+            test_functions[name] = df.TestFunction(spaces[name])
+            trial_functions[name] = df.TrialFunction(spaces[name])
+
+    # Create work dictionaries for all subproblems
+    w_ = dict((subproblem, df.Function(space, name=subproblem))
+              for subproblem, space in spaces.items())
+    w_1 = dict((subproblem, df.Function(space, name=subproblem+"_1"))
+               for subproblem, space in spaces.items())
+    w_tmp = dict((subproblem, df.Function(space, name=subproblem+"_tmp"))
+                 for subproblem, space in spaces.items())
+
+    # Shortcuts to the fields
+    x_ = dict()
+    for name, subproblem in subproblems.items():
+        if len(subproblem) > 1:
+            w_loc = df.split(w_[name])
+            for i, field in enumerate(subproblem):
+                x_[field["name"]] = w_loc[i]
+        else:
+            x_[subproblem[0]["name"]] = w_[name]
+
+    return dict(test_functions=test_functions,
+                trial_functions=trial_functions,
+                w_=w_, w_1=w_1, w_tmp=w_tmp, x_=x_)
+
+
+def create_boundary_conditions(mesh, create_bcs, subproblems, fields,
+                               field_to_subspace, field_to_subproblem,
+                               **namespace):
+    """ Get the boundary conditions of the problem, mark the boundaries,
+    and sort the conditions into Dirichlet conditions (per subproblem)
+    and Neumann conditions (per field). """
+    bcs_tuple = create_bcs(mesh=mesh, subproblems=subproblems, fields=fields,
+                           field_to_subspace=field_to_subspace,
+                           field_to_subproblem=field_to_subproblem,
+                           **namespace)
+    if len(bcs_tuple) == 3:
+        boundaries, bcs, bcs_pointwise = bcs_tuple
+    elif len(bcs_tuple) == 2:
+        boundaries, bcs = bcs_tuple
+        bcs_pointwise = None
+    else:
+        info_on_red("Wrong implementation of create_bcs.")
+        exit()
+
+    # Set up subdomains
+    subdomains = df.MeshFunction("size_t", mesh, mesh.topology().dim()-1)
+    subdomains.set_all(0)
+    boundary_to_mark = dict()
+    mark_to_boundary = dict()
+    for i, (boundary_name, markers) in enumerate(boundaries.items()):
+        for marker in markers:
+            marker.mark(subdomains, i+1)
+        boundary_to_mark[boundary_name] = i+1
+        mark_to_boundary[i] = boundary_name
+
+    # Set up dirichlet part of bcs
+    dirichlet_bcs = dict()
+    for subproblem_name in subproblems.keys():
+        dirichlet_bcs[subproblem_name] = []
+
+    # Neumann BCs (per field)
+    neumann_bcs = dict()
+    for field in fields:
+        neumann_bcs[field] = dict()
+
+    for boundary_name, bcs_fields in bcs.items():
+        for field, bc in bcs_fields.items():
+            subproblem_name = field_to_subproblem[field][0]
+            subspace = field_to_subspace[field]
+            mark = boundary_to_mark[boundary_name]
+            if bc.is_dbc():
+                dirichlet_bcs[subproblem_name].append(
+                    bc.dbc(subspace, subdomains, mark))
+            if bc.is_nbc():
+                neumann_bcs[field][boundary_name] = bc.nbc()
+
+    # Pointwise dirichlet bcs
+    for field, (value, c_code) in bcs_pointwise.items():
+        subproblem_name = field_to_subproblem[field][0]
+        subspace = field_to_subspace[field]
+        if not isinstance(value, df.Expression):
+            value = df.Constant(value)
+        dirichlet_bcs[subproblem_name].append(
+            df.DirichletBC(subspace, value, c_code, "pointwise"))
+
+    # Compute some mesh related stuff
+    dx = df.dx
+    ds = df.Measure("ds", domain=mesh, subdomain_data=subdomains)
+    normal = df.FacetNormal(mesh)
+
+    return dict(boundaries=boundaries, bcs=bcs, bcs_pointwise=bcs_pointwise,
+                subdomains=subdomains, boundary_to_mark=boundary_to_mark,
+                mark_to_boundary=mark_to_boundary,
+                dirichlet_bcs=dirichlet_bcs, neumann_bcs=neumann_bcs,
+                dx=dx, ds=ds, normal=normal)
+
+
+def initialize_solutions(w_, w_1, subproblems, initialize, **namespace):
+    """ Set the current and previous solution to the initial state given
+    by the problem, if any. """
+    w_init_fields = initialize(w_=w_, w_1=w_1, subproblems=subproblems,
+                               **namespace)
+    if w_init_fields:
+        for name, subproblem in subproblems.items():
+            w_init_vector = []
+            if len(subproblem) > 1:
+                for i, s in enumerate(subproblem):
+                    field = s["name"]
+                    # Only change initial state if it is given in
+                    # w_init_fields.
+                    if field in w_init_fields:
+                        w_init_field = w_init_fields[field]
+                    else:
+                        # Otherwise take the default value of that field.
+                        w_init_field = w_[name].sub(i)
+                    # Use df.project(df.as_vector(...)) with care...
+                    num_subspaces = \
+                        w_init_field.function_space().num_sub_spaces()
+                    if num_subspaces == 0:
+                        w_init_vector.append(w_init_field)
+                    else:
+                        for j in range(num_subspaces):
+                            w_init_vector.append(w_init_field.sub(j))
+                # assert len(w_init_vector) == w_[name].value_size()
+                w_init = df.project(
+                    df.as_vector(tuple(w_init_vector)),
+                    w_[name].function_space(),
+                    solver_type="gmres", preconditioner_type="default")
+            else:
+                field = subproblem[0]["name"]
+                if field in w_init_fields:
+                    w_init_field = w_init_fields[field]
+                else:
+                    # Take default value...
+                    w_init_field = w_[name]
+                w_init = df.project(w_init_field, w_[name].function_space(),
+                                    solver_type="gmres",
+                                    preconditioner_type="default")
+            w_[name].interpolate(w_init)
+            w_1[name].interpolate(w_init)
+
+
+def interpolate_solutions(w_old, w_new, **namespace):
+    """ Interpolate each solution (dict of subproblem functions) in the list
+    w_old to the corresponding one in w_new, which may be on another mesh. """
+    for w_o, w_n in zip(w_old, w_new):
+        for name in w_o:
+            df.LagrangeInterpolator.interpolate(w_n[name], w_o[name])
+
+
+def check_mesh_changes(adapt_intv=False, mesh_stages=[], p_lagrange=False,
+                       V_lagrange=False, **namespace):
+    """ The solutions cannot be transferred between meshes with the Real
+    subspaces of the Lagrange multipliers. """
+    if (adapt_intv or mesh_stages) and (p_lagrange or V_lagrange):
+        info_on_red("Adaptive meshes and mesh stages cannot be combined "
+                    "with p_lagrange or V_lagrange; use p_nullspace or "
+                    "V_nullspace instead.")
+        exit()
+
+
+def rebuild_on_mesh(mesh, w_, w_1, setup, rhs_source,
+                    transfer=interpolate_solutions, setup_solvers=True,
+                    **namespace):
+    """ Move the simulation to a new mesh: rebuild the spaces, functions and
+    boundary conditions, transfer the current and previous solution with
+    transfer, and set up the solvers again (unless setup_solvers is False,
+    i.e. before they exist). Returns the updated namespace. """
+    ns = dict(namespace, mesh=mesh, setup=setup, rhs_source=rhs_source)
+    ns.update(create_spaces(**ns))
+    ns.update(create_functions(**ns))
+    transfer([w_, w_1], [ns["w_"], ns["w_1"]], **ns)
+    ns.update(create_boundary_conditions(**ns))
+    if setup_solvers:
+        ns["q_rhs"] = rhs_source(**ns)
+        ns.update(setup(**ns))
+    return ns
@@ -128,3 +128,37 @@ def alpha_reg(c, c_cutoff):
     c_min = min_value(c, c_cutoff)
     return (alpha(c_max) + alpha_c(c_cutoff)*(c_min-c_cutoff)
             + 0.5*alpha_cc(c_cutoff)*(c_min-c_cutoff)**2)
+
+
+# Pressure stabilization
+def pspg_tau(mesh, u, rho, mu, dt):
+    """ Stabilization parameter of PSPG, for the momentum residual. """
+    return supg_tau(mesh, u, mu/rho, dt)/rho
+
+
+# Transport stabilization
+def supg_tau(mesh, w, K, dt):
+    """ Stabilization parameter of SUPG, for advection by w with
+    diffusivity K and timestep dt. """
+    h = df.CellDiameter(mesh)
+    return ((2./dt)**2 + (2.*df.sqrt(df.dot(w, w))/h)**2
+            + (4.*K/h**2)**2)**(-0.5)
+
+
+def edge_stabilization(f, g, w, mesh, coeff):
+    """ Edge (continuous interior penalty) stabilization of advection by w:
+    penalizes the jumps of the normal gradient across facets. """
+    h = df.CellDiameter(mesh)
+    n = df.FacetNormal(mesh)
+    return (coeff*df.avg(h)**2*abs(df.dot(df.avg(w), n("+")))
+            * df.jump(df.grad(f), n)*df.jump(df.grad(g), n)*df.dS)
+
+
+def stabilize_transport(method, R, f, b, w, K, dt, mesh, coeff):
+    """ Stabilization of the advection of f by w, tested with b: "supg",
+    with the strong residual R, or "edge". """
+    if method == "supg":
+        return supg_tau(mesh, w, K, dt)*R*df.dot(w, df.grad(b))*df.dx
+    elif method == "edge":
+        return edge_stabilization(f, b, w, mesh, coeff)
+    return 0
@@ -0,0 +1,50 @@
+"""
+Decoupled (Gummel) solution of the electrochemistry subproblem.
+
+Instead of solving all the concentrations and the electric potential as one
+mixed, nonsymmetric system, each Gummel iteration solves
+
+1. the Poisson equation for V, with the charge of the current iterate of
+   the concentrations (symmetric, suited for CG and AMG), and
+2. the Nernst-Planck equation of each species as a scalar problem, given V
+   and the current iterate of the other species.
+
+The species solves are independent of each other within an iteration, and
+all have the same sparsity pattern. More iterations restore the coupling.
+"""
+import dolfin as df
+
+__all__ = ["GummelSolver"]
+
+
+class GummelSolver:
+    """ Solver of the electrochemistry subproblem in w (mixed function of
+    the concentrations and V) by Gummel iterations. c and V are the
+    iterates on the collapsed subspaces, c_new the solutions of the species
+    solvers within an iteration. """
+    def __init__(self, w, c, V, c_new, poisson_solver, species_solvers,
+                 iterations=1):
+        self.w = w
+        self.c = c
+        self.V = V
+        self.c_new = c_new
+        self.poisson_solver = poisson_solver
+        self.species_solvers = species_solvers
+        self.iterations = iterations
+
+        fields = list(c) + [V]
+        spaces = [f.function_space() for f in fields]
+        self.fields = fields
+        self.extract = df.FunctionAssigner(spaces, w.function_space())
+        self.insert = df.FunctionAssigner(w.function_space(), spaces)
+
+    def solve(self):
+        self.extract.assign(self.fields, self.w)
+        for it in range(self.iterations):
+            self.poisson_solver.solve()
+            # The species are independent given V and the previous iterate
+            for solver in self.species_solvers:
+                solver.solve()
+            for ci, ci_new in zip(self.c, self.c_new):
+                ci.assign(ci_new)
+        self.insert.assign(self.w, self.fields)
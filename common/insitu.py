@@ -0,0 +1,451 @@
+"""
+In-situ analyses, evaluated on the live fields during the simulation.
+
+The analyses are selected by the parameter insitu (a list of names, see
+INSITU_ANALYSES) and evaluated every stat_intv timesteps. Their forms are
+compiled once. The results are buffered and written to
+Statistics/insitu.dat (and Statistics/insitu.h5 if stat_hdf5 is set).
+"""
+import os
+import numpy as np
+import dolfin as df
+from mpi4py import MPI
+from scipy.spatial import cKDTree
+from .cmd import info_cyan, info_on_red, info_warning, MPI_rank
+from .functions import ramp, dramp
+from .bcs import set_frame_velocity
+
+__all__ = ["InSituAnalyses", "StatisticsWriter", "ContactLineTracker",
+           "DropletFrame", "INSITU_ANALYSES"]
+
+
+class StatisticsWriter:
+    """ Buffered writer of rows of statistics. Only the root process
+    writes, and only every buffer_size rows (or when flushed). """
+    def __init__(self, filename, keys, buffer_size=10, use_hdf5=False):
+        self.filename = filename
+        self.keys = keys
+        self.buffer_size = buffer_size
+        self.use_hdf5 = use_hdf5
+        self.rows = []
+
+    def write(self, row):
+        self.rows.append(row)
+        if len(self.rows) >= self.buffer_size:
+            self.flush()
+
+    def flush(self):
+        if MPI_rank == 0 and len(self.rows) > 0:
+            data = np.array(self.rows, dtype=float)
+            txt_file = self.filename + ".dat"
+            # Continue the file when restarting.
+            header = "" if os.path.exists(txt_file) else "\t".join(self.keys)
+            with open(txt_file, "ab") as outfile:
+                np.savetxt(outfile, data, header=header)
+            if self.use_hdf5:
+                import h5py
+                with h5py.File(self.filename + ".h5", "a") as h5f:
+                    if "statistics" not in h5f:
+                        dset = h5f.create_dataset(
+                            "statistics", (0, len(self.keys)),
+                            maxshape=(None, len(self.keys)), dtype=float)
+                        dset.attrs["keys"] = ",".join(self.keys)
+                    dset = h5f["statistics"]
+                    dset.resize(len(dset)+len(data), axis=0)
+                    dset[-len(data):] = data
+        self.rows = []
+
+    def close(self):
+        self.flush()
+
+
+class CompiledFunctional:
+    """ Functional whose form is compiled once and assembled at every
+    evaluation. """
+    def __init__(self, form):
+        self.form = df.Form(form)
+
+    def __call__(self):
+        return df.assemble(self.form)
+
+
+class PointValues:
+    """ Values of a function at fixed points, in parallel. The cells
+    containing the points are located once. """
+    def __init__(self, f, points, mesh):
+        self.f = f
+        self.points = [np.array(x, dtype=float) for x in points]
+        self.value_size = max(f.value_size(), 1)
+        tree = mesh.bounding_box_tree()
+        num_cells = mesh.num_cells()
+        self.cells = []
+        for x in self.points:
+            cell = tree.compute_first_entity_collision(df.Point(*x))
+            self.cells.append(cell if cell < num_cells else None)
+        self.comm = mesh.mpi_comm()
+        # Each point is evaluated by one process only.
+        self.owner = np.array([
+            df.MPI.max(self.comm, float(MPI_rank if cell is not None else -1))
+            for cell in self.cells])
+        if (self.owner < 0).any():
+            info_on_red("Some in-situ probe points are outside the mesh.")
+
+    def __call__(self):
+        values = np.zeros(len(self.points)*self.value_size)
+        for i, x in enumerate(self.points):
+            if self.owner[i] == MPI_rank:
+                value = np.zeros(self.value_size)
+                self.f.eval(value, x)
+                values[i*self.value_size:(i+1)*self.value_size] = value
+        return [df.MPI.sum(self.comm, float(v)) for v in values]
+
+
+def insitu_energy(x_, discrete_energy=None, **namespace):
+    """ Discrete energy of the solver. """
+    if discrete_energy is None:
+        info_on_red("The solver defines no discrete energy.")
+        return [], []
+    keys = discrete_energy(None, **namespace)
+    integrands = discrete_energy(x_, **namespace)
+    return keys, [CompiledFunctional(f*df.dx) for f in integrands]
+
+
+def insitu_geometry(x_, mesh, enable_PF, enable_NS, **namespace):
+    """ Volume, centre of mass and velocity of the phase phi < 0. """
+    if not enable_PF:
+        return [], []
+    dim = mesh.topology().dim()
+    mask = 0.5*(1.-x_["phi"])
+    r = df.SpatialCoordinate(mesh)
+    keys = ["Area"]
+    functionals = [CompiledFunctional(mask*df.dx)]
+    for d in range(dim):
+        keys.append("CoM_" + "xyz"[d])
+        functionals.append(CompiledFunctional(mask*r[d]*df.dx))
+    if enable_NS:
+        for d in range(dim):
+            keys.append("U_" + "xyz"[d])
+            functionals.append(CompiledFunctional(mask*x_["u"][d]*df.dx))
+    return keys, functionals
+
+
+def insitu_flux(x_, ds, normal, boundary_to_mark, solutes,
+                pf_mobility, pf_mobility_coeff,
+                enable_NS, enable_PF, enable_EC, **namespace):
+    """ Fluxes through the marked boundaries. """
+    fluxes = dict()
+    if enable_NS:
+        fluxes["Velocity"] = x_["u"]
+    if enable_PF:
+        phi = x_["phi"]
+        M = pf_mobility(phi, pf_mobility_coeff)
+        fluxes["Phase"] = -M*df.grad(x_["g"])
+        if enable_NS:
+            fluxes["Phase"] += phi*x_["u"]
+    if enable_EC:
+        V = x_["V"]
+        for solute in solutes:
+            ci = x_[solute[0]]
+            c_grad_g_ci = df.grad(ci) + solute[1]*ci*df.grad(V)
+            if enable_PF:
+                K = ramp(phi, [solute[2], solute[3]])
+                c_grad_g_ci += dramp([solute[4], solute[5]])*df.grad(phi)
+            else:
+                K = solute[2]
+            fluxes["Solute {}".format(solute[0])] = K*c_grad_g_ci
+        fluxes["E-field"] = -df.grad(V)
+
+    keys = []
+    functionals = []
+    for boundary_name, mark in sorted(boundary_to_mark.items()):
+        for flux_name in sorted(fluxes.keys()):
+            keys.append("{} {}".format(flux_name, boundary_name))
+            functionals.append(CompiledFunctional(
+                df.dot(fluxes[flux_name], normal)*ds(mark)))
+    return keys, functionals
+
+
+def insitu_probes(w_, fields, field_to_subproblem, mesh, probe_points,
+                  **namespace):
+    """ Values of all fields at the points probe_points. """
+    keys = []
+    functionals = []
+    for field in fields:
+        name, i = field_to_subproblem[field]
+        f = w_[name] if i == -1 else w_[name].split()[i]
+        probe = PointValues(f, probe_points, mesh)
+        for j in range(len(probe_points)):
+            if probe.value_size == 1:
+                keys.append("{}_{}".format(field, j))
+            else:
+                keys.extend(["{}_{}_{}".format(field, "xyz"[d], j)
+                             for d in range(probe.value_size)])
+        functionals.append(probe)
+    return keys, functionals
+
+
+class ContactLineTracker:
+    """ Contact points of the phase boundary on a wall (2D), and the
+    apparent contact angles (through the phase phi < 0).
+
+    The contact points are found by linear interpolation of phi along the
+    wall facets. The angle is that between the wall and the line fitted to
+    the interface points (crossings of phi = 0 on the mesh edges) within
+    radius of the contact point. The wall facets and the edges close to the
+    wall are found once, so that each evaluation is a few vectorized
+    operations on the vertex values of phi.
+    """
+    def __init__(self, f_phi, mesh, subdomains, mark, radius=None,
+                 num_points=2):
+        self.f_phi = f_phi
+        self.mesh = mesh
+        self.num_points = num_points
+        dim = mesh.topology().dim()
+        coords = mesh.coordinates()[:, :dim]
+
+        mesh.init(dim-1, dim)
+        wall = []
+        cell_midpoints = []
+        for facet in df.facets(mesh):
+            if subdomains[facet] == mark:
+                wall.append(facet.entities(0))
+                cell = df.Cell(mesh, facet.entities(dim)[0])
+                cell_midpoints.append(cell.midpoint().array()[:dim])
+        self.wall = np.array(wall, dtype=int).reshape(-1, 2)
+        self.x_a = coords[self.wall[:, 0]]
+        self.x_b = coords[self.wall[:, 1]]
+        tangent = self.x_b-self.x_a
+        normal = np.vstack((-tangent[:, 1], tangent[:, 0])).T
+        normal /= np.linalg.norm(normal, axis=1)[:, None]
+        inward = ((np.array(cell_midpoints).reshape(-1, dim)-self.x_a)
+                  * normal).sum(axis=1) > 0.
+        self.normal = np.where(inward[:, None], normal, -normal)
+
+        if radius is None:
+            radius = 3*MPI.COMM_WORLD.allreduce(mesh.hmax(), op=MPI.MAX)
+        self.radius = radius
+
+        # Edges with both vertices within radius of the wall.
+        wall_coords = np.vstack(MPI.COMM_WORLD.allgather(
+            coords[np.unique(self.wall)]))
+        if len(wall_coords) == 0:
+            info_on_red("No facets found on the contact line wall.")
+            exit()
+        near = cKDTree(wall_coords).query(coords)[0] <= radius
+        mesh.init(1, 0)
+        edges = np.array([edge.entities(0) for edge in df.edges(mesh)],
+                         dtype=int).reshape(-1, 2)
+        self.edges = edges[near[edges].all(axis=1)]
+        self.coords = coords
+
+    def keys(self):
+        keys = []
+        for i in range(self.num_points):
+            keys.extend(["x_{}".format(i), "y_{}".format(i),
+                         "theta_{}".format(i)])
+        return keys
+
+    def __call__(self):
+        phi = self.f_phi.compute_vertex_values(self.mesh)
+
+        # Contact points on the wall facets
+        phi_a = phi[self.wall[:, 0]]
+        phi_b = phi[self.wall[:, 1]]
+        cut = (phi_a > 0.) != (phi_b > 0.)
+        s = (phi_a/(phi_a-phi_b))[cut, None]
+        x_c = (1.-s)*self.x_a[cut] + s*self.x_b[cut]
+        # Direction along the wall into the phase phi < 0
+        into = np.where((phi_b < 0.)[cut, None],
+                        self.x_b[cut]-self.x_a[cut],
+                        self.x_a[cut]-self.x_b[cut])
+        into /= np.linalg.norm(into, axis=1)[:, None]
+
+        # Interface points close to the wall
+        phi_a = phi[self.edges[:, 0]]
+        phi_b = phi[self.edges[:, 1]]
+        crossing = (phi_a > 0.) != (phi_b > 0.)
+        s = (phi_a/(phi_a-phi_b))[crossing, None]
+        x_i = ((1.-s)*self.coords[self.edges[crossing, 0]]
+               + s*self.coords[self.edges[crossing, 1]])
+
+        contacts = np.vstack(MPI.COMM_WORLD.allgather(
+            np.hstack((x_c, into, self.normal[cut]))))
+        x_i = np.vstack(MPI.COMM_WORLD.allgather(x_i))
+
+        row = []
+        for contact in contacts[np.lexsort(contacts[:, 1::-1].T)]:
+            x_0, into, normal = contact[:2], contact[2:4], contact[4:6]
+            x = np.vstack((x_0, x_i[np.linalg.norm(x_i-x_0, axis=1)
+                                    < self.radius]))
+            # Principal direction of the local interface points
+            direction = np.linalg.svd(x-x.mean(axis=0))[2][0]
+            if np.dot(direction, normal) < 0.:
+                direction = -direction
+            theta = np.arccos(np.clip(np.dot(direction, into), -1., 1.))
+            row.extend([x_0[0], x_0[1], theta])
+        if len(row) > 3*self.num_points:
+            info_warning("More contact points than num_contact_points.")
+        row = row[:3*self.num_points]
+        return row + [np.nan]*(3*self.num_points-len(row))
+
+
+def contact_line_tracker(contact_wall, contact_radius, num_contact_points,
+                         w_, field_to_subproblem, mesh, subdomains,
+                         boundary_to_mark, enable_PF, **namespace):
+    """ Contact line tracker on the boundary contact_wall. """
+    if not enable_PF or mesh.topology().dim() != 2:
+        info_on_red("The contact line tracker needs a phase field in 2D.")
+        exit()
+    name, i = field_to_subproblem["phi"]
+    f_phi = w_[name] if i == -1 else w_[name].split()[i]
+    return ContactLineTracker(f_phi, mesh, subdomains,
+                              boundary_to_mark[contact_wall],
+                              contact_radius, num_contact_points)
+
+
+class DropletFrame:
+    """ Reference frame following the phase phi < 0.
+
+    The velocity u in w_NS is relative to the frame, which moves at
+    u_comoving = U; the lab velocity is u + U. At every update, the mean
+    relative velocity of the phase is added (times relaxation) to U, and
+    subtracted from u in w_NS and w_1NS, so that the lab velocity is kept.
+    The constant is assigned in place, so the forms that use it are not
+    recompiled.
+
+    Walls at rest in the lab move at -U in this frame. Boundary conditions
+    given in the lab frame (LabFixed in bcs) are updated with U; other
+    Dirichlet conditions are taken as relative to the frame.
+    """
+    def __init__(self, u_comoving, w_NS, w_1NS, phi_, parameters,
+                 bcs=None, relaxation=1.):
+        self.u_comoving = u_comoving
+        self.functions = [w_NS, w_1NS]
+        self.bcs = bcs if bcs is not None else dict()
+        self.relaxation = relaxation
+        self.parameters = parameters
+        self.dim = len(u_comoving.values())
+        u_ = df.split(w_NS)[0]
+        mask = 0.5*(1.-phi_)
+        self.volume = CompiledFunctional(mask*df.dx)
+        self.momentum = [CompiledFunctional(mask*u_[d]*df.dx)
+                         for d in range(self.dim)]
+        self.velocity = np.array(
+            parameters["comoving_velocity"][:self.dim], dtype=float)
+        self.displacement = np.array(
+            parameters.get("comoving_displacement",
+                           [0.]*self.dim)[:self.dim], dtype=float)
+
+        # Unit relative velocity in each direction, in the space of w_NS
+        W = w_NS.function_space()
+        V = W.sub(0).collapse()
+        assigner = df.FunctionAssigner(W.sub(0), V)
+        self.units = []
+        for d in range(self.dim):
+            unit = df.Function(W)
+            assigner.assign(unit.sub(0), df.interpolate(
+                df.Constant(tuple(np.eye(self.dim)[d])), V))
+            self.units.append(unit)
+
+    def update(self, dt):
+        """ Move the frame a timestep, and update its velocity. """
+        self.displacement += dt*self.velocity
+        volume = self.volume()
+        if volume > 0.:
+            u_rel = np.array([m() for m in self.momentum])/volume
+            du = self.relaxation*u_rel
+            self.velocity += du
+            for w in self.functions:
+                for d in range(self.dim):
+                    w.vector().axpy(-du[d], self.units[d].vector())
+        self.u_comoving.assign(df.Constant(tuple(self.velocity)))
+        set_frame_velocity(self.bcs, self.velocity)
+        # Stored in the checkpoints, to restart in the same frame.
+        self.parameters["comoving_velocity"] = list(self.velocity)
+        self.parameters["comoving_displacement"] = list(self.displacement)
+
+    def keys(self):
+        return (["Frame_U_" + "xyz"[d] for d in range(self.dim)] +
+                ["Frame_X_" + "xyz"[d] for d in range(self.dim)])
+
+    def __call__(self):
+        return list(self.velocity) + list(self.displacement)
+
+
+def insitu_frame(droplet_frame=None, **namespace):
+    """ Velocity and displacement of the droplet-following frame. """
+    if droplet_frame is None:
+        info_on_red("The droplet-following frame is not enabled.")
+        return [], []
+    return droplet_frame.keys(), [droplet_frame]
+
+
+INSITU_ANALYSES = dict(energy=insitu_energy,
+                       geometry=insitu_geometry,
+                       flux=insitu_flux,
+                       probes=insitu_probes,
+                       frame=insitu_frame)
+
+
+class InSituAnalyses:
+    """ The in-situ analyses of a simulation, set up from the namespace of
+    sauce.py. """
+    def __init__(self, insitu, stat_intv, newfolder, stat_buffer=10,
+                 stat_hdf5=False, contact_wall=None, contact_intv=1,
+                 contact_radius=None, num_contact_points=2, **namespace):
+        self.stat_intv = stat_intv
+        self.keys = ["Timestep", "Time"]
+        self.functionals = []
+        for name in insitu:
+            if name not in INSITU_ANALYSES:
+                info_on_red("Unknown in-situ analysis: " + name)
+                exit()
+            keys, functionals = INSITU_ANALYSES[name](**namespace)
+            self.keys.extend(keys)
+            self.functionals.extend(functionals)
+        self.writer = None
+        if len(self.functionals) > 0:
+            info_cyan("In-situ analyses: " + ", ".join(insitu))
+            self.writer = StatisticsWriter(
+                os.path.join(newfolder, "Statistics", "insitu"),
+                self.keys, stat_buffer, stat_hdf5)
+
+        self.contact_intv = contact_intv
+        self.contact_tracker = None
+        if contact_wall:
+            info_cyan("Tracking the contact line on: " + contact_wall)
+            self.contact_tracker = contact_line_tracker(
+                contact_wall, contact_radius, num_contact_points,
+                **namespace)
+            self.contact_writer = StatisticsWriter(
+                os.path.join(newfolder, "Statistics", "contact_line"),
+                ["Timestep", "Time"] + self.contact_tracker.keys(),
+                stat_buffer, stat_hdf5)
+
+    def evaluate(self, t, tstep, stop=False):
+        """ Evaluate the analyses if tstep is a statistics step. """
+        if self.contact_tracker is not None:
+            if tstep % self.contact_intv == 0 or stop:
+                self.contact_writer.write([tstep, t] +
+                                          self.contact_tracker())
+            if stop:
+                self.contact_writer.flush()
+        if self.writer is None:
+            return
+        if tstep % self.stat_intv == 0 or stop:
+            row = [tstep, t]
+            for functional in self.functionals:
+                value = functional()
+                if isinstance(value, list):
+                    row.extend(value)
+                else:
+                    row.append(value)
+            self.writer.write(row)
+        if stop:
+            self.writer.flush()
+
+    def close(self):
+        if self.writer is not None:
+            self.writer.close()
+        if self.contact_tracker is not None:
+            self.contact_writer.close()
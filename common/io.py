@@ -93,7 +93,10 @@ def create_initial_folders(folder, restart_folder, fields, tstep,
         filename = os.path.join(tstepfolder,
                                 field + "_from_tstep_{}.xdmf".format(tstep))
         tstepfiles[field] = XDMFFile(mpi_comm(), filename)
-        tstepfiles[field].parameters["rewrite_function_mesh"] = False
+        # The mesh is written at every step only if it changes in time.
+        # (Mesh stages are stored in separate folders.)
+        tstepfiles[field].parameters["rewrite_function_mesh"] = bool(
+            parameters.get("adapt_intv", False))
         tstepfiles[field].parameters["flush_output"] = True
 
     # Dump settings
@@ -217,14 +220,23 @@ def load_mesh(filename, subdir="mesh",
 
 
 def parse_xdmf(xml_file, get_mesh_address=False):
+    """ Datasets (time, address) of an XDMF time series. With
+    get_mesh_address, also the mesh of each dataset, as the addresses
+    ((h5 file, topology), (h5 file, geometry)). A grid that refers to the
+    mesh of a previous grid gets its addresses. """
     tree = ET.parse(xml_file)
     root = tree.getroot()
 
     dsets = []
     timestamps = []
 
-    geometry_found = not get_mesh_address
-    topology_found = not get_mesh_address
+    def h5_address(prop):
+        h5_file, address = prop[0].text.strip().split(":")
+        return (os.path.join(os.path.dirname(xml_file), h5_file), address)
+
+    topology_address = None
+    geometry_address = None
+    mesh_addresses = []
 
     for i, step in enumerate(root[0][0]):
         if step.tag == "Time":
@@ -239,21 +251,17 @@ def parse_xdmf(xml_file, get_mesh_address=False):
                     timestamp = float(prop.attrib["Value"])
                 elif prop.tag == "Attribute":
                     dset_address = prop[0].text.split(":")[1]
-                elif not topology_found and prop.tag == "Topology":
-                    topology_address = prop[0].text.split(":")
-                    topology_address[0] = os.path.join(
-                        os.path.dirname(xml_file), topology_address[0])
-                    topology_found = True
-                elif not geometry_found and prop.tag == "Geometry":
-                    geometry_address = prop[0].text.split(":")
-                    geometry_address[0] = os.path.join(
-                        os.path.dirname(xml_file), geometry_address[0])
-                    geometry_found = True
+                elif prop.tag == "Topology":
+                    topology_address = h5_address(prop)
+                elif prop.tag == "Geometry":
+                    geometry_address = h5_address(prop)
             if timestamp is None:
                 timestamp = timestamps[i-1]
             dsets.append((timestamp, dset_address))
-    if get_mesh_address and topology_found and geometry_found:
-        return (dsets, topology_address, geometry_address)
+            mesh_addresses.append((topology_address, geometry_address))
+    if bool(get_mesh_address and topology_address is not None and
+            geometry_address is not None):
+        return (dsets, mesh_addresses)
     return dsets
 
 
@@ -0,0 +1,183 @@
+"""
+Subproblems with fields that are only determined up to a constant, such as
+the pressure in a closed domain, or the electric potential with surface
+charges only.
+
+Instead of a Lagrange multiplier in a Real space (p_lagrange, V_lagrange),
+which couples all dofs through a dense row and column, the constant modes
+are attached to the operator as a PETSc nullspace. After each solve, the
+fields are shifted to zero mean, which is the constraint imposed by the
+Lagrange multiplier.
+
+The right-hand side must be consistent, i.e. orthogonal to the nullspace
+of the transposed operator. This is the constant mode itself for the
+pressure, but not for the electric potential, whose equation is coupled
+to the concentrations: there, the transposed nullspace also has the
+charges (times the timestep) on the concentrations (left_weights). A
+closed system with a net charge has no solution at all; the Lagrange
+multiplier V0 then acts as a uniform background charge that cancels it.
+The same background is added explicitly here (background), so that both
+give the same solution.
+"""
+import dolfin as df
+from .cmd import info_red
+
+__all__ = ["NullspaceSolver", "charge_nullspace"]
+
+
+class NullspaceProblem(df.NonlinearProblem):
+    """ Nonlinear problem whose Jacobian carries a nullspace. """
+    def __init__(self, F, J, bcs, nullspace, left_nullspace):
+        df.NonlinearProblem.__init__(self)
+        self.F_form = df.Form(F)
+        self.J_form = df.Form(J)
+        self.bcs = bcs
+        self.nullspace = nullspace
+        self.left_nullspace = left_nullspace
+
+    def F(self, b, x):
+        df.assemble(self.F_form, tensor=b)
+        for bc in self.bcs:
+            bc.apply(b, x)
+        self.left_nullspace.orthogonalize(b)
+
+    def J(self, A, x):
+        df.assemble(self.J_form, tensor=A)
+        for bc in self.bcs:
+            bc.apply(A)
+        df.as_backend_type(A).set_nullspace(self.nullspace)
+
+
+def subspace_vector(w, weights):
+    """ Vector of the space of w that is constant on each of the subspaces
+    given as keys of weights (indices in the mixed space), with the given
+    values, and zero elsewhere. """
+    V = w.function_space()
+    vector = w.vector().copy()
+    vector.zero()
+    for i, weight in weights.items():
+        V.sub(i).dofmap().set(vector, float(weight))
+    vector.apply("insert")
+    return vector
+
+
+class NullspaceSolver:
+    """ Solver of the subproblem F = 0 for w, where the fields given by
+    subspaces (indices in the mixed space of w) have constant modes.
+
+    left_weights gives, for each mode, the nullspace of the transposed
+    operator as weights of the subspaces (by default the mode itself);
+    the right-hand side is orthogonalized against it. background is an
+    optional pair (constant, form), where constant is set to the mean of
+    form before each solve, e.g. to cancel a net charge. """
+    def __init__(self, F, w, bcs, subspaces, nonlinear=False,
+                 use_iterative_solvers=False, left_weights=None,
+                 background=None):
+        self.w = w
+        self.bcs = bcs
+        self.nonlinear = nonlinear
+        V = w.function_space()
+        mesh = V.mesh()
+        w_split = df.split(w)
+        if left_weights is None:
+            left_weights = [{i: 1.} for i in subspaces]
+
+        # Constant modes, and the forms of the means of the fields
+        self.modes = []
+        self.means = []
+        for i in subspaces:
+            self.modes.append(subspace_vector(w, {i: 1.}))
+            self.means.append(df.Form(w_split[i]*df.dx(domain=mesh)))
+        self.volume = df.assemble(df.Constant(1.)*df.dx(domain=mesh))
+        self.nullspace = df.VectorSpaceBasis(
+            [mode.copy() for mode in self.modes])
+        self.nullspace.orthonormalize()
+        self.left_nullspace = df.VectorSpaceBasis(
+            [subspace_vector(w, weights) for weights in left_weights])
+        self.left_nullspace.orthonormalize()
+
+        self.background = None
+        if background is not None:
+            self.background = (background[0], df.Form(background[1]))
+
+        if use_iterative_solvers:
+            self.linear_solver = df.PETScKrylovSolver("gmres", "default")
+        else:
+            # MUMPS detects the null pivot of the singular operator
+            df.PETScOptions.set("mat_mumps_icntl_24", 1)
+            self.linear_solver = df.PETScLUSolver("mumps")
+
+        if nonlinear:
+            J = df.derivative(F, w)
+            self.problem = NullspaceProblem(F, J, bcs, self.nullspace,
+                                            self.left_nullspace)
+            self.newton_solver = df.NewtonSolver(
+                mesh.mpi_comm(), self.linear_solver,
+                df.PETScFactory.instance())
+            self.newton_solver.parameters["relative_tolerance"] = 1e-7
+        else:
+            self.a = df.Form(df.lhs(F))
+            self.L = df.Form(df.rhs(F))
+
+    def solve(self):
+        if self.background is not None:
+            constant, form = self.background
+            constant.assign(df.assemble(form)/self.volume)
+        if self.nonlinear:
+            self.newton_solver.solve(self.problem, self.w.vector())
+        else:
+            A, b = df.assemble_system(self.a, self.L, self.bcs)
+            df.as_backend_type(A).set_nullspace(self.nullspace)
+            self.left_nullspace.orthogonalize(b)
+            self.linear_solver.set_operator(A)
+            self.linear_solver.solve(self.w.vector(), b)
+        self.remove_means()
+
+    def remove_means(self):
+        """ Shift the fields to zero mean. """
+        for mode, mean in zip(self.modes, self.means):
+            self.w.vector().axpy(-df.assemble(mean)/self.volume, mode)
+
+
+def net_charge(z, c_1, dt, solutes, q_rhs, neumann_bcs, boundary_to_mark,
+               dx, ds):
+    """ Form of the net charge of a closed system at the end of a timestep
+    dt: the charge of the concentrations c_1 and of their sources, the
+    surface charges, and the (negative) charge source of the potential. """
+    one = df.Constant(1.)
+    Q = df.Constant(0.)*dx
+    for zi, ci_1, solute in zip(z, c_1, solutes):
+        if zi == 0:
+            continue
+        Q += zi*ci_1*dx
+        if solute[0] in q_rhs:
+            Q += zi*dt*q_rhs[solute[0]]*dx
+    for boundary_name, sigma_e in neumann_bcs["V"].items():
+        Q += sigma_e*one*ds(boundary_to_mark[boundary_name])
+    if "V" in q_rhs:
+        Q += -q_rhs["V"]*dx
+    return Q
+
+
+def charge_nullspace(z, c_1, dt, solutes, q_rhs, neumann_bcs,
+                     boundary_to_mark, dx, ds, dirichlet_bcs):
+    """ Nullspace data of the electrochemistry subproblem of a closed system,
+    in which the electric potential is determined up to a constant. The
+    equations of the concentrations, weighted by their charges times dt,
+    sum up with the Poisson equation to the net charge, which a uniform
+    background charge cancels. Returns the keyword arguments of
+    NullspaceSolver, and the background charge, to be added as
+    background*U*dx to the Poisson equation. """
+    if len(dirichlet_bcs) > 0:
+        info_red("V_nullspace requires a closed system, without Dirichlet "
+                 "conditions on the electrochemistry; use V_lagrange or a "
+                 "Dirichlet condition on V instead.")
+        exit()
+    background = df.Constant(0.)
+    left_weights = dict([(i, zi*dt) for i, zi in enumerate(z)])
+    left_weights[len(z)] = 1.
+    kwargs = dict(left_weights=[left_weights],
+                  background=(background, net_charge(
+                      z, c_1, dt, solutes, q_rhs, neumann_bcs,
+                      boundary_to_mark, dx, ds)))
+    return kwargs, background
@@ -0,0 +1,118 @@
+"""
+Mesh sequencing: spin-up on coarser meshes.
+
+The stages are given by the parameter mesh_stages, a list of dicts, each
+holding the end time T of the stage and the mesh parameters that differ
+from the production run, e.g.
+
+    mesh_stages=[dict(T=0.5, grid_spacing=1./16),
+                 dict(T=1.0, grid_spacing=1./32)]
+
+The simulation runs on the mesh of stage 0 until time T, then the solution
+is transferred to the next mesh, and so on, until it reaches the mesh of
+the problem itself. The current stage is stored in the parameter stage,
+and hence in the checkpoints. Every stage after the first is stored in a
+new results folder, so that each folder holds the time series of a single
+mesh.
+"""
+import dolfin as df
+from .cmd import info_cyan, info_on_red
+from .io import create_initial_folders
+from .discretization import rebuild_on_mesh
+
+__all__ = ["stage_parameters", "stage_ended", "transfer_matrices",
+           "transfer_solutions", "next_mesh_stage"]
+
+
+def stage_parameters(parameters):
+    """ The parameters of the current mesh stage. """
+    mesh_stages = parameters.get("mesh_stages", [])
+    stage = parameters.get("stage", 0)
+    if stage >= len(mesh_stages):
+        return parameters
+    stage_params = dict(parameters)
+    stage_params.update(dict((key, value) for key, value
+                             in mesh_stages[stage].items() if key != "T"))
+    return stage_params
+
+
+def stage_ended(t, stage, mesh_stages, dt=0., **namespace):
+    """ Whether the current mesh stage has reached its end time. """
+    return stage < len(mesh_stages) and \
+        t >= mesh_stages[stage]["T"] - 1e-6*dt
+
+
+def transfer_matrices(spaces_old, spaces_new, subproblems):
+    """ Precompute the interpolation matrices from the old to the new
+    spaces; one per field of a mixed space. """
+    matrices = dict()
+    for name, subproblem in subproblems.items():
+        if len(subproblem) > 1:
+            matrices[name] = [
+                df.PETScDMCollection.create_transfer_matrix(
+                    spaces_old[name].sub(i).collapse(),
+                    spaces_new[name].sub(i).collapse())
+                for i in range(len(subproblem))]
+        else:
+            matrices[name] = [df.PETScDMCollection.create_transfer_matrix(
+                spaces_old[name], spaces_new[name])]
+    return matrices
+
+
+def transfer_solutions(w_old, w_new, subproblems, **namespace):
+    """ Transfer each solution in the list w_old to the corresponding one in
+    w_new, with interpolation matrices computed once for all of them. """
+    spaces_old = dict((name, w.function_space())
+                      for name, w in w_old[0].items())
+    spaces_new = dict((name, w.function_space())
+                      for name, w in w_new[0].items())
+    matrices = transfer_matrices(spaces_old, spaces_new, subproblems)
+
+    for w_o, w_n in zip(w_old, w_new):
+        for name, subproblem in subproblems.items():
+            if len(subproblem) == 1:
+                matrices[name][0].mult(w_o[name].vector(),
+                                       w_n[name].vector())
+                continue
+            # Transfer the fields one by one, and assemble them again
+            f_old = w_o[name].split(deepcopy=True)
+            f_new = [df.Function(spaces_new[name].sub(i).collapse())
+                     for i in range(len(subproblem))]
+            for matrix, f_o, f_n in zip(matrices[name], f_old, f_new):
+                matrix.mult(f_o.vector(), f_n.vector())
+            df.FunctionAssigner(
+                spaces_new[name],
+                [f.function_space() for f in f_new]).assign(w_n[name], f_new)
+
+
+def next_mesh_stage(mesh_generator, stage, mesh_stages, parameters,
+                    folder, fields, t, tstep, tstepfiles, **namespace):
+    """ Move on to the next mesh stage: create its mesh, transfer the
+    solution to it, and open a new results folder for it. Returns the
+    updated namespace. """
+    if not callable(mesh_generator):
+        info_on_red("Mesh stages require the problem to define the mesh "
+                    "by a function.")
+        exit()
+    stage += 1
+    parameters["stage"] = stage
+    mesh = mesh_generator(**stage_parameters(parameters))
+    info_cyan("Mesh stage {} of {}: {} cells.".format(
+        stage+1, len(mesh_stages)+1,
+        int(df.MPI.sum(mesh.mpi_comm(), float(mesh.num_cells())))))
+    ns = rebuild_on_mesh(mesh, transfer=transfer_solutions,
+                         mesh_generator=mesh_generator,
+                         mesh_stages=mesh_stages, parameters=parameters,
+                         folder=folder, fields=fields, t=t, tstep=tstep,
+                         **namespace)
+    # Adaptive meshes are refined from the mesh of the stage
+    ns.update(stage=stage, base_mesh=mesh)
+
+    for tstepfile in tstepfiles.values():
+        tstepfile.close()
+    parameters["t_0"] = t
+    newfolder, tstepfiles = create_initial_folders(folder, False, fields,
+                                                   tstep, parameters)
+    info_cyan("Mesh stage {} is stored in {}.".format(stage+1, newfolder))
+    ns.update(newfolder=newfolder, tstepfiles=tstepfiles)
+    return ns
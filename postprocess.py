@@ -1,9 +1,12 @@
 from utilities.TimeSeries import TimeSeries
 import dolfin as df
 from common import info, parse_command_line, \
-    info_cyan, info_split, info_on_red, info_red, info_yellow
+    info_cyan, info_split, info_on_red, info_red, info_yellow, info_warning
 import os
 import glob
+import json
+import hashlib
+from time import sleep
 import numpy as np
 from mpi4py import MPI
 from utilities import get_methods, get_help
@@ -39,6 +42,11 @@ def compute_norms(err, vector_norms=["l2", "linf"],
             row.append(df.norm(err[field], norm_type=norm_type))
         table.append(row)
 
+    output_norms(table, headers, show=show, tablefmt=tablefmt, save=save)
+
+
+def output_norms(table, headers, show=True, tablefmt="simple", save=False):
+    """ Output table of norms to terminal and/or file. """
     from tabulate import tabulate
     tab_string = tabulate(table, headers, tablefmt=tablefmt, floatfmt="e")
     if show:
@@ -50,7 +58,27 @@ def compute_norms(err, vector_norms=["l2", "linf"],
             outfile.write(tab_string)
 
 
+def nodal_norms(err, M, K):
+    """ Norms of nodal (P1) errors for many steps at once.
+
+    err has shape (nodes, steps, components), and M and K are the P1 mass
+    and stiffness matrices. Returns dict from norm type to an array of the
+    norms at each step. """
+    num_nodes, num_steps, num_comps = err.shape
+    err_flat = err.reshape(num_nodes, -1)
+    L2_sq = (err_flat*(M*err_flat)).sum(axis=0).reshape(
+        num_steps, num_comps).sum(axis=1)
+    H1_semi_sq = (err_flat*(K*err_flat)).sum(axis=0).reshape(
+        num_steps, num_comps).sum(axis=1)
+    return dict(l2=np.sqrt((err**2).sum(axis=(0, 2))),
+                linf=np.abs(err).max(axis=(0, 2)),
+                L2=np.sqrt(L2_sq),
+                H1=np.sqrt(L2_sq + H1_semi_sq))
+
+
 def path_length(paths, total_length=True):
+    """ Length of polylines (2D), or area of triangles (3D), as returned by
+    zero_level_set. """
     lengths = []
     for x in paths:
         dim = x.shape[1]
@@ -58,13 +86,8 @@ def path_length(paths, total_length=True):
             dx = x[:-1, :]-x[1:, :]
             length = np.sum(np.sqrt(dx[:, 0]**2 + dx[:, 1]**2))
         if dim == 3:
-            # FIXME: This is actually an area...
-            # Heron's formula
-            a = np.linalg.norm(x[0, :] - x[1, :])
-            b = np.linalg.norm(x[1, :] - x[2, :])
-            c = np.linalg.norm(x[2, :] - x[0, :])
-            s = (a + b + c)/2.0
-            length = np.sqrt(s*(s-a)*(s-b)*(s-c))
+            length = 0.5*np.linalg.norm(np.cross(x[1, :]-x[0, :],
+                                                 x[2, :]-x[0, :]))
         lengths.append(length)
     if total_length:
         return sum(lengths)
@@ -103,9 +126,240 @@ def get_step_and_info(ts, time, step=0):
     return step, time
 
 
+class Analysis:
+    """ Base class for time-history analyses.
+
+    An analysis declares the steps it wants and the fields it needs in the
+    shared dolfin functions x_. It is fed one step at a time by
+    run_analyses, which reads every step once for all analyses in a
+    pipeline, and finally returns its output as tables.
+    """
+    def __init__(self, ts, x_, dt=None, time=None, fields=None, **options):
+        self.ts = ts
+        self.x_ = x_
+        self.dt = dt
+        self.time = time
+        # Fields needed in x_ (None means all fields in the time series).
+        self.fields = fields
+        # Further options that the output depends on.
+        self.options = options
+
+    @property
+    def steps(self):
+        """ Steps to analyze. Re-evaluated as the time series grows. """
+        return get_steps(self.ts, self.dt, self.time)
+
+    def process(self, step):
+        """ Analyze the current step. The functions in x_ are up to date.
+        Returns the data that should be stored for this step. """
+        return None
+
+    def tables(self, results):
+        """ Returns dict of filename: (header, data) to be stored in the
+        analysis folder, given a dict of step: data from process. """
+        return dict()
+
+
+def get_input_hash(ts, a, num_steps):
+    """ Hash of everything the output of the first num_steps steps of an
+    analysis depends on: its options, the parameters, the mesh and the
+    times of these steps. The steps that the time series has grown by since
+    do not enter. """
+    params_files = sorted(
+        glob.glob(ts.params_prefix + "*" + ts.params_suffix),
+        key=lambda f: int(f[len(ts.params_prefix):-len(ts.params_suffix)]))
+    md5 = hashlib.md5()
+    md5.update(repr((type(a).__name__, a.dt, a.time,
+                     sorted(a.options.items()),
+                     ts.mesh_hash())).encode())
+    md5.update(np.array(ts.times[:num_steps], dtype=float).tobytes())
+    with open(params_files[0], "rb") as params_file:
+        md5.update(params_file.read())
+    return md5.hexdigest()
+
+
+def get_state_file(ts, a):
+    return os.path.join(ts.analysis_folder,
+                        ".{}.state".format(type(a).__name__))
+
+
+def load_state(ts, a):
+    """ Load the state of a previous run of the analysis, if it can be
+    continued. Returns None otherwise. """
+    state_file = get_state_file(ts, a)
+    if not os.path.exists(state_file):
+        return None
+    with open(state_file, "r") as infile:
+        state = json.load(infile)
+    last_step = state["next_step"]-1
+    if bool(last_step >= len(ts) or
+            state["hash"] != get_input_hash(ts, a, state["next_step"]) or
+            not np.isclose(ts.times[last_step], state["time"]) or
+            not all([os.path.exists(os.path.join(ts.analysis_folder, f))
+                     for f in state["files"]])):
+        return None
+    return state
+
+
+def save_state(ts, a, steps, files):
+    state = dict(hash=get_input_hash(ts, a, max(steps)+1),
+                 next_step=max(steps)+1,
+                 time=ts.times[max(steps)],
+                 files=files)
+    with open(get_state_file(ts, a), "w") as outfile:
+        json.dump(state, outfile)
+
+
+def run_analyses(ts, x_, analyses, incremental=False):
+    """ Run all analyses in a single pass over the time series.
+
+    In parallel-over-time mode (ts.parallel_time), every process holds a
+    serial copy of the mesh and analyzes a contiguous block of the steps.
+    The results are gathered and sorted on rank 0.
+
+    If incremental, only steps that are newer than those processed in a
+    previous run (with the same inputs) are analyzed, and the new rows are
+    appended to the existing tables.
+    """
+    states = [None for _ in analyses]
+    if incremental:
+        if rank == 0:
+            states = [load_state(ts, a) for a in analyses]
+        states = comm.bcast(states, root=0)
+
+    steps_sets = [set([step for step in a.steps
+                       if state is None or step >= state["next_step"]])
+                  for a, state in zip(analyses, states)]
+    steps = sorted(set.union(*steps_sets))
+    if ts.parallel_time:
+        # Contiguous blocks, so that analyses that follow the steps in
+        # sequence (e.g. droplet tracking) are split as little as possible
+        steps = steps[rank*len(steps)//size:(rank+1)*len(steps)//size]
+
+    fields = set()
+    for a, steps_set in zip(analyses, steps_sets):
+        if len(steps_set) > 0:
+            fields.update(a.fields if a.fields is not None else ts.fields)
+
+    results = [dict() for _ in analyses]
+    for step in steps:
+        info("Step {} of {}".format(step, len(ts)))
+
+        for field in fields:
+            ts.update(x_[field], field, step)
+
+        for a, steps_set, results_a in zip(analyses, steps_sets, results):
+            if step in steps_set:
+                results_a[step] = a.process(step)
+
+    if ts.parallel_time:
+        results_gathered = comm.gather(results, root=0)
+        if rank == 0:
+            results = [dict() for _ in analyses]
+            for results_proc in results_gathered:
+                for results_a, results_proc_a in zip(results, results_proc):
+                    results_a.update(results_proc_a)
+
+    for a, steps_set, state, results_a in zip(
+            analyses, steps_sets, states, results):
+        if len(steps_set) == 0:
+            if state is not None:
+                info("No new steps for " + type(a).__name__ + ".")
+            continue
+        if ts.parallel_time and rank != 0:
+            continue
+        tables = a.tables(results_a)
+        if rank == 0:
+            for filename, (header, data) in tables.items():
+                if state is not None:
+                    with open(os.path.join(ts.analysis_folder, filename),
+                              "ab") as outfile:
+                        np.savetxt(outfile, data)
+                else:
+                    with open(os.path.join(ts.analysis_folder, filename),
+                              "wb") as outfile:
+                        np.savetxt(outfile, data, header=header)
+            save_state(ts, a, steps_set, list(tables.keys()))
+    comm.Barrier()
+
+
+def get_module(method, scripts_folder):
+    return __import__("{}.{}".format(scripts_folder, method)).__dict__[method]
+
+
+def get_analyses(method, methods, scripts_folder, ts, x_, cmd_kwargs):
+    """ Set up the analyses given by method, separated by commas. Analyses
+    that do not apply to the time series (their factory returns None) are
+    skipped. """
+    analyses = []
+    for method_i in method.split(","):
+        if method_i not in methods:
+            info_on_red("The specified analysis method doesn't exist: " +
+                        method_i)
+            exit()
+        m = get_module(method_i, scripts_folder)
+        if "analysis" not in m.__dict__:
+            info_on_red("The analysis method " + method_i +
+                        " cannot be run in a pipeline.")
+            exit()
+        m.description(ts, **cmd_kwargs)
+        a = m.analysis(ts, x_, **cmd_kwargs)
+        if a is None:
+            info_warning("Skipping the analysis " + method_i + ".")
+            continue
+        analyses.append(a)
+    return analyses
+
+
+def call_pipeline(method, methods, scripts_folder, ts, cmd_kwargs):
+    """ Run several analyses, separated by commas, in a single pass.
+
+    With incremental=True, only new steps are analyzed. With follow=True,
+    the time series folder of a running simulation is polled every
+    follow_intv seconds and the analyses are updated with the new steps.
+    """
+    incremental = cmd_kwargs.get("incremental", False)
+    follow = cmd_kwargs.get("follow", False)
+    follow_intv = cmd_kwargs.get("follow_intv", 10.)
+
+    x_ = ts.functions()
+    analyses = get_analyses(method, methods, scripts_folder, ts, x_,
+                            cmd_kwargs)
+    if len(analyses) == 0:
+        info_on_red("None of the specified analyses apply.")
+        return
+    run_analyses(ts, x_, analyses, incremental=incremental or follow)
+
+    if follow:
+        info_cyan("Following " + ts.folder + ". Stop with Ctrl+C.")
+        try:
+            while True:
+                sleep(follow_intv)
+                if ts.refresh():
+                    run_analyses(ts, x_, analyses, incremental=True)
+        except KeyboardInterrupt:
+            info("Stopped following.")
+
+
+def supports_pipeline(method, methods, scripts_folder):
+    """ Check whether all (comma-separated) methods are analyses that can
+    run in a pipeline. """
+    return all([method_i in methods and
+                "analysis" in get_module(method_i, scripts_folder).__dict__
+                for method_i in method.split(",")])
+
+
 def call_method(method, methods, scripts_folder, ts, cmd_kwargs):
-    # Call the specified method
-    if method[-1] == "?" and method[:-1] in methods:
+    # Call the specified method. Several methods (separated by commas), or
+    # incremental and follow mode, go through the pipeline.
+    use_pipeline = ("," in method or cmd_kwargs.get("incremental", False)
+                    or cmd_kwargs.get("follow", False))
+    if use_pipeline and supports_pipeline(method, methods, scripts_folder):
+        call_pipeline(method, methods, scripts_folder, ts, cmd_kwargs)
+    elif use_pipeline and "," in method:
+        info_on_red("The specified analysis methods cannot all be run in "
+                    "a pipeline.")
+    elif method[-1] == "?" and method[:-1] in methods:
         m = __import__("{}.{}".format(scripts_folder,
                                       method[:-1])).__dict__[method[:-1]]
         m.description(ts, **cmd_kwargs)
@@ -139,12 +393,23 @@ def main():
         info("No folder(=[...]) specified.")
         exit()
 
+    method = cmd_kwargs.get("method", "geometry_in_time")
+
+    # Parallel over time: every process gets a serial copy of the mesh
+    # and a disjoint subset of the steps.
+    ts_comm = comm
+    if cmd_kwargs.get("parallel_time", False) and size > 1:
+        if supports_pipeline(method, methods, scripts_folder):
+            ts_comm = MPI.COMM_SELF
+        else:
+            info_red("Method does not support parallel_time; "
+                     "parallelizing over space instead.")
+
     sought_fields_str = (", ".join(sought_fields)
                          if sought_fields is not None else "All")
     info_split("Sought fields:", sought_fields_str)
-    ts = TimeSeries(folder, sought_fields=sought_fields)
+    ts = TimeSeries(folder, sought_fields=sought_fields, comm=ts_comm)
     info_split("Found fields:", ", ".join(ts.fields))
-    method = cmd_kwargs.get("method", "geometry_in_time")
 
     if len(ts.fields) == 0:
         info_on_red("Found no data.")
@@ -1,6 +1,7 @@
 import dolfin as df
 from common import *
 from common.cmd import info_cyan, info_blue, info_red, info_green, info_error
+from common.sequencing import stage_parameters
 
 """
 This module contains general functions that can or should be overloaded by
@@ -36,13 +37,20 @@ parameters = dict(
     info_intv=10,
     use_iterative_solvers=False,
     use_pressure_stabilization=False,
+    pspg=False,  # PSPG, for equal-order base_elements (e.g. P1-P1)
+    transport_stabilization=False,  # False, "supg" or "edge"
+    edge_stabilization_coeff=0.01,
     dump_subdomains=False,
     V_lagrange=False,
     p_lagrange=False,
+    V_nullspace=False,  # alternative to V_lagrange, see common/nullspace.py
+    p_nullspace=False,
     base_elements=base_elements,
     c_cutoff=0.,
     q_rhs=dict(),
-    EC_scheme="NL2",
+    EC_scheme="NL2",  # NL1, NL2, L1, L2 or Gummel (decoupled)
+    gummel_iterations=1,
+    EC_substeps=1,  # EC substeps per timestep, see basic.solve_EC_substeps
     grav_dir=[1., 0],
     pf_mobility_coeff=1.,
     friction_coeff=0.,
@@ -53,6 +61,9 @@ parameters = dict(
     density_per_concentration=None,
     viscosity_per_concentration=None,
     comoving_velocity=[0., 0., 0.],
+    follow_droplet=False,  # update comoving_velocity to follow phi < 0
+    # (walls at rest in the lab: LabFixed velocity BCs, see common.bcs)
+    follow_relaxation=1.,
     testing=False,
     tstep=0,
     enable_PF=True,
@@ -61,6 +72,19 @@ parameters = dict(
     save_intv=5,
     checkpoint_intv=50,
     stat_intv=5,
+    insitu=[],  # in-situ analyses, see common/insitu.py
+    probe_points=[],
+    stat_buffer=10,
+    stat_hdf5=False,
+    contact_wall=None,  # boundary on which to track the contact line
+    contact_intv=1,
+    adapt_intv=False,  # adapt the mesh every adapt_intv timesteps
+    adapt_levels=2,
+    adapt_phi_threshold=0.9,
+    adapt_grad_c=None,
+    adapt_residual=None,  # mark where the residual indicator > this*max
+    mesh_stages=[],  # coarse spin-up stages, see common/sequencing.py
+    stage=0,
     solve_initial=False
 )
 
@@ -110,9 +134,9 @@ def import_problem_hook(parameters, mesh, cmd_kwargs, **namespace):
     """ Called after importing problem. """
     internalize_cmd_kwargs(parameters, cmd_kwargs)
 
-    # Internalize the mesh
+    # Internalize the mesh (of the current mesh stage, if any)
     if callable(mesh):
-        mesh = mesh(**parameters)
+        mesh = mesh(**stage_parameters(parameters))
     assert(isinstance(mesh, df.Mesh))
 
     namespace_dict = dict(mesh=mesh)
@@ -243,6 +243,14 @@ def start_hook(newfolder, **namespace):
     return dict(statsfile=statsfile)
 
 
+def end_hook(x_, enable_NS, dx, **namespace):
+    u_mean = 0.
+    if enable_NS:
+        u_mean = (df.assemble(x_["u"][0]*dx) /
+                  df.assemble(df.Constant(1.)*dx))
+    info("Mean velocity = {:e}".format(u_mean))
+
+
 def reference(t_0, front_position_init, inlet_velocity, interface_thickness,
               **namespace):
     """ This contains the analytical reference for convergence analysis. """
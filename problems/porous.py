@@ -1,9 +1,7 @@
 import dolfin as df
-import os
 from . import *
-from common.io import mpi_is_root, load_mesh
+from common.io import load_mesh
 from common.bcs import Fixed, Pressure, Charged
-from ufl import sign
 import numpy as np
 __author__ = "Gaute Linga"
 
@@ -84,7 +82,8 @@ def problem():
         enable_PF=True,
         enable_EC=True,
         save_intv=5,
-        stats_intv=5,
+        stat_intv=5,
+        insitu=["geometry"],  # volume and centre of mass of phi < 0
         checkpoint_intv=50,
         tstep=0,
         dt=0.08,
@@ -269,25 +268,8 @@ def initial_velocity(inlet_velocity, function_space):
     return u_init
 
 
-def tstep_hook(t, tstep, stats_intv, statsfile, field_to_subspace,
-               field_to_subproblem, subproblems, w_,
-               enable_PF,
-               **namespace):
+def tstep_hook(t, tstep, **namespace):
     info_blue("Timestep = {}".format(tstep))
-    if enable_PF and stats_intv and tstep % stats_intv == 0:
-        # GL: Seems like a rather awkward way of doing this,
-        # but any other way seems to fuck up the simulation.
-        # Anyhow, a better idea could be to move some of this to a post-processing stage.
-        # GL: Move into common/utilities at a certain point.
-        subproblem_name, subproblem_i = field_to_subproblem["phi"]
-        phi = w_[subproblem_name].split(deepcopy=True)[subproblem_i]
-        bubble = 0.5*(1.-sign(phi))
-        mass = df.assemble(bubble*df.dx)
-        massy = df.assemble(
-            bubble*df.Expression("x[1]", degree=1)*df.dx)
-        if mpi_is_root():
-            with open(statsfile, "a") as outfile:
-                outfile.write("{} {} {} \n".format(t, mass, massy))
 
 
 def pf_mobility(phi, gamma):
@@ -297,7 +279,3 @@ def pf_mobility(phi, gamma):
     # return 0.75 * gamma * 0.5 * (1. + df.sign(func)) * func
     return gamma
 
-
-def start_hook(newfolder, **namespace):
-    statsfile = os.path.join(newfolder, "Statistics/stats.dat")
-    return dict(statsfile=statsfile)
@@ -214,8 +214,13 @@ def start_hook(newfolder, **namespace):
     return dict(statsfile=statsfile)
 
 
-def end_hook(x_, enable_NS, dx, **namespace):
+def end_hook(x_, enable_NS, enable_PF, dx, **namespace):
     u_norm = 0.
     if enable_NS:
         u_norm = df.assemble(df.dot(x_["u"], x_["u"])*dx)
     info("Velocity norm = {:e}".format(u_norm))
+    if enable_NS and enable_PF:
+        bubble = 0.5*(1.-x_["phi"])
+        u_rise = (df.assemble(bubble*x_["u"][2]*dx) /
+                  df.assemble(bubble*dx))
+        info("Rise velocity = {:e}".format(u_rise))
@@ -0,0 +1,205 @@
+import dolfin as df
+import os
+from . import *
+from common.io import mpi_is_root
+from common.bcs import Fixed, FreeSlip
+from common.functions import max_value
+import numpy as np
+__author__ = "Gaute Linga"
+
+
+class Axis(df.SubDomain):
+    def inside(self, x, on_boundary):
+        return bool(df.near(x[0], 0.) and on_boundary)
+
+
+class Top(df.SubDomain):
+    def __init__(self, Lz):
+        self.Lz = Lz
+        df.SubDomain.__init__(self)
+
+    def inside(self, x, on_boundary):
+        return bool(df.near(x[1], self.Lz) and on_boundary)
+
+
+class Bottom(df.SubDomain):
+    def inside(self, x, on_boundary):
+        return bool(df.near(x[1], 0.) and on_boundary)
+
+
+class Wall(df.SubDomain):
+    def __init__(self, R, Lz):
+        self.R = R
+        self.Lz = Lz
+        df.SubDomain.__init__(self)
+
+    def inside(self, x, on_boundary):
+        return bool(df.near(x[0], self.R)
+                    and not df.near(x[1], self.Lz)
+                    and not df.near(x[1], 0.)
+                    and on_boundary)
+
+
+def problem():
+    info_cyan("Rising bubble, axisymmetric (meridian plane of simple_3D).")
+
+    # Define solutes
+    # Format: name, valency, diffusivity in phase 1, diffusivity in phase
+    #         2, beta in phase 1, beta in phase 2
+    solutes = [["c_p",  1, 0.0001, 0.1, 2., 0.],
+               ["c_m", -1, 0.0001, 0.1, 2., 0.]]
+
+    # Format: name : (family, degree, is_vector)
+    base_elements = dict(u=["Lagrange", 2, True],
+                         p=["Lagrange", 1, False],
+                         phi=["Lagrange", 1, False],
+                         g=["Lagrange", 1, False],
+                         c=["Lagrange", 1, False],
+                         V=["Lagrange", 1, False])
+
+    # Default parameters to be loaded unless starting from checkpoint.
+    parameters = dict(
+        solver="basic_axisym",
+        folder="results_simple_axisym",
+        restart_folder=False,
+        enable_NS=True,
+        enable_PF=True,
+        enable_EC=True,
+        save_intv=5,
+        stats_intv=5,
+        checkpoint_intv=50,
+        tstep=0,
+        dt=0.005,
+        t_0=0.,
+        T=20.,
+        grid_spacing=1./64.,
+        interface_thickness=0.02,
+        solutes=solutes,
+        base_elements=base_elements,
+        R=0.5,
+        Lz=1.,
+        rad_init=0.25,
+        #
+        V_top=1.,
+        V_btm=0.,
+        surface_tension=5.0,
+        grav_const=0.98,
+        grav_dir=[0., -1.],
+        concentration_init=4.5,
+        #
+        pf_mobility_coeff=0.000010,
+        density=[1000., 100.],
+        viscosity=[10., 1.],
+        permittivity=[1., 10.],
+        #
+        use_iterative_solvers=False,
+        use_pressure_stabilization=False
+    )
+    return parameters
+
+
+def constrained_domain(**namespace):
+    return None
+
+
+def mesh(R=0.5, Lz=1., grid_spacing=1./16, **namespace):
+    return df.RectangleMesh(df.Point(0., 0.), df.Point(R, Lz),
+                            int(R/grid_spacing), int(Lz/grid_spacing))
+
+
+def initialize(Lz, rad_init, concentration_init,
+               interface_thickness, solutes, restart_folder,
+               field_to_subspace,
+               enable_NS, enable_PF, enable_EC, **namespace):
+    """ Create the initial state: a bubble centred on the axis. """
+    w_init_field = dict()
+    if not restart_folder:
+        # Phase field
+        if enable_PF:
+            w_init_field["phi"] = initial_phasefield(
+                Lz/2, rad_init, interface_thickness,
+                field_to_subspace["phi"].collapse())
+
+        # Electrochemistry
+        if enable_EC:
+            c_init = initial_phasefield(
+                Lz/2, rad_init, interface_thickness,
+                field_to_subspace[solutes[0][0]].collapse())
+            c_init.vector()[:] = 0.5*(
+                1.-c_init.vector().get_local()) * concentration_init
+            for solute in solutes:
+                w_init_field[solute[0]] = c_init
+            V_init_expr = df.Expression("x[1]/Lz", Lz=Lz, degree=1)
+            w_init_field["V"] = df.interpolate(
+                V_init_expr, field_to_subspace["V"].collapse())
+
+    return w_init_field
+
+
+def create_bcs(R, Lz, V_top, V_btm,
+               enable_NS, enable_PF, enable_EC, **namespace):
+    """ The boundaries and boundary conditions are defined here. """
+    boundaries = dict(
+        axis=[Axis()],
+        wall=[Wall(R, Lz)],
+        top=[Top(Lz)],
+        bottom=[Bottom()]
+    )
+
+    bcs = dict()
+    bcs_pointwise = dict()
+    bcs["axis"] = dict()
+    bcs["wall"] = dict()
+    bcs["top"] = dict()
+    bcs["bottom"] = dict()
+
+    noslip = Fixed((0., 0.))
+    if enable_NS:
+        bcs["axis"]["u"] = FreeSlip(0., 0)
+        bcs["top"]["u"] = noslip
+        bcs["bottom"]["u"] = noslip
+        bcs["wall"]["u"] = noslip
+        bcs_pointwise["p"] = (0., "x[0] < DOLFIN_EPS && x[1] < DOLFIN_EPS")
+
+    if enable_EC:
+        bcs["top"]["V"] = Fixed(V_top)
+        bcs["bottom"]["V"] = Fixed(V_btm)
+
+    return boundaries, bcs, bcs_pointwise
+
+
+def initial_phasefield(z0, rad, eps, function_space):
+    expr_str = ("tanh((sqrt(pow(x[0],2)+pow(x[1]-z0,2))-rad)"
+                "/(sqrt(2)*eps))")
+    phi_init_expr = df.Expression(expr_str, z0=z0, rad=rad, eps=eps,
+                                  degree=2)
+    phi_init = df.interpolate(phi_init_expr, function_space)
+    return phi_init
+
+
+def tstep_hook(t, tstep, **namespace):
+    info_blue("Timestep = {}".format(tstep))
+
+
+def pf_mobility(phi, gamma):
+    """ Phase field mobility function. """
+    func = 1.-phi**2
+    return 0.75 * gamma * max_value(0., func)
+
+
+def end_hook(x_, enable_NS, enable_PF, dx, **namespace):
+    r = df.SpatialCoordinate(x_["u"].function_space().mesh())[0]
+    u_norm = 0.
+    if enable_NS:
+        u_norm = df.assemble(df.dot(x_["u"], x_["u"])*r*dx)
+    info("Velocity norm = {:e}".format(u_norm))
+    if enable_NS and enable_PF:
+        bubble = 0.5*(1.-x_["phi"])
+        u_rise = (df.assemble(bubble*x_["u"][1]*r*dx) /
+                  df.assemble(bubble*r*dx))
+        info("Rise velocity = {:e}".format(u_rise))
+
+
+def start_hook(newfolder, **namespace):
+    statsfile = os.path.join(newfolder, "Statistics/stats.dat")
+    return dict(statsfile=statsfile)
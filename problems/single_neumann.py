@@ -48,6 +48,7 @@ def problem():
         viscosity=[0.001, 0.001],
         permittivity=[2., 2.],
         surface_charge=5.0,
+        net_charge=0.,  # total charge of bulk and surface
         composition=[0.1, 0.9],  # must sum to one
         #
         EC_scheme="NL2",
@@ -101,6 +102,7 @@ def initialize(Lx, Ly,
 def create_bcs(Lx, Ly, mesh,
                surface_charge, solutes, enable_NS, enable_EC,
                V_lagrange, p_lagrange,
+               V_nullspace, p_nullspace,
                **namespace):
     """ The boundaries and boundary conditions are defined here. """
 
@@ -141,13 +143,13 @@ def create_bcs(Lx, Ly, mesh,
     if enable_NS:
         bcs["obstacles"]["u"] = noslip
 
-        if not p_lagrange:
+        if not (p_lagrange or p_nullspace):
             bcs_pointwise["p"] = (0., pin_code)
 
     if enable_EC:
         bcs["obstacles"]["V"] = Charged(surface_charge)
 
-        if not V_lagrange:
+        if not (V_lagrange or V_nullspace):
             bcs_pointwise["V"] = (0., pin_code)
 
     return boundaries, bcs, bcs_pointwise
@@ -171,6 +173,7 @@ def start_hook(w_, x_,
                boundary_to_mark,
                dx, ds,
                surface_charge, solutes,
+               net_charge=0.,
                **namespace):
     total_surface_charge = df.assemble(
         df.Constant(surface_charge)*ds(
@@ -178,7 +181,7 @@ def start_hook(w_, x_,
     info("Total surface charge: {}".format(total_surface_charge))
     total_bulk_charge = integrate_bulk_charge(x_, solutes, dx)
     info("Total bulk charge:    {}".format(total_bulk_charge))
-    rescale_factor = -total_surface_charge/total_bulk_charge
+    rescale_factor = (net_charge-total_surface_charge)/total_bulk_charge
     info("Rescale factor:       {}".format(rescale_factor))
     
     subproblem = field_to_subproblem[solutes[0][0]][0]
@@ -190,3 +193,20 @@ def start_hook(w_, x_,
 
     statsfile = os.path.join(newfolder, "Statistics/stats.dat")
     return dict(statsfile=statsfile)
+
+
+def end_hook(x_, enable_NS, enable_EC, dx, **namespace):
+    """ Norms of the final state; the pressure and the electric potential
+    are determined up to constants, and measured relative to their means. """
+    volume = df.assemble(df.Constant(1.)*dx)
+    norms = dict(u=0., p=0., V=0.)
+    fields = []
+    if enable_NS:
+        norms["u"] = df.assemble(df.dot(x_["u"], x_["u"])*dx)
+        fields.append("p")
+    if enable_EC:
+        fields.append("V")
+    for field in fields:
+        mean = df.assemble(x_[field]*dx)/volume
+        norms[field] = df.assemble((x_[field]-mean)**2*dx)
+    info("Final norms: u = {u:e} p = {p:e} V = {V:e}".format(**norms))
@@ -274,6 +274,8 @@ def end_hook(x_, t,
 
         output = "Final error norms:"
         for field in ["u", "phi", "c_p", "c_m", "V"]:
+            if field not in exprs:
+                continue
             f = df.project(x_[field],
                            field_to_subspace[field].collapse())
             f_ref = exprs[field]
@@ -26,6 +26,7 @@ from common.functions import ramp, dramp, diff_pf_potential, \
 from common.cmd import info_red
 from common.io import mpi_barrier
 from .basic import unit_interval_filter  # GL: Move this to common.functions?
+from .basic import solve_EC_substeps
 from . import *
 from . import __all__
 import numpy as np
@@ -163,6 +164,7 @@ def setup(tstep, test_functions, trial_functions, w_, w_1,
           grav_const, grav_dir, pf_mobility, pf_mobility_coeff,
           use_iterative_solvers,
           solve_initial,
+          EC_substeps=1,
           **namespace):
     """ Set up problem. """
 
@@ -210,7 +212,7 @@ def setup(tstep, test_functions, trial_functions, w_, w_1,
                                  neumann_bcs, boundary_to_mark,
                                  c_1,
                                  u_1, K_, veps_, phi_flt_, rho_1,
-                                 dt, z, dbeta,
+                                 dt/EC_substeps, z, dbeta,
                                  enable_NS, enable_PF,
                                  use_iterative_solvers)
 
@@ -467,6 +469,7 @@ def setup_NSp(w_NSp, p, q,
 
 def solve(tstep, w_, w_1, w_tmp, solvers,
           enable_PF, enable_EC, enable_NS,
+          EC_substeps=1,
           **namespace):
     """ Solve equations. """
     timer_outer = df.Timer("Solve system")
@@ -478,7 +481,8 @@ def solve(tstep, w_, w_1, w_tmp, solvers,
     if enable_EC:
         timer_inner = df.Timer("Solve subproblem EC")
         mpi_barrier()
-        solvers["EC"].solve()
+        solve_EC_substeps(solvers["EC"], w_["EC"], w_1["EC"], w_tmp["EC"],
+                          EC_substeps)
         timer_inner.stop()
     if enable_NS:
         # Step 1: Predict u
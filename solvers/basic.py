@@ -21,8 +21,12 @@ GL, 2017-05-29
 import dolfin as df
 import math
 from common.functions import ramp, dramp, diff_pf_potential_linearised, \
-    unit_interval_filter, diff_pf_contact_linearised, pf_potential, alpha
+    unit_interval_filter, diff_pf_contact_linearised, pf_potential, alpha, \
+    pspg_tau, stabilize_transport
 from common.io import mpi_barrier, info_red
+from common.bcs import set_frame_velocity
+from common.insitu import DropletFrame
+from common.nullspace import NullspaceSolver, charge_nullspace
 import numpy as np
 from . import *
 from . import __all__
@@ -66,18 +70,39 @@ def setup(mesh, test_functions, trial_functions,
           comoving_velocity,
           p_lagrange,
           q_rhs,
+          parameters,
+          p_nullspace=False,
+          V_nullspace=False,
+          follow_droplet=False,
+          follow_relaxation=1.,
+          bcs=None,
+          transport_stabilization=False,
+          edge_stabilization_coeff=0.01,
+          EC_substeps=1,
+          pspg=False,
           **namespace):
     """ Set up problem. """
     # Constant
     dim = mesh.geometry().dim()
     sigma_bar = surface_tension*3./(2*math.sqrt(2))
     per_tau = df.Constant(1./dt)
+    per_tau_EC = df.Constant(EC_substeps/dt)  # EC is subcycled
     grav = df.Constant(tuple(grav_const*np.array(grav_dir[:dim])))
     gamma = pf_mobility_coeff
     eps = interface_thickness
     fric = df.Constant(friction_coeff)
     u_comoving = df.Constant(tuple(comoving_velocity[:dim]))
-    
+    if bcs is not None:
+        # Lab-frame velocities (LabFixed) are imposed relative to the frame
+        set_frame_velocity(bcs, comoving_velocity)
+    if p_lagrange and p_nullspace:
+        info_red("Use either p_lagrange or p_nullspace, not both.")
+        exit()
+    if transport_stabilization not in (False, "supg", "edge"):
+        info_red("Unknown transport_stabilization: " +
+                 str(transport_stabilization))
+        exit()
+
     # Navier-Stokes
     u_ = p_ = None
     u_1 = p_1 = None
@@ -163,7 +188,9 @@ def setup(mesh, test_functions, trial_functions,
                                  phi_1, u_1, M_1, c_1, V_1,
                                  per_tau, sigma_bar, eps, dbeta, dveps,
                                  enable_NS, enable_EC,
-                                 use_iterative_solvers, q_rhs)
+                                 use_iterative_solvers, q_rhs,
+                                 transport_stabilization,
+                                 edge_stabilization_coeff)
 
     if enable_EC:
         solvers["EC"] = setup_EC(w_["EC"], c, V, b, U, rho_e,
@@ -172,13 +199,15 @@ def setup(mesh, test_functions, trial_functions,
                                  boundary_to_mark,
                                  c_1, u_1, K_, veps_, phi_flt_,
                                  solutes,
-                                 per_tau, z, dbeta,
+                                 per_tau_EC, z, dbeta,
                                  enable_NS, enable_PF,
                                  use_iterative_solvers,
-                                 q_rhs)
+                                 q_rhs, V_nullspace,
+                                 transport_stabilization,
+                                 edge_stabilization_coeff)
 
     if enable_NS:
-        solvers["NS"] = setup_NS(w_["NS"], u, p, v, q, p0, q0,
+        solvers["NS"] = setup_NS(w_["NS"], u, p, v, q, p0, q0, mesh,
                                  dx, ds, normal,
                                  dirichlet_bcs["NS"], neumann_bcs,
                                  boundary_to_mark,
@@ -194,11 +223,20 @@ def setup(mesh, test_functions, trial_functions,
                                  use_iterative_solvers,
                                  use_pressure_stabilization,
                                  p_lagrange,
-                                 q_rhs)
-    return dict(solvers=solvers)
+                                 q_rhs, p_nullspace, pspg)
 
+    # Frame following the droplet (phi < 0)
+    droplet_frame = None
+    if follow_droplet:
+        if not (enable_PF and enable_NS):
+            info_red("Following the droplet requires PF and NS.")
+            exit()
+        droplet_frame = DropletFrame(u_comoving, w_["NS"], w_1["NS"], phi_,
+                                     parameters, bcs, follow_relaxation)
+    return dict(solvers=solvers, droplet_frame=droplet_frame)
 
-def setup_NS(w_NS, u, p, v, q, p0, q0,
+
+def setup_NS(w_NS, u, p, v, q, p0, q0, mesh,
              dx, ds, normal,
              dirichlet_bcs, neumann_bcs, boundary_to_mark,
              u_1, phi_, rho_, rho_1, g_, M_, mu_, rho_e_,
@@ -210,8 +248,11 @@ def setup_NS(w_NS, u, p, v, q, p0, q0,
              enable_PF, enable_EC,
              use_iterative_solvers, use_pressure_stabilization,
              p_lagrange,
-             q_rhs):
-    """ Set up the Navier-Stokes subproblem. """
+             q_rhs, p_nullspace=False, pspg=False):
+    """ Set up the Navier-Stokes subproblem. With pspg, the continuity
+    equation is stabilized by PSPG, which allows equal-order elements.
+    With p_nullspace, the pressure is determined up to a constant, and set
+    to zero mean. """
     # F = (
     #     per_tau * rho_ * df.dot(u - u_1, v)*dx
     #     + rho_*df.inner(df.grad(u), df.outer(u_1, v))*dx
@@ -263,12 +304,36 @@ def setup_NS(w_NS, u, p, v, q, p0, q0,
     if "u" in q_rhs:
         F += -df.dot(q_rhs["u"], v)*dx
 
+    if pspg:
+        # Strong momentum residual
+        R = (per_tau * rho_1 * (u - u_1)
+             + df.dot(mom_1, df.nabla_grad(u))
+             - df.div(2*mu_*df.sym(df.nabla_grad(u)))
+             + df.grad(p)
+             + fric*mu_*(u + u_comoving)
+             - rho_*grav)
+        if enable_PF:
+            R += phi_*df.grad(g_)
+        if enable_EC:
+            for ci_, ci_1, dbetai, solute in zip(c_, c_1, dbeta, solutes):
+                R += df.grad(ci_) + solute[1]*ci_1*df.grad(V_)
+                if enable_PF:
+                    R += ci_*dbetai*df.grad(phi_)
+        if "u" in q_rhs:
+            R += -q_rhs["u"]
+        tau = pspg_tau(mesh, u_1 + u_comoving, rho_1, mu_, 1./per_tau)
+        F += tau*df.dot(R, df.grad(q))*dx
+
+    if p_nullspace:
+        return NullspaceSolver(F, w_NS, dirichlet_bcs, [1],
+                               use_iterative_solvers=use_iterative_solvers)
+
     a, L = df.lhs(F), df.rhs(F)
 
     problem = df.LinearVariationalProblem(a, L, w_NS, dirichlet_bcs)
     solver = df.LinearVariationalSolver(problem)
 
-    if use_iterative_solvers and use_pressure_stabilization:
+    if use_iterative_solvers and (use_pressure_stabilization or pspg):
         solver.parameters["linear_solver"] = "gmres"
         #solver.parameters["preconditioner"] = "jacobi"
         #solver.parameters["preconditioner"] = "ilu"
@@ -284,8 +349,11 @@ def setup_PF(w_PF, phi, g, psi, h,
              dbeta, dveps,
              enable_NS, enable_EC,
              use_iterative_solvers,
-             q_rhs):
-    """ Set up phase field subproblem. """
+             q_rhs,
+             transport_stabilization=False,
+             edge_stabilization_coeff=0.01):
+    """ Set up phase field subproblem. The advection may be stabilized by
+    SUPG or edge stabilization (transport_stabilization). """
 
     F_phi = (per_tau*(phi-unit_interval_filter(phi_1))*psi*dx +
              M_1*df.dot(df.grad(g), df.grad(psi))*dx)
@@ -311,6 +379,17 @@ def setup_PF(w_PF, phi, g, psi, h,
 
     if "phi" in q_rhs:        
         F_phi += -q_rhs["phi"]*psi*dx
+
+    if enable_NS and transport_stabilization:
+        R_phi = (per_tau*(phi-unit_interval_filter(phi_1))
+                 + df.dot(u_1, df.grad(phi))
+                 - df.div(M_1*df.grad(g)))
+        if "phi" in q_rhs:
+            R_phi += -q_rhs["phi"]
+        F_phi += stabilize_transport(
+            transport_stabilization, R_phi, phi, psi, u_1,
+            M_1*sigma_bar/eps, 1./per_tau, w_PF.function_space().mesh(),
+            edge_stabilization_coeff)
     
     F = F_phi + F_g
     a, L = df.lhs(F), df.rhs(F)
@@ -333,8 +412,16 @@ def setup_EC(w_EC, c, V, b, U, rho_e,
              per_tau, z, dbeta,
              enable_NS, enable_PF,
              use_iterative_solvers,
-             q_rhs):
-    """ Set up electrochemistry subproblem. """
+             q_rhs, V_nullspace=False,
+             transport_stabilization=False,
+             edge_stabilization_coeff=0.01):
+    """ Set up electrochemistry subproblem. With V_nullspace, the electric
+    potential is determined up to a constant, and set to zero mean; the
+    system must be closed, and a net charge is cancelled by a uniform
+    background charge, as with V_lagrange. The
+    advection may be stabilized by SUPG or edge stabilization
+    (transport_stabilization). """
+    mesh = w_EC.function_space().mesh()
     F_c = []
     for ci, ci_1, bi, Ki_, zi, dbetai, solute in zip(
             c, c_1, b, K_, z, dbeta, solutes):
@@ -355,6 +442,20 @@ def setup_EC(w_EC, c, V, b, U, rho_e,
         if solute[0] in q_rhs:
             F_ci += - q_rhs[solute[0]]*bi*dx
 
+        if enable_NS and transport_stabilization:
+            # Strong residual of the Nernst-Planck equation
+            R_ci = (per_tau*(ci-ci_1) + df.dot(u_1, df.grad(ci))
+                    - df.div(Ki_*df.grad(ci)))
+            if zi != 0:
+                R_ci += -df.div(Ki_*zi*ci_1*df.grad(V))
+            if enable_PF:
+                R_ci += -df.div(Ki_*ci*dbetai*df.grad(phi_))
+            if solute[0] in q_rhs:
+                R_ci += -q_rhs[solute[0]]
+            F_ci += stabilize_transport(
+                transport_stabilization, R_ci, ci, bi, u_1, Ki_,
+                1./per_tau, mesh, edge_stabilization_coeff)
+
         F_c.append(F_ci)
     F_V = veps_*df.dot(df.nabla_grad(V), df.nabla_grad(U))*dx
     for boundary_name, sigma_e in neumann_bcs["V"].items():
@@ -365,6 +466,15 @@ def setup_EC(w_EC, c, V, b, U, rho_e,
         F_V += q_rhs["V"]*U*dx
 
     F = sum(F_c) + F_V
+    if V_nullspace:
+        kwargs, background = charge_nullspace(
+            z, c_1, 1./float(per_tau), solutes, q_rhs, neumann_bcs,
+            boundary_to_mark, dx, ds, dirichlet_bcs)
+        F += background*U*dx
+        return NullspaceSolver(F, w_EC, dirichlet_bcs, [len(c)],
+                               use_iterative_solvers=use_iterative_solvers,
+                               **kwargs)
+
     a, L = df.lhs(F), df.rhs(F)
 
     problem = df.LinearVariationalProblem(a, L, w_EC, dirichlet_bcs)
@@ -377,7 +487,8 @@ def setup_EC(w_EC, c, V, b, U, rho_e,
     return solver
 
 
-def solve(w_, solvers, enable_PF, enable_EC, enable_NS, **namespace):
+def solve(w_, w_1, w_tmp, solvers, enable_PF, enable_EC, enable_NS,
+          EC_substeps=1, **namespace):
     """ Solve equations. """
     timer_outer = df.Timer("Solve system")
     for subproblem, enable in zip(["PF", "EC", "NS"],
@@ -385,14 +496,34 @@ def solve(w_, solvers, enable_PF, enable_EC, enable_NS, **namespace):
         if enable:
             timer_inner = df.Timer("Solve subproblem " + subproblem)
             mpi_barrier()
-            solvers[subproblem].solve()
+            if subproblem == "EC":
+                solve_EC_substeps(solvers["EC"], w_["EC"], w_1["EC"],
+                                  w_tmp["EC"], EC_substeps)
+            else:
+                solvers[subproblem].solve()
             timer_inner.stop()
 
     timer_outer.stop()
 
 
+def solve_EC_substeps(solver, w_EC, w_1_EC, w_tmp_EC, EC_substeps):
+    """ Solve the EC subproblem in EC_substeps substeps of dt/EC_substeps,
+    with the other subproblems frozen. The EC solution at the start of the
+    step is restored in w_1_EC afterwards, since the other subproblems
+    refer to it. """
+    for substep in range(EC_substeps):
+        if substep == 1:
+            w_tmp_EC.assign(w_1_EC)
+        if substep > 0:
+            w_1_EC.assign(w_EC)
+        solver.solve()
+    if EC_substeps > 1:
+        w_1_EC.assign(w_tmp_EC)
+
+
 def update(t, dt, w_, w_1, bcs, bcs_pointwise,
-           enable_PF, enable_EC, enable_NS, q_rhs, **namespace):
+           enable_PF, enable_EC, enable_NS, q_rhs, droplet_frame=None,
+           **namespace):
     """ Update work variables at end of timestep. """
     # Update the time-dependent source terms
     for qi in q_rhs.values():
@@ -409,6 +540,10 @@ def update(t, dt, w_, w_1, bcs, bcs_pointwise,
         if enable:
             w_1[subproblem].assign(w_[subproblem])
 
+    # Update the velocity of the frame following the droplet
+    if droplet_frame is not None:
+        droplet_frame.update(dt)
+
 
 def equilibrium_EC(w_, x_, test_functions,
                    solutes,
@@ -0,0 +1,364 @@
+"""This module defines the axisymmetric version of the basic solver.
+
+The problem is solved in the meridian plane, with x[0] = r the distance to
+the axis and x[1] = z the axial coordinate, assuming no swirl. All
+integrals are weighted by r (the factor 2 pi is dropped), the divergence
+gets the term u_r/r, and the viscous stress the hoop term 2 mu u_r/r^2.
+The subproblems are the same as in basic:
+
+* PF: Phase field and chemical potential, with a linearised double-well
+  potential.
+
+* EC: Solute concentrations and electric potential, with a linearised
+  c grad V term.
+
+* NS: Velocity and pressure, with a linearised inertial term.
+
+On the axis (r = 0), u_r = 0 must be imposed (e.g. by FreeSlip(0., 0));
+all other fields are naturally symmetric there.
+
+"""
+import dolfin as df
+import math
+from common.functions import ramp, dramp, diff_pf_potential_linearised, \
+    unit_interval_filter, diff_pf_contact_linearised
+from common.io import info_red
+from . import *
+from . import __all__
+from .basic import get_subproblems, solve, update
+from .basic import discrete_energy as discrete_energy_cartesian
+import numpy as np
+
+
+def setup(mesh, test_functions, trial_functions,
+          w_, w_1,
+          ds, dx, normal,
+          dirichlet_bcs, neumann_bcs, boundary_to_mark,
+          permittivity, density, viscosity,
+          solutes,
+          enable_PF, enable_EC, enable_NS,
+          surface_tension, dt, interface_thickness,
+          grav_const,
+          grav_dir,
+          friction_coeff,
+          pf_mobility,
+          pf_mobility_coeff,
+          use_iterative_solvers, use_pressure_stabilization,
+          comoving_velocity,
+          p_lagrange,
+          q_rhs,
+          EC_substeps=1,
+          **namespace):
+    """ Set up problem. """
+    if mesh.geometry().dim() != 2:
+        info_red("The axisymmetric solver needs a mesh of the meridian "
+                 "plane (2D).")
+        exit()
+
+    # Constant
+    r = df.SpatialCoordinate(mesh)[0]
+    sigma_bar = surface_tension*3./(2*math.sqrt(2))
+    per_tau = df.Constant(1./dt)
+    grav = df.Constant(tuple(grav_const*np.array(grav_dir[:2])))
+    gamma = pf_mobility_coeff
+    eps = interface_thickness
+    fric = df.Constant(friction_coeff)
+    u_comoving = df.Constant(tuple(comoving_velocity[:2]))
+
+    # Navier-Stokes
+    u_ = p_ = None
+    u_1 = p_1 = None
+    p0 = q0 = p0_ = p0_1 = None
+    if enable_NS:
+        u, p = trial_functions["NS"][:2]
+        v, q = test_functions["NS"][:2]
+
+        up_ = df.split(w_["NS"])
+        up_1 = df.split(w_1["NS"])
+        u_, p_ = up_[:2]
+        u_1, p_1 = up_1[:2]
+        if p_lagrange:
+            p0 = trial_functions["NS"][-1]
+            q0 = test_functions["NS"][-1]
+            p0_ = up_[-1]
+            p0_1 = up_1[-1]
+
+    # Phase field
+    if enable_PF:
+        phi, g = trial_functions["PF"]
+        psi, h = test_functions["PF"]
+
+        phi_, g_ = df.split(w_["PF"])
+        phi_1, g_1 = df.split(w_1["PF"])
+    else:
+        # Defaults to phase 1 if phase field is disabled
+        phi_ = phi_1 = 1.
+        g_ = g_1 = None
+
+    # Electrochemistry
+    if enable_EC:
+        num_solutes = len(trial_functions["EC"])-1
+        assert(num_solutes == len(solutes))
+        c = trial_functions["EC"][:num_solutes]
+        V = trial_functions["EC"][num_solutes]
+        b = test_functions["EC"][:num_solutes]
+        U = test_functions["EC"][num_solutes]
+
+        cV_ = df.split(w_["EC"])
+        cV_1 = df.split(w_1["EC"])
+        c_, V_ = cV_[:num_solutes], cV_[num_solutes]
+        c_1, V_1 = cV_1[:num_solutes], cV_1[num_solutes]
+    else:
+        c_ = V_ = c_1 = V_1 = None
+
+    phi_flt_ = unit_interval_filter(phi_)
+    phi_flt_1 = unit_interval_filter(phi_1)
+
+    M_ = pf_mobility(phi_flt_, gamma)
+    M_1 = pf_mobility(phi_flt_1, gamma)
+    mu_ = ramp(phi_flt_, viscosity)
+    rho_ = ramp(phi_flt_, density)
+    rho_1 = ramp(phi_flt_1, density)
+    veps_ = ramp(phi_flt_, permittivity)
+
+    dveps = dramp(permittivity)
+    drho = dramp(density)
+
+    dbeta = []  # Diff. in beta
+    z = []  # Charge z[species]
+    K_ = []  # Diffusivity K[species]
+    beta_ = []  # Conc. jump func. beta[species]
+
+    for solute in solutes:
+        z.append(solute[1])
+        K_.append(ramp(phi_, [solute[2], solute[3]]))
+        beta_.append(ramp(phi_, [solute[4], solute[5]]))
+        dbeta.append(dramp([solute[4], solute[5]]))
+
+    if enable_EC:
+        rho_e = sum([c_e*z_e for c_e, z_e in zip(c, z)])  # Sum of trial func.
+        rho_e_ = sum([c_e*z_e for c_e, z_e in zip(c_, z)])  # Sum of curr. sol.
+    else:
+        rho_e_ = None
+
+    solvers = dict()
+    if enable_PF:
+        solvers["PF"] = setup_PF(w_["PF"], phi, g, psi, h, r,
+                                 dx, ds, normal,
+                                 dirichlet_bcs["PF"], neumann_bcs,
+                                 boundary_to_mark,
+                                 phi_1, u_1, M_1, c_1, V_1,
+                                 per_tau, sigma_bar, eps, dbeta, dveps,
+                                 enable_NS, enable_EC,
+                                 use_iterative_solvers, q_rhs)
+
+    if enable_EC:
+        solvers["EC"] = setup_EC(w_["EC"], c, V, b, U, rho_e, r,
+                                 dx, ds, normal,
+                                 dirichlet_bcs["EC"], neumann_bcs,
+                                 boundary_to_mark,
+                                 c_1, u_1, K_, veps_, phi_flt_,
+                                 solutes,
+                                 df.Constant(EC_substeps/dt), z, dbeta,
+                                 enable_NS, enable_PF,
+                                 use_iterative_solvers,
+                                 q_rhs)
+
+    if enable_NS:
+        solvers["NS"] = setup_NS(w_["NS"], u, p, v, q, p0, q0, r,
+                                 dx, ds, normal,
+                                 dirichlet_bcs["NS"], neumann_bcs,
+                                 boundary_to_mark,
+                                 u_1, phi_flt_,
+                                 rho_, rho_1, g_, M_, mu_, rho_e_,
+                                 c_, V_,
+                                 c_1, V_1,
+                                 dbeta, solutes,
+                                 per_tau, drho, sigma_bar, eps, dveps,
+                                 grav, fric,
+                                 u_comoving,
+                                 enable_PF, enable_EC,
+                                 use_iterative_solvers,
+                                 use_pressure_stabilization,
+                                 p_lagrange,
+                                 q_rhs)
+    return dict(solvers=solvers)
+
+
+def setup_NS(w_NS, u, p, v, q, p0, q0, r,
+             dx, ds, normal,
+             dirichlet_bcs, neumann_bcs, boundary_to_mark,
+             u_1, phi_, rho_, rho_1, g_, M_, mu_, rho_e_,
+             c_, V_,
+             c_1, V_1,
+             dbeta, solutes,
+             per_tau, drho, sigma_bar, eps, dveps, grav, fric,
+             u_comoving,
+             enable_PF, enable_EC,
+             use_iterative_solvers, use_pressure_stabilization,
+             p_lagrange,
+             q_rhs):
+    """ Set up the Navier-Stokes subproblem. Without swirl, the inertial
+    term has the same form as in Cartesian coordinates; the divergence
+    gets the term u_r/r, and the strain rate the hoop component u_r/r. """
+    mom_1 = rho_1*(u_1 + u_comoving)
+    if enable_PF:
+        mom_1 += -M_*drho * df.nabla_grad(g_)
+
+    F = (
+        per_tau * rho_1 * df.dot(u - u_1, v) * r*dx
+        + fric*mu_*df.dot(u + u_comoving, v) * r*dx
+        + 2*mu_*df.inner(df.sym(df.nabla_grad(u)),
+                         df.sym(df.nabla_grad(v))) * r*dx
+        + 2*mu_*u[0]*v[0]/r * dx
+        - p * (r*df.div(v) + v[0]) * dx
+        + q * (r*df.div(u) + u[0]) * dx
+        + df.inner(df.nabla_grad(u), df.outer(mom_1, v)) * r*dx
+        + 0.5 * (per_tau * (rho_ - rho_1) * df.dot(u, v)
+                 - df.dot(mom_1, df.nabla_grad(df.dot(u, v)))) * r*dx
+        - rho_*df.dot(grav, v) * r*dx
+        - mu_ * df.dot(df.nabla_grad(u)*normal, v) * r*df.ds
+    )
+    for boundary_name, slip_length in neumann_bcs["u"].items():
+        F += 1./slip_length * \
+             df.dot(u, v) * r*ds(boundary_to_mark[boundary_name])
+
+    for boundary_name, pressure in neumann_bcs["p"].items():
+        F += pressure * df.dot(normal, v) * \
+            r*ds(boundary_to_mark[boundary_name])
+
+    if enable_PF:
+        F += phi_*df.dot(df.nabla_grad(g_), v)*r*dx
+
+    if enable_EC:
+        for ci_, ci_1, dbetai, solute in zip(c_, c_1, dbeta, solutes):
+            zi = solute[1]
+            F += df.dot(df.grad(ci_), v)*r*dx \
+                + zi*ci_1*df.dot(df.grad(V_), v)*r*dx
+            if enable_PF:
+                F += ci_*dbetai*df.dot(df.grad(phi_), v)*r*dx
+
+    if p_lagrange:
+        F += (p*q0 + q*p0)*r*dx
+
+    if "u" in q_rhs:
+        F += -df.dot(q_rhs["u"], v)*r*dx
+
+    a, L = df.lhs(F), df.rhs(F)
+
+    problem = df.LinearVariationalProblem(a, L, w_NS, dirichlet_bcs)
+    solver = df.LinearVariationalSolver(problem)
+
+    if use_iterative_solvers and use_pressure_stabilization:
+        solver.parameters["linear_solver"] = "gmres"
+
+    return solver
+
+
+def setup_PF(w_PF, phi, g, psi, h, r,
+             dx, ds, normal,
+             dirichlet_bcs, neumann_bcs, boundary_to_mark,
+             phi_1, u_1, M_1, c_1, V_1,
+             per_tau, sigma_bar, eps,
+             dbeta, dveps,
+             enable_NS, enable_EC,
+             use_iterative_solvers,
+             q_rhs):
+    """ Set up phase field subproblem. """
+    F_phi = (per_tau*(phi-unit_interval_filter(phi_1))*psi*r*dx +
+             M_1*df.dot(df.grad(g), df.grad(psi))*r*dx)
+    if enable_NS:
+        F_phi += - phi*df.dot(u_1, df.grad(psi))*r*dx \
+                 + phi*psi*df.dot(u_1, normal)*r*df.ds
+    F_g = (g*h*r*dx
+           - sigma_bar*eps*df.dot(df.nabla_grad(phi),
+                                  df.nabla_grad(h))*r*dx
+           - sigma_bar/eps*(
+               diff_pf_potential_linearised(phi,
+                                            unit_interval_filter(
+                                                phi_1))*h*r*dx))
+    if enable_EC:
+        F_g += (-sum([dbeta_i*ci_1*h*r*dx
+                      for dbeta_i, ci_1 in zip(dbeta, c_1)])
+                + 0.5*dveps*df.dot(df.nabla_grad(V_1),
+                                   df.nabla_grad(V_1))*h*r*dx)
+
+    for boundary_name, costheta in neumann_bcs["phi"].items():
+        fw_prime = diff_pf_contact_linearised(phi, unit_interval_filter(phi_1))
+        F_g += sigma_bar*costheta*fw_prime*h*r*ds(
+            boundary_to_mark[boundary_name])
+
+    if "phi" in q_rhs:
+        F_phi += -q_rhs["phi"]*psi*r*dx
+
+    F = F_phi + F_g
+    a, L = df.lhs(F), df.rhs(F)
+
+    problem = df.LinearVariationalProblem(a, L, w_PF)
+    solver = df.LinearVariationalSolver(problem)
+
+    if use_iterative_solvers:
+        solver.parameters["linear_solver"] = "gmres"
+
+    return solver
+
+
+def setup_EC(w_EC, c, V, b, U, rho_e, r,
+             dx, ds, normal,
+             dirichlet_bcs, neumann_bcs, boundary_to_mark,
+             c_1, u_1, K_, veps_, phi_,
+             solutes,
+             per_tau, z, dbeta,
+             enable_NS, enable_PF,
+             use_iterative_solvers,
+             q_rhs):
+    """ Set up electrochemistry subproblem. """
+    F_c = []
+    for ci, ci_1, bi, Ki_, zi, dbetai, solute in zip(
+            c, c_1, b, K_, z, dbeta, solutes):
+        F_ci = (per_tau*(ci-ci_1)*bi*r*dx +
+                Ki_*df.dot(df.nabla_grad(ci), df.nabla_grad(bi))*r*dx)
+        if zi != 0:
+            F_ci += Ki_*zi*ci_1*df.dot(df.nabla_grad(V),
+                                       df.nabla_grad(bi))*r*dx
+
+        if enable_PF:
+            F_ci += Ki_*ci*dbetai*df.dot(df.nabla_grad(phi_),
+                                         df.nabla_grad(bi))*r*dx
+
+        if enable_NS:
+            F_ci += - ci*df.dot(u_1, df.grad(bi))*r*dx \
+                    + ci*bi*df.dot(u_1, normal)*r*df.ds
+
+        if solute[0] in q_rhs:
+            F_ci += - q_rhs[solute[0]]*bi*r*dx
+
+        F_c.append(F_ci)
+    F_V = veps_*df.dot(df.nabla_grad(V), df.nabla_grad(U))*r*dx
+    for boundary_name, sigma_e in neumann_bcs["V"].items():
+        F_V += -sigma_e*U*r*ds(boundary_to_mark[boundary_name])
+    if rho_e != 0:
+        F_V += -rho_e*U*r*dx
+    if "V" in q_rhs:
+        F_V += q_rhs["V"]*U*r*dx
+
+    F = sum(F_c) + F_V
+    a, L = df.lhs(F), df.rhs(F)
+
+    problem = df.LinearVariationalProblem(a, L, w_EC, dirichlet_bcs)
+    solver = df.LinearVariationalSolver(problem)
+
+    if use_iterative_solvers:
+        solver.parameters["linear_solver"] = "gmres"
+
+    return solver
+
+
+def discrete_energy(x_, mesh, **namespace):
+    """ The energy densities of basic, weighted by 2 pi r, so that their
+    integrals over the meridian plane are those over the full domain. """
+    E_list = discrete_energy_cartesian(x_, **namespace)
+    if x_ is None:
+        return E_list
+    r = df.SpatialCoordinate(mesh)[0]
+    return [2*math.pi*r*E for E in E_list]
@@ -0,0 +1,272 @@
+"""This module defines a depth-averaged (Hele-Shaw) solver.
+
+Binary electrohydrodynamics in a thin gap between two plates, where the
+gap-averaged velocity follows Darcy's law,
+
+    u = - (k / mu) (grad p + f),
+
+with the permeability k = 1/friction_coeff (k = h^2/12 for a gap of width
+h), and f the capillary, electric, osmotic and gravitational forces of the
+basic solver. The problem is split between the following subproblems.
+
+* PF: Same as basic
+
+* EC: Same as basic
+
+* NSp: Pressure, from the Poisson equation div u = 0.
+
+* NSu: Velocity, projected from Darcy's law (cheap, postprocessed).
+
+Fixed and free-slip conditions on the velocity give the normal flux in
+the pressure equation; elsewhere, including slip walls, the walls are
+impermeable unless the pressure is given.
+
+"""
+import dolfin as df
+import math
+from common.functions import ramp, dramp, unit_interval_filter
+from common.io import mpi_barrier, info_red
+from common.bcs import Fixed, FreeSlip
+from . import *
+from . import __all__
+from .basic import setup_PF, setup_EC
+import numpy as np
+
+
+def get_subproblems(base_elements, solutes,
+                    enable_NS, enable_PF, enable_EC,
+                    **namespace):
+    """ Returns dict of subproblems the solver splits the problem into. """
+    subproblems = dict()
+    if enable_NS:
+        subproblems["NSp"] = [dict(name="p", element="p")]
+        subproblems["NSu"] = [dict(name="u", element="u")]
+    if enable_PF:
+        subproblems["PF"] = [dict(name="phi", element="phi"),
+                             dict(name="g", element="g")]
+    if enable_EC:
+        subproblems["EC"] = ([dict(name=solute[0], element="c")
+                              for solute in solutes]
+                             + [dict(name="V", element="V")])
+    return subproblems
+
+
+def setup(mesh, test_functions, trial_functions,
+          w_, w_1,
+          ds, dx, normal,
+          dirichlet_bcs, neumann_bcs, boundary_to_mark, bcs,
+          permittivity, density, viscosity,
+          solutes,
+          enable_PF, enable_EC, enable_NS,
+          surface_tension, dt, interface_thickness,
+          grav_const,
+          grav_dir,
+          friction_coeff,
+          pf_mobility,
+          pf_mobility_coeff,
+          use_iterative_solvers,
+          q_rhs,
+          **namespace):
+    """ Set up problem. """
+    if enable_NS and not friction_coeff > 0.:
+        info_red("The Hele-Shaw solver needs friction_coeff > 0 "
+                 "(the inverse permeability).")
+        exit()
+
+    # Constant
+    dim = mesh.geometry().dim()
+    sigma_bar = surface_tension*3./(2*math.sqrt(2))
+    per_tau = df.Constant(1./dt)
+    grav = df.Constant(tuple(grav_const*np.array(grav_dir[:dim])))
+    gamma = pf_mobility_coeff
+    eps = interface_thickness
+    perm = df.Constant(1./friction_coeff)
+
+    # Darcy flow
+    u_1 = None
+    if enable_NS:
+        u_1 = w_1["NSu"]
+
+    # Phase field
+    if enable_PF:
+        phi, g = trial_functions["PF"]
+        psi, h = test_functions["PF"]
+
+        phi_, g_ = df.split(w_["PF"])
+        phi_1, g_1 = df.split(w_1["PF"])
+    else:
+        # Defaults to phase 1 if phase field is disabled
+        phi_ = phi_1 = 1.
+        g_ = g_1 = None
+
+    # Electrochemistry
+    if enable_EC:
+        num_solutes = len(trial_functions["EC"])-1
+        assert(num_solutes == len(solutes))
+        c = trial_functions["EC"][:num_solutes]
+        V = trial_functions["EC"][num_solutes]
+        b = test_functions["EC"][:num_solutes]
+        U = test_functions["EC"][num_solutes]
+
+        cV_ = df.split(w_["EC"])
+        cV_1 = df.split(w_1["EC"])
+        c_, V_ = cV_[:num_solutes], cV_[num_solutes]
+        c_1, V_1 = cV_1[:num_solutes], cV_1[num_solutes]
+    else:
+        c_ = V_ = c_1 = V_1 = None
+
+    phi_flt_ = unit_interval_filter(phi_)
+    phi_flt_1 = unit_interval_filter(phi_1)
+
+    M_1 = pf_mobility(phi_flt_1, gamma)
+    mu_ = ramp(phi_flt_, viscosity)
+    rho_ = ramp(phi_flt_, density)
+    veps_ = ramp(phi_flt_, permittivity)
+
+    dveps = dramp(permittivity)
+
+    dbeta = []  # Diff. in beta
+    z = []  # Charge z[species]
+    K_ = []  # Diffusivity K[species]
+
+    for solute in solutes:
+        z.append(solute[1])
+        K_.append(ramp(phi_, [solute[2], solute[3]]))
+        dbeta.append(dramp([solute[4], solute[5]]))
+
+    if enable_EC:
+        rho_e = sum([c_e*z_e for c_e, z_e in zip(c, z)])  # Sum of trial func.
+
+    solvers = dict()
+    if enable_PF:
+        solvers["PF"] = setup_PF(w_["PF"], phi, g, psi, h,
+                                 dx, ds, normal,
+                                 dirichlet_bcs["PF"], neumann_bcs,
+                                 boundary_to_mark,
+                                 phi_1, u_1, M_1, c_1, V_1,
+                                 per_tau, sigma_bar, eps, dbeta, dveps,
+                                 enable_NS, enable_EC,
+                                 use_iterative_solvers, q_rhs)
+
+    if enable_EC:
+        solvers["EC"] = setup_EC(w_["EC"], c, V, b, U, rho_e,
+                                 dx, ds, normal,
+                                 dirichlet_bcs["EC"], neumann_bcs,
+                                 boundary_to_mark,
+                                 c_1, u_1, K_, veps_, phi_flt_,
+                                 solutes,
+                                 per_tau, z, dbeta,
+                                 enable_NS, enable_PF,
+                                 use_iterative_solvers,
+                                 q_rhs)
+
+    if enable_NS:
+        force = darcy_force(phi_flt_, g_, c_, V_, c_1, rho_, grav,
+                            dbeta, solutes, enable_PF, enable_EC)
+        solvers["NSp"] = setup_NSp(w_["NSp"], trial_functions["NSp"],
+                                   test_functions["NSp"],
+                                   ds, dx, dirichlet_bcs["NSp"],
+                                   bcs, boundary_to_mark, normal,
+                                   perm, mu_, force,
+                                   use_iterative_solvers, q_rhs)
+        solvers["NSu"] = setup_NSu(w_["NSu"], trial_functions["NSu"],
+                                   test_functions["NSu"], w_["NSp"],
+                                   dx, dirichlet_bcs["NSu"],
+                                   perm, mu_, force,
+                                   use_iterative_solvers)
+    return dict(solvers=solvers)
+
+
+def darcy_force(phi_, g_, c_, V_, c_1, rho_, grav,
+                dbeta, solutes, enable_PF, enable_EC):
+    """ The force density f in Darcy's law, u = -(k/mu)(grad p + f); the
+    same forces as in the momentum equation of basic. """
+    f = -rho_*grav
+    if enable_PF:
+        f += phi_*df.nabla_grad(g_)
+    if enable_EC:
+        for ci_, ci_1, dbetai, solute in zip(c_, c_1, dbeta, solutes):
+            zi = solute[1]
+            f += df.grad(ci_) + zi*ci_1*df.grad(V_)
+            if enable_PF:
+                f += ci_*dbetai*df.grad(phi_)
+    return f
+
+
+def setup_NSp(w_NSp, p, q, ds, dx, dirichlet_bcs, bcs, boundary_to_mark,
+              normal, perm, mu_, force,
+              use_iterative_solvers, q_rhs):
+    """ Set up the pressure subproblem, div u = 0 with Darcy's law. """
+    F = perm/mu_*df.dot(df.nabla_grad(p) + force, df.nabla_grad(q))*dx
+    # Prescribed velocities give the flux through the boundary. The value
+    # of a Slip condition is a slip length; those walls are impermeable.
+    for boundary_name, bcs_fields in bcs.items():
+        bc = bcs_fields.get("u", None)
+        if isinstance(bc, FreeSlip):
+            F += bc.value*normal[bc.dim]*q*ds(boundary_to_mark[boundary_name])
+        elif isinstance(bc, Fixed):
+            F += df.dot(bc.value, normal)*q*ds(
+                boundary_to_mark[boundary_name])
+
+    if "p" in q_rhs:
+        F += -q_rhs["p"]*q*dx
+
+    a, L = df.lhs(F), df.rhs(F)
+
+    problem = df.LinearVariationalProblem(a, L, w_NSp, dirichlet_bcs)
+    solver = df.LinearVariationalSolver(problem)
+
+    if use_iterative_solvers:
+        solver.parameters["linear_solver"] = "cg"
+        solver.parameters["preconditioner"] = "hypre_amg"
+
+    return solver
+
+
+def setup_NSu(w_NSu, u, v, p_, dx, dirichlet_bcs, perm, mu_, force,
+              use_iterative_solvers):
+    """ Set up the projection of the velocity from Darcy's law. """
+    F = (df.dot(u, v)*dx
+         + perm/mu_*df.dot(df.nabla_grad(p_) + force, v)*dx)
+    a, L = df.lhs(F), df.rhs(F)
+
+    problem = df.LinearVariationalProblem(a, L, w_NSu, dirichlet_bcs)
+    solver = df.LinearVariationalSolver(problem)
+
+    if use_iterative_solvers:
+        solver.parameters["linear_solver"] = "cg"
+        solver.parameters["preconditioner"] = "jacobi"
+
+    return solver
+
+
+def solve(w_, solvers, enable_PF, enable_EC, enable_NS, **namespace):
+    """ Solve equations. """
+    timer_outer = df.Timer("Solve system")
+    for subproblem, enable in zip(["PF", "EC", "NSp", "NSu"],
+                                  [enable_PF, enable_EC,
+                                   enable_NS, enable_NS]):
+        if enable:
+            timer_inner = df.Timer("Solve subproblem " + subproblem)
+            mpi_barrier()
+            solvers[subproblem].solve()
+            timer_inner.stop()
+
+    timer_outer.stop()
+
+
+def update(t, dt, w_, w_1, bcs, bcs_pointwise,
+           enable_PF, enable_EC, enable_NS, q_rhs, **namespace):
+    """ Update work variables at end of timestep. """
+    # Update the time-dependent source terms
+    for qi in q_rhs.values():
+        qi.t = t+dt
+    # Update the time-dependent boundary conditions
+    for boundary_name, bcs_fields in bcs.items():
+        for field, bc in bcs_fields.items():
+            if isinstance(bc.value, df.Expression):
+                bc.value.t = t+dt
+
+    # Update fields
+    for subproblem in w_:
+        w_1[subproblem].assign(w_[subproblem])
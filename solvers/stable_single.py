@@ -5,10 +5,13 @@ GL, 2017
 """
 import dolfin as df
 from common.functions import max_value, alpha, alpha_c, alpha_cc, \
-    alpha_reg, alpha_c_reg, absolute
+    alpha_reg, alpha_c_reg, absolute, pspg_tau, \
+    stabilize_transport
 from . import *
 from . import __all__
-from common.io import mpi_barrier
+from common.io import mpi_barrier, info_red
+from common.nullspace import NullspaceSolver, charge_nullspace
+from common.gummel import GummelSolver
 import numpy as np
 
 
@@ -49,6 +52,12 @@ def setup(test_functions, trial_functions, w_, w_1,
           density_per_concentration,
           viscosity_per_concentration,
           V_lagrange, p_lagrange,
+          p_nullspace=False, V_nullspace=False,
+          transport_stabilization=False,
+          edge_stabilization_coeff=0.01,
+          bcs=None, bcs_pointwise=None, subdomains=None,
+          gummel_iterations=1,
+          pspg=False,
           **namespace):
     """ Set up problem. """
     # Constant
@@ -58,6 +67,15 @@ def setup(test_functions, trial_functions, w_, w_1,
     mu_0 = df.Constant(viscosity[0])
     rho_0 = df.Constant(density[0])
 
+    if (p_lagrange and p_nullspace) or (V_lagrange and V_nullspace):
+        info_red("Use either a Lagrange multiplier or a nullspace, "
+                 "not both.")
+        exit()
+    if transport_stabilization not in (False, "supg", "edge"):
+        info_red("Unknown transport_stabilization: " +
+                 str(transport_stabilization))
+        exit()
+
     if EC_scheme in ["NL1", "NL2"]:
         nonlinear_EC = True
     else:
@@ -187,7 +205,10 @@ def setup(test_functions, trial_functions, w_, w_1,
     if enable_EC:
         w_EC = w_["EC"]
         dirichlet_bcs_EC = dirichlet_bcs["EC"]
-        solvers["EC"] = setup_EC(**vars())
+        if EC_scheme == "Gummel":
+            solvers["EC"] = setup_EC_gummel(**vars())
+        else:
+            solvers["EC"] = setup_EC(**vars())
 
     if enable_NS:
         w_NS = w_["NS"]
@@ -209,8 +230,11 @@ def setup_NS(w_NS, u, p, v, q, p0, q0,
              q_rhs,
              density_per_concentration,
              K,
+             p_nullspace,
+             pspg=False,
              **namespace):
-    """ Set up the Navier-Stokes subproblem. """
+    """ Set up the Navier-Stokes subproblem. With pspg, the continuity
+    equation is stabilized by PSPG, which allows equal-order elements. """
     mom_1 = rho_1 * u_1
     if enable_EC and density_per_concentration is not None:
         for drhodci, ci_1, grad_g_ci_, Ki in zip(
@@ -243,6 +267,26 @@ def setup_NS(w_NS, u, p, v, q, p0, q0,
     if "u" in q_rhs:
         F += -df.dot(q_rhs["u"], v)*dx
 
+    if pspg:
+        # Strong momentum residual
+        R = (1./dt * rho_1 * (u - u_1)
+             + df.dot(mom_1, df.nabla_grad(u))
+             - df.div(2*mu_*df.sym(df.nabla_grad(u)))
+             + df.grad(p)
+             - rho_*grav)
+        if enable_EC:
+            for ci_1, grad_g_ci_ in zip(c_1, grad_g_c_):
+                R += ci_1*grad_g_ci_
+        if "u" in q_rhs:
+            R += -q_rhs["u"]
+        tau = pspg_tau(mesh, u_1, rho_1, mu_, dt)
+        # The continuity equation enters with a minus sign here.
+        F += -tau*df.dot(R, df.grad(q))*dx
+
+    if p_nullspace:
+        return NullspaceSolver(F, w_NS, dirichlet_bcs_NS, [1],
+                               use_iterative_solvers=use_iterative_solvers)
+
     a, L = df.lhs(F), df.rhs(F)
     if not use_iterative_solvers:
         problem = df.LinearVariationalProblem(a, L, w_NS, dirichlet_bcs_NS)
@@ -261,7 +305,7 @@ def alpha_prime_approx(ci, ci_1, EC_scheme, c_cutoff):
         return (ci-ci_1)*(alpha(ci)-alpha(ci_1))/((ci-ci_1)**2+0.001)
     elif EC_scheme == "NL2":
         return alpha_c(ci)
-    elif EC_scheme == "L1":
+    elif EC_scheme in ["L1", "Gummel"]:
         return alpha_c(ci_1) + 0.5*alpha_cc(ci_1)*(ci-ci_1)
     elif EC_scheme == "L2":
         return alpha_c_reg(ci_1, c_cutoff) + 0.5*alpha_cc(c_cutoff)*(ci-ci_1)
@@ -277,7 +321,7 @@ def regulate(ci, ci_1, EC_scheme, c_cutoff):
 
 
 def setup_EC(w_EC, c, V, V0, b, U, U0,
-             rho_e, grad_g_c, c_reg, g_c,
+             rho_e, grad_g_c, c_reg, g_c, z,
              dx, ds, normal,
              dirichlet_bcs_EC, neumann_bcs, boundary_to_mark,
              c_1, u_1, K, veps,
@@ -292,13 +336,22 @@ def setup_EC(w_EC, c, V, V0, b, U, U0,
              reactions,
              beta,
              g_c_1,
+             mesh,
+             V_nullspace=False,
+             transport_stabilization=False,
+             edge_stabilization_coeff=0.01,
+             EC_substeps=1,
              **namespace):
-    """ Set up electrochemistry subproblem. """
+    """ Set up electrochemistry subproblem. With V_nullspace, the system
+    must be closed, and a net charge is cancelled by a uniform background
+    charge, as with V_lagrange. The advection may be stabilized by SUPG or
+    edge stabilization (transport_stabilization), along the projected
+    velocity u_star that advects the concentrations. """
     if enable_NS:
-        # Projected velocity
-        u_star = u_1 - dt/rho_1*sum([ci_1*grad_g_ci
-                                     for ci_1, grad_g_ci
-                                     in zip(c_1, grad_g_c)])
+        # Projected velocity, over the timestep of the flow (dt is that of
+        # the electrochemistry, which may be subcycled)
+        u_star = u_1 - EC_substeps*dt/rho_1*sum(
+            [ci_1*grad_g_ci for ci_1, grad_g_ci in zip(c_1, grad_g_c)])
 
     F_c = []
     for ci, ci_1, bi, Ki, grad_g_ci, solute, ci_reg in zip(
@@ -316,6 +369,14 @@ def setup_EC(w_EC, c, V, V0, b, U, U0,
                 # F_ci += df.dot(u_1, normal)*bi*ci_1*ds(
                 #     boundary_to_mark[boundary_name])
                 pass
+        if enable_NS and transport_stabilization:
+            R_ci = (1./dt*(ci-ci_1) + df.div(ci_1*u_star)
+                    - df.div(Ki*ci_reg*grad_g_ci))
+            if solute[0] in q_rhs:
+                R_ci += -q_rhs[solute[0]]
+            F_ci += stabilize_transport(
+                transport_stabilization, R_ci, ci, bi, u_star, Ki, dt, mesh,
+                edge_stabilization_coeff)
         F_c.append(F_ci)
 
     for reaction_constant, nu in reactions:
@@ -348,6 +409,15 @@ def setup_EC(w_EC, c, V, V0, b, U, U0,
         F_V += q_rhs["V"]*U*dx
 
     F = sum(F_c) + F_V
+    if V_nullspace:
+        kwargs, background = charge_nullspace(
+            z, c_1, dt, solutes, q_rhs, neumann_bcs, boundary_to_mark,
+            dx, ds, dirichlet_bcs_EC)
+        F += background*U*dx
+        return NullspaceSolver(F, w_EC, dirichlet_bcs_EC, [len(c)],
+                               nonlinear=nonlinear_EC,
+                               use_iterative_solvers=use_iterative_solvers,
+                               **kwargs)
     if nonlinear_EC:
         J = df.derivative(F, w_EC)
         problem = df.NonlinearVariationalProblem(F, w_EC, dirichlet_bcs_EC, J)
@@ -368,8 +438,122 @@ def setup_EC(w_EC, c, V, V0, b, U, U0,
     return solver
 
 
+def collapsed_dirichlet_bcs(field, space, bcs, bcs_pointwise, subdomains,
+                            boundary_to_mark):
+    """ Dirichlet conditions of field, on the (collapsed) space. """
+    dbcs = []
+    for boundary_name, bcs_fields in bcs.items():
+        bc = bcs_fields.get(field, None)
+        if bc is not None and bc.is_dbc():
+            dbcs.append(bc.dbc(space, subdomains,
+                               boundary_to_mark[boundary_name]))
+    if bcs_pointwise and field in bcs_pointwise:
+        value, c_code = bcs_pointwise[field]
+        if not isinstance(value, df.Expression):
+            value = df.Constant(value)
+        dbcs.append(df.DirichletBC(space, value, c_code, "pointwise"))
+    return dbcs
+
+
+def setup_EC_gummel(w_EC, solutes, z, K, beta,
+                    c_1, V_1, u_1, rho_1, veps,
+                    dt, dx, ds,
+                    neumann_bcs, boundary_to_mark,
+                    bcs, bcs_pointwise, subdomains,
+                    enable_NS,
+                    q_rhs,
+                    reactions,
+                    c_cutoff,
+                    use_iterative_solvers,
+                    gummel_iterations,
+                    V_lagrange=False, V_nullspace=False,
+                    EC_substeps=1,
+                    **namespace):
+    """ Set up electrochemistry subproblem, decoupled into the Poisson
+    equation and one Nernst-Planck equation per species, solved by Gummel
+    iterations (see common/gummel.py). The chemical potentials are
+    linearised as in the L1 scheme. """
+    if V_lagrange or V_nullspace:
+        info_red("The Gummel scheme does not support V_lagrange or "
+                 "V_nullspace.")
+        exit()
+    num_solutes = len(solutes)
+    W = w_EC.function_space()
+    spaces = [W.sub(i).collapse() for i in range(num_solutes+1)]
+    c_it = [df.Function(space) for space in spaces[:num_solutes]]
+    c_new = [df.Function(space) for space in spaces[:num_solutes]]
+    V_it = df.Function(spaces[num_solutes])
+
+    # Poisson equation, with the charge of the current iterate
+    V = df.TrialFunction(spaces[num_solutes])
+    U = df.TestFunction(spaces[num_solutes])
+    F_V = (veps*df.dot(df.grad(V), df.grad(U))*dx
+           - sum([zi*ci for zi, ci in zip(z, c_it)])*U*dx)
+    for boundary_name, sigma_e in neumann_bcs["V"].items():
+        F_V += -sigma_e*U*ds(boundary_to_mark[boundary_name])
+    if "V" in q_rhs:
+        F_V += q_rhs["V"]*U*dx
+    problem = df.LinearVariationalProblem(
+        df.lhs(F_V), df.rhs(F_V), V_it,
+        collapsed_dirichlet_bcs("V", spaces[num_solutes], bcs,
+                                bcs_pointwise, subdomains, boundary_to_mark))
+    poisson_solver = df.LinearVariationalSolver(problem)
+    if use_iterative_solvers:
+        poisson_solver.parameters["linear_solver"] = "cg"
+        poisson_solver.parameters["preconditioner"] = "hypre_amg"
+
+    # Chemical potentials of the current iterate, and of the previous step
+    g_it = [alpha_prime_approx(ci, ci_1, "L1", c_cutoff) + betai + zi*V_it
+            for ci, ci_1, betai, zi in zip(c_it, c_1, beta, z)]
+    g_1 = [alpha_c(ci_1) + betai + zi*V_1
+           for ci_1, betai, zi in zip(c_1, beta, z)]
+
+    species_solvers = []
+    for i, solute in enumerate(solutes):
+        ci = df.TrialFunction(spaces[i])
+        bi = df.TestFunction(spaces[i])
+        ci_1 = c_1[i]
+        # The species' own potential is implicit, the others are iterates
+        g = list(g_it)
+        g[i] = (alpha_prime_approx(ci, ci_1, "L1", c_cutoff)
+                + beta[i] + z[i]*V_it)
+
+        F_ci = (1./dt*(ci-ci_1)*bi*dx +
+                K[i]*regulate(ci, ci_1, "L1", c_cutoff)*df.dot(
+                    df.grad(g[i]), df.grad(bi))*dx)
+        if enable_NS:
+            u_star = u_1 - EC_substeps*dt/rho_1*sum(
+                [cj_1*df.grad(gj) for cj_1, gj in zip(c_1, g)])
+            F_ci += - ci_1*df.dot(u_star, df.grad(bi))*dx
+        if solute[0] in q_rhs:
+            F_ci += - q_rhs[solute[0]]*bi*dx
+
+        for reaction_constant, nu in reactions:
+            if nu[i] == 0:
+                continue
+            g_less = sum([-nuj*gj_1 for nuj, gj_1 in zip(nu, g_1) if nuj < 0])
+            g_more = sum([nuj*gj_1 for nuj, gj_1 in zip(nu, g_1) if nuj > 0])
+            C = reaction_constant*(
+                df.exp(g_less) - df.exp(g_more))/(g_less - g_more)
+            R = C*sum([nuj*gj for nuj, gj in zip(nu, g)])
+            F_ci += nu[i]*R*bi*dx
+
+        problem = df.LinearVariationalProblem(
+            df.lhs(F_ci), df.rhs(F_ci), c_new[i],
+            collapsed_dirichlet_bcs(solute[0], spaces[i], bcs, bcs_pointwise,
+                                    subdomains, boundary_to_mark))
+        solver = df.LinearVariationalSolver(problem)
+        if use_iterative_solvers:
+            solver.parameters["linear_solver"] = "bicgstab"
+            solver.parameters["preconditioner"] = "hypre_amg"
+        species_solvers.append(solver)
+
+    return GummelSolver(w_EC, c_it, V_it, c_new, poisson_solver,
+                        species_solvers, gummel_iterations)
+
+
 def solve(w_, t, dt, q_rhs, solvers, enable_EC, enable_NS,
-          use_iterative_solvers, bcs,
+          use_iterative_solvers, bcs, p_nullspace=False,
           **namespace):
     """ Solve equations. """
     # Update the time-dependent source terms
@@ -387,7 +571,8 @@ def solve(w_, t, dt, q_rhs, solvers, enable_EC, enable_NS,
         if enable:
             timer_inner = df.Timer("Solve subproblem " + subproblem)
             mpi_barrier()
-            if subproblem == "NS" and use_iterative_solvers:
+            if (subproblem == "NS" and use_iterative_solvers
+                    and not p_nullspace):
                 solver, a, L, bcs = solvers[subproblem]
                 A = df.assemble(a)
                 b = df.assemble(L)
@@ -3,9 +3,10 @@ described in the paper.
 
 GL, 2017
 """
-from .stable_single import setup_EC, alpha_prime_approx, alpha_generalized, \
-    regulate, alpha_c
+from .stable_single import setup_EC, setup_EC_gummel, alpha_prime_approx, \
+    alpha_generalized, regulate, alpha_c
 import dolfin as df
+from .basic import solve_EC_substeps
 from common.io import mpi_barrier
 from . import *
 from . import __all__
@@ -43,6 +44,9 @@ def setup(test_functions, trial_functions, w_, w_1,
           V_lagrange, p_lagrange,
           density_per_concentration,
           viscosity_per_concentration,
+          bcs=None, bcs_pointwise=None, subdomains=None,
+          gummel_iterations=1,
+          EC_substeps=1,
           **namespace):
     """ Set up problem. """
     # Constant
@@ -169,7 +173,12 @@ def setup(test_functions, trial_functions, w_, w_1,
     if enable_EC:
         w_EC = w_["EC"]
         dirichlet_bcs_EC = dirichlet_bcs["EC"]
-        solvers["EC"] = setup_EC(**vars())
+        # The EC subproblem is subcycled with substeps of dt/EC_substeps
+        ns_EC = dict(vars(), dt=dt/EC_substeps)
+        if EC_scheme == "Gummel":
+            solvers["EC"] = setup_EC_gummel(**ns_EC)
+        else:
+            solvers["EC"] = setup_EC(**ns_EC)
 
     if enable_NS:
         w_NSu = w_["NSu"]
@@ -274,15 +283,17 @@ def setup_NSp(w_NSp, p, q, dirichlet_bcs_NSp,
     return solver
 
 
-def solve(tstep, w_, w_1, solvers,
+def solve(tstep, w_, w_1, w_tmp, solvers,
           enable_EC, enable_NS,
+          EC_substeps=1,
           **namespace):
     """ Solve equations. """
     timer_outer = df.Timer("Solve system")
     if enable_EC:
         timer_inner = df.Timer("Solve subproblem EC")
         mpi_barrier()
-        solvers["EC"].solve()
+        solve_EC_substeps(solvers["EC"], w_["EC"], w_1["EC"], w_tmp["EC"],
+                          EC_substeps)
         timer_inner.stop()
     if enable_NS:
         # Step 1: Predict u
@@ -0,0 +1,86 @@
+import os
+import sys
+import numpy as np
+import pytest
+import dolfin as df
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+from common.bcs import LabFixed
+from common.insitu import DropletFrame, StatisticsWriter, \
+    CompiledFunctional, PointValues
+
+
+def test_statistics_writer(tmpdir):
+    """ Rows are buffered, written with a header once, and continued when
+    the writer is reopened (as on restart). """
+    filename = str(tmpdir.join("insitu"))
+    writer = StatisticsWriter(filename, ["Timestep", "Time"], buffer_size=2)
+    writer.write([0, 0.])
+    assert not os.path.exists(filename + ".dat")
+    writer.write([1, 0.1])
+    writer.write([2, 0.2])
+    writer.close()
+
+    writer = StatisticsWriter(filename, ["Timestep", "Time"], buffer_size=2)
+    writer.write([3, 0.3])
+    writer.close()
+
+    with open(filename + ".dat") as infile:
+        assert sum([line.startswith("#") for line in infile]) == 1
+    data = np.loadtxt(filename + ".dat")
+    assert np.allclose(data, [[0, 0.], [1, 0.1], [2, 0.2], [3, 0.3]])
+
+
+def test_compiled_functional():
+    """ The compiled form follows the function it refers to. """
+    mesh = df.UnitSquareMesh(8, 8)
+    f = df.Function(df.FunctionSpace(mesh, "Lagrange", 1))
+    functional = CompiledFunctional(f*df.dx)
+    f.vector()[:] = 2.
+    assert abs(functional()-2.) < 1e-12
+    f.interpolate(df.Expression("x[0]", degree=1))
+    assert abs(functional()-0.5) < 1e-12
+
+
+def test_point_values():
+    """ Values at fixed points, component by component. """
+    mesh = df.UnitSquareMesh(8, 8)
+    f = df.interpolate(df.Expression(("x[0]", "2*x[1]"), degree=1),
+                       df.VectorFunctionSpace(mesh, "Lagrange", 1))
+    values = PointValues(f, [(0.25, 0.5), (0.9, 0.1)], mesh)
+    assert np.allclose(values(), [0.25, 1., 0.9, 0.2])
+
+
+@pytest.mark.parametrize("relaxation", [1., 0.5])
+def test_droplet_frame_translating(relaxation):
+    """ For a droplet translating uniformly with the fluid, the frame
+    velocity converges to that of the droplet, the lab velocity u + U is
+    kept, and the walls at rest move at -U in the frame. """
+    mesh = df.UnitSquareMesh(16, 16)
+    P2 = df.VectorElement("Lagrange", mesh.ufl_cell(), 2)
+    P1 = df.FiniteElement("Lagrange", mesh.ufl_cell(), 1)
+    W = df.FunctionSpace(mesh, df.MixedElement([P2, P1]))
+    u_lab = np.array([0.3, -0.1])
+    w_ = df.interpolate(df.Constant((u_lab[0], u_lab[1], 0.)), W)
+    w_1 = w_.copy(deepcopy=True)
+    phi_ = df.interpolate(
+        df.Expression("tanh((sqrt(pow(x[0]-0.5, 2) + pow(x[1]-0.5, 2))"
+                      " - 0.2)/0.02)", degree=2),
+        df.FunctionSpace(mesh, "Lagrange", 1))
+
+    u_comoving = df.Constant((0., 0.))
+    parameters = dict(comoving_velocity=[0., 0.])
+    wall = LabFixed((0., 0.))
+    frame = DropletFrame(u_comoving, w_, w_1, phi_, parameters,
+                         dict(wall=dict(u=wall)), relaxation)
+    for _ in range(50):
+        frame.update(0.01)
+
+    assert np.allclose(frame.velocity, u_lab)
+    assert np.allclose(u_comoving.values(), u_lab)
+    assert np.allclose(parameters["comoving_velocity"], u_lab)
+    assert np.allclose(wall.value.values(), -u_lab)
+    for w in [w_, w_1]:
+        for x in [(0.5, 0.5), (0.1, 0.9)]:
+            u = w(*x)[:2]
+            assert np.allclose(u, 0.)
+            assert np.allclose(u + frame.velocity, u_lab)
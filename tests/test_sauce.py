@@ -39,6 +39,176 @@ def test_taylorgreen(solver, num_proc):
         assert eval(e) < 1e-1
 
 
+@pytest.mark.parametrize("solver", ["basic", "stable_single"])
+@pytest.mark.parametrize("num_proc", [1])
+def test_taylorgreen_equal_order(solver, num_proc):
+    """ P1-P1 with PSPG converges at second order in the velocity over a
+    refinement pair, and Taylor-Hood (without PSPG) stays the more
+    accurate of the two. """
+    cmd = ("cd ..; mpiexec -n {} python sauce.py solver={} "
+           "problem=taylorgreen T=0.05 dt=0.0005 testing=True "
+           "enable_PF=False enable_EC=False N={}{}")
+    p1 = " pspg=True 'base_elements={\"u\": [\"Lagrange\", 1, true]}'"
+    errors = dict()
+    for elements in ["", p1]:
+        for N in [16, 32]:
+            d = subprocess.check_output(
+                cmd.format(num_proc, solver, N, elements), shell=True)
+            match = re.search("Final error norms: u = " + number, str(d))
+            errors[elements, N] = eval(match.groups()[0])
+
+    # The first-order time error may dominate Taylor-Hood at this dt
+    rate = math.log(errors[p1, 16]/errors[p1, 32], 2)
+    assert rate > 1.5
+    assert errors["", 32] < 1.1*errors["", 16]
+    assert errors[p1, 32] < 1e-1
+    assert errors["", 32] < errors[p1, 32]
+
+
+@pytest.mark.parametrize("net_charge", [0., 0.5])
+def test_nullspace_lagrange(net_charge):
+    """ On a closed problem, the nullspaces of the pressure and the electric
+    potential give the same solution as the Lagrange multipliers, also
+    with a net charge. """
+    cmd = ("cd ..; mpiexec -n 1 python sauce.py problem=single_neumann "
+           "T=0.02 N=16 testing=True use_iterative_solvers=False "
+           "net_charge={} p_lagrange={} V_lagrange={} "
+           "p_nullspace={} V_nullspace={}")
+    norms = dict()
+    for nullspace in [False, True]:
+        d = subprocess.check_output(
+            cmd.format(net_charge, not nullspace, not nullspace,
+                       nullspace, nullspace), shell=True)
+        match = re.search("Final norms: u = " + number +
+                          " p = " + number +
+                          " V = " + number, str(d))
+        norms[nullspace] = [eval(e) for e in match.groups()]
+
+    for norm_lagrange, norm_nullspace in zip(norms[False], norms[True]):
+        assert abs(norm_nullspace-norm_lagrange) < 1e-6*(norm_lagrange+1e-8)
+
+
+@pytest.mark.parametrize("num_proc", [1, 2])
+def test_intrusion_bulk_hele_shaw(num_proc):
+    """ The walls of the channel are impermeable, so the mean velocity is
+    that of the inflow. """
+    cmd = ("cd ..; mpiexec -n {} python sauce.py solver=hele_shaw "
+           "problem=intrusion_bulk T=0.08 dt=0.04 grid_spacing=0.0625 "
+           "inlet_velocity=0.1 use_iterative_solvers=False testing=True")
+    d = subprocess.check_output(cmd.format(num_proc), shell=True)
+    match = re.search("Mean velocity = " + number, str(d))
+    u_mean = eval(match.groups()[0])
+
+    assert abs(u_mean-0.1) < 5e-3
+
+
+def test_gummel_coupled():
+    """ The Gummel iterations converge to the coupled L1 solution. """
+    cmd = ("cd ..; mpiexec -n 1 python sauce.py problem=single_neumann "
+           "T=0.01 N=16 testing=True use_iterative_solvers=False "
+           "V_lagrange=False EC_scheme={} gummel_iterations={}")
+    norms = dict()
+    for scheme, iterations in [("L1", 1), ("Gummel", 1), ("Gummel", 10)]:
+        d = subprocess.check_output(cmd.format(scheme, iterations),
+                                    shell=True)
+        match = re.search("Final norms: u = " + number +
+                          " p = " + number +
+                          " V = " + number, str(d))
+        norms[scheme, iterations] = [eval(e) for e in match.groups()]
+
+    for norm_coupled, norm_1, norm_10 in zip(norms["L1", 1],
+                                              norms["Gummel", 1],
+                                              norms["Gummel", 10]):
+        assert abs(norm_10-norm_coupled) < 1e-4*(norm_coupled+1e-8)
+        assert (abs(norm_10-norm_coupled) <=
+                abs(norm_1-norm_coupled) + 1e-12)
+
+
+@pytest.mark.parametrize("solver", ["basic", "TDLUES"])
+def test_taylorgreen_substeps(solver):
+    """ Subcycled electrochemistry stays as accurate as the single-rate
+    scheme. """
+    cmd = ("cd ..; mpiexec -n 1 python sauce.py solver={} "
+           "problem=taylorgreen T=0.002 testing=True N=20 EC_substeps={}")
+    errors = dict()
+    for substeps in [1, 2]:
+        d = subprocess.check_output(cmd.format(solver, substeps), shell=True)
+        match = re.search("Final error norms: u = " + number +
+                          " phi = " + number +
+                          " c_p = " + number +
+                          " c_m = " + number +
+                          " V = " + number, str(d))
+        errors[substeps] = [eval(e) for e in match.groups()]
+
+    for e_1, e_2 in zip(errors[1], errors[2]):
+        assert e_2 < 1e-1
+        assert e_2 < 1.5*e_1 + 1e-8
+
+
+def test_single_neumann_substeps():
+    """ The subcycled stable_single_fracstep solver stays close to the
+    single-rate run. """
+    cmd = ("cd ..; mpiexec -n 1 python sauce.py problem=single_neumann "
+           "solver=stable_single_fracstep T=0.01 N=16 testing=True "
+           "use_iterative_solvers=False V_lagrange=False p_lagrange=False "
+           "EC_substeps={}")
+    norms = dict()
+    for substeps in [1, 2]:
+        d = subprocess.check_output(cmd.format(substeps), shell=True)
+        match = re.search("Final norms: u = " + number +
+                          " p = " + number +
+                          " V = " + number, str(d))
+        norms[substeps] = [eval(e) for e in match.groups()]
+
+    for norm_1, norm_2 in zip(norms[1], norms[2]):
+        assert abs(norm_2-norm_1) < 5e-2*(norm_1+1e-8)
+
+
+@pytest.mark.parametrize("solver", ["basic", "stable_single"])
+def test_taylorgreen_transport_stabilization(solver):
+    """ On a coarse mesh with little diffusion, the stabilized
+    concentrations are no less accurate than the plain Galerkin ones. """
+    cmd = ("cd ..; mpiexec -n 1 python sauce.py solver={} "
+           "problem=taylorgreen T=0.05 dt=0.005 N=8 testing=True "
+           "enable_PF=False transport_stabilization={} "
+           "'solutes=[[\"c_p\", 1, 0.001, 0.001, 2.0, -2.0], "
+           "[\"c_m\", -1, 0.001, 0.001, 1.0, -1.0]]'")
+    errors = dict()
+    for stabilization in ["False", "supg", "edge"]:
+        d = subprocess.check_output(cmd.format(solver, stabilization),
+                                    shell=True)
+        match = re.search("Final error norms: u = " + number +
+                          " c_p = " + number +
+                          " c_m = " + number +
+                          " V = " + number, str(d))
+        errors[stabilization] = [eval(e) for e in match.groups()]
+
+    for stabilization in ["supg", "edge"]:
+        for e, e_galerkin in zip(errors[stabilization][1:3],
+                                 errors["False"][1:3]):
+            assert e < 1.2*e_galerkin
+
+
+def test_simple_axisym():
+    """ The axisymmetric bubble is independent of the number of processes,
+    and rises about as fast as the bubble of simple_3D. """
+    cmd = ("cd ..; mpiexec -n {} python sauce.py problem={} T=0.05 "
+           "grid_spacing={} testing=True")
+    u_rise = dict()
+    for problem, num_proc, grid_spacing in [("simple_axisym", 1, 1./32),
+                                            ("simple_axisym", 2, 1./32),
+                                            ("simple_3D", 2, 1./16)]:
+        d = subprocess.check_output(
+            cmd.format(num_proc, problem, grid_spacing), shell=True)
+        match = re.search("Rise velocity = " + number, str(d))
+        u_rise[problem, num_proc] = eval(match.groups()[0])
+
+    assert abs(u_rise["simple_axisym", 2]-u_rise["simple_axisym", 1]) < tol
+    assert u_rise["simple_axisym", 1] > 0.
+    assert (abs(u_rise["simple_axisym", 1]-u_rise["simple_3D", 2]) <
+            0.25*u_rise["simple_3D", 2])
+
+
 if __name__ == "__main__":
     #test_simple("basic", 1)
     test_taylorgreen("basic", 1)
@@ -0,0 +1,170 @@
+import os
+import sys
+import time
+import shutil
+import numpy as np
+import pytest
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+from utilities.interpolation import locate_points, interpolation_matrix
+from utilities.level_set import level_set_geometry
+from utilities.convergence_study import get_runs, run_order, \
+    observed_orders
+
+
+def square_mesh(n, hole_radius=0.):
+    """ Triangulated unit square with n x n squares, without the triangles
+    whose centroid is within hole_radius of the centre. """
+    x, y = np.meshgrid(np.linspace(0., 1., n+1), np.linspace(0., 1., n+1))
+    nodes = np.vstack((x.flatten(), y.flatten())).T
+    i, j = np.meshgrid(np.arange(n), np.arange(n))
+    a = (j*(n+1) + i).flatten()
+    elems = np.vstack((np.vstack((a, a+1, a+n+2)).T,
+                       np.vstack((a, a+n+2, a+n+1)).T))
+    centroids = nodes[elems].mean(axis=1)
+    elems = elems[np.sqrt(((centroids-0.5)**2).sum(axis=1)) > hole_radius]
+    return nodes, elems
+
+
+def grid_points(num, margin=0.05):
+    s = np.linspace(-margin, 1.+margin, num)
+    x, y = np.meshgrid(s, s)
+    return np.vstack((x.flatten(), y.flatten())).T
+
+
+def test_locate_points_hole():
+    """ Points in the hole and outside the domain are not found, and linear
+    fields are interpolated exactly elsewhere. """
+    nodes, elems = square_mesh(40, hole_radius=0.3)
+    x = grid_points(101)
+    P, found = interpolation_matrix(nodes, elems, x)
+
+    r = np.sqrt(((x-0.5)**2).sum(axis=1))
+    in_square = (x >= 0.).all(axis=1) & (x <= 1.).all(axis=1)
+    assert not found[~in_square].any()
+    assert not found[r < 0.25].any()
+    assert found[in_square & (r > 0.35)].all()
+
+    f = 2.*nodes[:, 0] - nodes[:, 1]
+    assert np.allclose((P*f)[found], 2.*x[found, 0] - x[found, 1])
+
+
+def test_locate_points_extrapolate():
+    nodes, elems = square_mesh(20, hole_radius=0.3)
+    x = grid_points(51, margin=0.2)
+    cells, weights = locate_points(nodes, elems, x, extrapolate=True)
+    assert (cells >= 0).all()
+    assert np.allclose(weights.sum(axis=1), 1.)
+    assert (weights >= -1e-8).all()
+
+
+@pytest.mark.parametrize("n", [190])
+def test_locate_points_timing(n):
+    """ Rasterizing a large mesh with a hole must not fall back to a search
+    over all elements for the points outside it. """
+    nodes, elems = square_mesh(n, hole_radius=0.3)
+    x = grid_points(200)
+    t0 = time.time()
+    cells, _ = locate_points(nodes, elems, x)
+    assert time.time()-t0 < 5.
+    assert (cells < 0).sum() > 0.2*len(x)
+
+
+def test_raster_renderer_hole():
+    """ The background pixels of a non-convex domain are found quickly, and
+    are left blank. """
+    from utilities.raster import RasterRenderer
+    nodes, elems = square_mesh(190, hole_radius=0.3)
+    t0 = time.time()
+    renderer = RasterRenderer(nodes, elems, width=400)
+    assert time.time()-t0 < 10.
+    image = renderer.render(charge=np.zeros(len(nodes)))
+    height, width = renderer.shape
+    assert (image[height//2, width//2] == renderer.background).all()
+    assert not (image[height//10, width//10] == renderer.background).all()
+
+
+def test_fancy_plotter_render():
+    """ Frames are rendered to RGB arrays of the size of the figure, and
+    the reused figure is redrawn for every frame. """
+    from utilities.plot import FancyPlotter
+    nodes, elems = square_mesh(20)
+    plotter = FancyPlotter(nodes, elems, charge_max=1., num_intp=20,
+                           width=2., dpi=50)
+    r = np.sqrt(((nodes-0.5)**2).sum(axis=1))
+    phi = np.tanh((r-0.25)/0.05)
+    charge = nodes[:, 0]-0.5
+    u = np.vstack((0.5-nodes[:, 1], nodes[:, 0]-0.5)).T
+    image = plotter.render(phi, charge, u)
+    assert image.shape == (100, 100, 3)
+    assert image.dtype == np.uint8
+    image_inverse = plotter.render(-phi, charge)
+    assert image_inverse.shape == image.shape
+    assert not np.array_equal(image, image_inverse)
+
+
+@pytest.mark.skipif(shutil.which("ffmpeg") is None,
+                    reason="ffmpeg is not installed")
+def test_animation_writer(tmpdir):
+    """ Frames streamed to ffmpeg are encoded to a GIF. """
+    from utilities.plot import AnimationWriter
+    filename = str(tmpdir.join("animation.gif"))
+    writer = AnimationWriter(filename, fps=5)
+    for i in range(3):
+        writer.write(np.full((20, 30, 3), 80*i, dtype=np.uint8))
+    writer.close()
+    assert os.path.getsize(filename) > 0
+
+
+@pytest.mark.parametrize("reverse", [False, True])
+def test_level_set_zero_at_nodes(reverse):
+    """ A circle through nodes where phi is exactly zero is one closed
+    polyline, whatever the orientation of the elements. """
+    nodes, elems = square_mesh(20)
+    if reverse:
+        elems = elems[:, ::-1]
+    R = 0.25
+    # Some nodes get exactly zero, others round-off values about zero
+    phi = np.sqrt(((nodes-0.5)**2).sum(axis=1)) - R
+    assert (phi == 0.).sum() > 0
+
+    data = level_set_geometry(nodes, elems, phi)
+    assert len(data["polylines"]) == 1
+    path = data["polylines"][0]
+    assert np.allclose(path[0], path[-1])
+    length = np.sqrt((np.diff(path, axis=0)**2).sum(axis=1)).sum()
+    assert abs(length-data["measure"]) < 1e-12
+    assert abs(length-2*np.pi*R) < 0.01
+    assert abs(data["volume"]-np.pi*R**2) < 0.01
+
+
+def test_run_order():
+    """ Paired refinements are started finest first, and a single dt is
+    kept for all grid spacings. """
+    runs = get_runs([0.1, 0.025, 0.05], [0.01, 0.0025, 0.005])
+    assert [run["label"] for run in run_order(runs)] == [
+        "h0.025_dt0.0025", "h0.05_dt0.005", "h0.1_dt0.01"]
+
+    runs = get_runs([0.05, 0.1], 0.01)
+    assert [run["dt"] for run in runs] == [0.01, 0.01]
+    assert [run["grid_spacing"] for run in run_order(runs)] == [0.05, 0.1]
+
+
+@pytest.mark.parametrize("order", [1., 2.])
+def test_observed_orders(order):
+    """ The pairwise and fitted orders of synthetic errors C*h^order, also
+    with a perturbation and with a vanishing error, which is left out of
+    the fit. """
+    h = np.array([0.1, 0.05, 0.025, 0.0125])
+    pairwise, fitted = observed_orders(h, 3.*h**order)
+    assert np.allclose(pairwise, order)
+    assert np.isclose(fitted, order)
+
+    perturbation = np.array([1.05, 0.95, 1.05, 0.95])
+    pairwise, fitted = observed_orders(h, 3.*h**order*perturbation)
+    assert np.all(np.abs(pairwise-order) < 0.2)
+    assert abs(fitted-order) < 0.1
+
+    errors = 3.*h**order
+    errors[-1] = 0.
+    pairwise, fitted = observed_orders(h, errors)
+    assert np.isclose(fitted, order)
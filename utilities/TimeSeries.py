@@ -4,13 +4,18 @@ import sys
 from mpi4py import MPI
 import h5py
 import glob
+from collections import OrderedDict
 # Find path to the BERNAISE root folder
 bernaise_path = "/" + os.path.join(*os.path.realpath(__file__).split("/")[:-2])
 # ...and append it to sys.path to get functionality from BERNAISE
 sys.path.append(bernaise_path)
 from .generate_mesh import numpy_to_dolfin
+from .interpolation import interpolation_matrix, basis_gradients, \
+    mesh_hash
+import scipy.sparse as sp
 from common import makedirs_safe, info_warning, info_split, info_on_red, \
     load_parameters, parse_xdmf, info
+from common.functions import ramp
 import dolfin as df
 
 
@@ -35,9 +40,14 @@ def prep(x_list):
 class TimeSeries:
     """ Class for loading timeseries """
     def __init__(self, folder, sought_fields=None, get_mesh_from=False,
-                 memory_modest=True):
+                 memory_modest=True, cache_size=2**28, comm=comm):
         self.folder = folder
 
+        # Communicator of the mesh. A serial communicator gives every
+        # process its own copy of the mesh (parallel-over-time mode).
+        self.comm = comm
+        self.parallel_time = comm.Get_size() == 1 and size > 1
+
         self.settings_folder = os.path.join(folder, "Settings")
         self.timeseries_folder = os.path.join(folder, "Timeseries")
         self.statistics_folder = os.path.join(folder, "Statistics")
@@ -47,6 +57,12 @@ class TimeSeries:
 
         self.memory_modest = memory_modest
 
+        # Least recently used snapshots read from file, limited by
+        # cache_size (in bytes).
+        self.cache = OrderedDict()
+        self.cache_size = cache_size
+        self.cache_bytes = 0
+
         self.params_prefix = os.path.join(self.settings_folder,
                                           "parameters_from_tstep_")
         self.params_suffix = ".dat"
@@ -55,10 +71,22 @@ class TimeSeries:
 
         self.nodes = None
         self.elems = None
+        # Mesh of every step, and the matrices that interpolate the
+        # snapshots on other meshes than the first (adaptive meshes) to it
+        self.step_meshes = []
+        self.num_meshes = 1
+        self.mesh_transfers = dict()
+        # Fields as stored by the simulation, on the mesh of their step
+        self.native_fields = set()
 
         self.times = dict()
         self.datasets = dict()
+        # Fields computed on demand: field -> (dependencies, expression)
+        self.derived = dict()
+        # Interpolation matrices for probe points, keyed by the points
+        self.probe_operators = dict()
 
+        self.sought_fields = sought_fields
         self._load_timeseries(sought_fields)
 
         if len(self.fields) > 0:
@@ -66,13 +94,16 @@ class TimeSeries:
 
             self.dummy_function = df.Function(self.function_space)
 
+            self._declare_derived_fields()
+
             makedirs_safe(self.analysis_folder)
             makedirs_safe(self.plots_folder)
             makedirs_safe(self.tmp_folder)
 
     def _load_mesh(self, get_mesh_from):
         if not get_mesh_from:
-            self.mesh = numpy_to_dolfin(self.nodes, self.elems)
+            self.mesh = numpy_to_dolfin(self.nodes, self.elems,
+                                        comm=self.comm)
             self.function_space = df.FunctionSpace(self.mesh, "CG", 1)
             self.vector_function_space = df.VectorFunctionSpace(
                 self.mesh, "CG", 1)
@@ -80,6 +111,9 @@ class TimeSeries:
 
             self.x = self._make_dof_coords()
             self.xdict = self._make_xdict()
+            self.dof_to_node = np.array(
+                [self.xdict[prep(x_val)] for x_val in self.x.tolist()],
+                dtype=int)
 
             indices_function = df.Function(self.function_space)
             self.set_val(indices_function, np.arange(len(self.nodes)))
@@ -92,6 +126,7 @@ class TimeSeries:
             self.dim = get_mesh_from.dim
             self.x = get_mesh_from.x
             self.xdict = get_mesh_from.xdict
+            self.dof_to_node = get_mesh_from.dof_to_node
             self.indices = get_mesh_from.indices
 
     def _load_timeseries(self, sought_fields=None):
@@ -104,6 +139,8 @@ class TimeSeries:
             exit()
 
         data = dict()
+        # Mesh addresses of the snapshots: field -> time -> addresses
+        meshes = dict()
         for params_file in glob.glob(
                 self.params_prefix + "*" + self.params_suffix):
             parameters = dict()
@@ -132,16 +169,13 @@ class TimeSeries:
                     if bool(field not in data):
                         data[field] = dict()
 
-                    dsets, topology_address, geometry_address \
-                        = parse_xdmf(xml_file, get_mesh_address=True)
-
-                    if self.elems is None:
-                        with h5py.File(topology_address[0], "r") as h5f:
-                            self.elems = np.array(h5f[topology_address[1]])
-
-                    if self.nodes is None:
-                        with h5py.File(geometry_address[0], "r") as h5f:
-                            self.nodes = np.array(h5f[geometry_address[1]])
+                    dsets, mesh_addresses = parse_xdmf(
+                        xml_file, get_mesh_address=True)
+                    if bool(field not in meshes):
+                        meshes[field] = dict()
+                    for (time, _), mesh_address in zip(dsets,
+                                                       mesh_addresses):
+                        meshes[field][time] = mesh_address
 
                     with h5py.File(data_file, "r") as h5f:
                         for time, dset_address in dsets:
@@ -156,10 +190,49 @@ class TimeSeries:
             tmps = sorted(data[field].items())
             if i == 0:
                 self.times = [tmp[0] for tmp in tmps]
+                self.step_meshes = [meshes[field][tmp[0]] for tmp in tmps]
             self[field] = [tmp[1] for tmp in tmps]
+        self.native_fields = set(data.keys())
+        if self.nodes is None and len(self.times) > 0:
+            self.nodes, self.elems = self._read_mesh(self.step_meshes[0])
+        num_meshes = len(set(self.step_meshes))
+        if num_meshes > 1 and num_meshes != self.num_meshes:
+            info("The time series is stored on {} meshes; the snapshots "
+                 "are interpolated to the mesh of the first step.".format(
+                     num_meshes))
+        self.num_meshes = num_meshes
         self.parameters = sorted(self.parameters.items())
         self.fields = self.datasets.keys()
 
+    def refresh(self):
+        """ Reload the time series, e.g. while a simulation is still
+        writing to it. The mesh is kept. Returns True if new steps were
+        found. """
+        num_steps = len(self)
+        backup = (self.parameters, self.times, self.datasets, self.fields,
+                  self.step_meshes, self.native_fields)
+        self.parameters = dict()
+        self.datasets = dict()
+        try:
+            self._load_timeseries(self.sought_fields)
+            success = True
+        except (IOError, OSError, KeyError, SyntaxError) as e:
+            # Files may be incomplete while being written; retry later.
+            info_warning("Could not refresh time series: {}".format(e))
+            success = False
+        if not comm.allreduce(success, op=MPI.LAND):
+            (self.parameters, self.times, self.datasets, self.fields,
+             self.step_meshes, self.native_fields) = backup
+            return False
+        # All processes must agree on the available steps.
+        num_steps_new = comm.allreduce(len(self), op=MPI.MIN)
+        self.times = self.times[:num_steps_new]
+        self.step_meshes = self.step_meshes[:num_steps_new]
+        for field in self.fields:
+            self.datasets[field] = self.datasets[field][:num_steps_new]
+        self.clear_cache()
+        return num_steps_new > num_steps
+
     def _make_dof_coords(self):
         dofmap = self.function_space.dofmap()
         my_first, my_last = dofmap.ownership_range()
@@ -183,10 +256,8 @@ class TimeSeries:
 
     def set_val(self, f, f_data):
         vec = f.vector()
-        values = vec.get_local()
-        values[:] = [f_data[self.xdict[prep(x_val)]]
-                     for x_val in self.x.tolist()]
-        vec.set_local(values)
+        values = np.asarray(f_data, dtype=float).reshape(len(self.nodes))
+        vec.set_local(values[self.dof_to_node])
         vec.apply('insert')
 
     def update(self, f, field, step):
@@ -230,19 +301,248 @@ class TimeSeries:
             return self.datasets[key]
         if len(key) == 2:
             field, step = key
-            if self.memory_modest:
-                data_file, dset_address = self.datasets[field][step]
-                with h5py.File(data_file, "r") as h5f:
-                    return np.array(h5f[dset_address])
+            if field in self.derived and field not in self.datasets:
+                return self._cached(field, step, self._compute_derived)
+            if self.memory_modest or bool(
+                    field in self.native_fields and
+                    self.mesh_transfer(step) is not None):
+                return self._cached(field, step, self._read)
             else:
                 return self.datasets[field][step]
 
+    def _read(self, field, step):
+        if self.memory_modest:
+            data_file, dset_address = self.datasets[field][step]
+            with h5py.File(data_file, "r") as h5f:
+                data = np.array(h5f[dset_address])
+        else:
+            data = np.array(self.datasets[field][step])
+        if field in self.native_fields:
+            P = self.mesh_transfer(step)
+            if P is not None:
+                data = P.dot(data)
+        return data
+
+    def _read_mesh(self, mesh_address):
+        (topology_file, topology), (geometry_file, geometry) = mesh_address
+        with h5py.File(topology_file, "r") as h5f:
+            elems = np.array(h5f[topology])
+        with h5py.File(geometry_file, "r") as h5f:
+            nodes = np.array(h5f[geometry])
+        return nodes, elems
+
+    def mesh_transfer(self, step):
+        """ Sparse matrix interpolating the snapshots of step from their
+        mesh to the mesh of the time series, or None if they are on it.
+        Computed once per mesh. """
+        mesh_address = self.step_meshes[step]
+        if mesh_address not in self.mesh_transfers:
+            nodes, elems = self._read_mesh(mesh_address)
+            P = None
+            if not (nodes.shape == self.nodes.shape and
+                    elems.shape == self.elems.shape and
+                    np.array_equal(nodes, self.nodes) and
+                    np.array_equal(elems, self.elems)):
+                P, _ = interpolation_matrix(nodes, elems, self.nodes,
+                                            extrapolate=True)
+            self.mesh_transfers[mesh_address] = P
+        return self.mesh_transfers[mesh_address]
+
+    def _cached(self, field, step, load):
+        """ Load snapshot, or get it from the cache if it has been loaded
+        recently. The returned array is read-only since it is shared. """
+        key = (field, step)
+        if key in self.cache:
+            data = self.cache.pop(key)
+            self.cache[key] = data
+            return data
+        data = load(field, step)
+        data.setflags(write=False)
+        if data.nbytes <= self.cache_size:
+            self.cache[key] = data
+            self.cache_bytes += data.nbytes
+            while self.cache_bytes > self.cache_size:
+                _, data_old = self.cache.popitem(last=False)
+                self.cache_bytes -= data_old.nbytes
+        return data
+
+    def clear_cache(self, field=None):
+        for key in list(self.cache.keys()):
+            if field is None or key[0] == field:
+                self.cache_bytes -= self.cache.pop(key).nbytes
+
     def __setitem__(self, key, val):
+        self.clear_cache(key)
+        self.native_fields.discard(key)
         self.datasets[key] = val
 
     def __contains__(self, key):
         """ Overload 'in' operator """
-        return key in self.datasets
+        return key in self.datasets or key in self.derived
+
+    def add_derived_field(self, field, dependencies, expression):
+        """ Declare a field that is computed on demand at each step.
+        expression is a vectorized numpy function taking the nodal data of
+        the dependencies (at the same step) as arguments. """
+        self.derived[field] = (dependencies, expression)
+        self.clear_cache(field)
+
+    def _compute_derived(self, field, step):
+        dependencies, expression = self.derived[field]
+        data = expression(*[self[dep, step] for dep in dependencies])
+        return np.asarray(data, dtype=float).reshape(len(self.nodes), -1)
+
+    def _declare_derived_fields(self):
+        """ Declare the standard derived fields that are available from the
+        stored fields. """
+        fields = set(self.fields)
+        solutes = self.get_parameter("solutes", default=[])
+        species = [solute[0] for solute in solutes]
+        z = [solute[1] for solute in solutes]
+
+        if len(species) > 0 and fields.issuperset(species):
+            self.add_derived_field(
+                "charge", species,
+                lambda *c: sum([z_i*c_i for z_i, c_i in zip(z, c)]))
+
+            permittivity = self.get_parameter("permittivity")
+            if "phi" in fields and permittivity:
+                def debye_length(phi, *c):
+                    veps = ramp(np.clip(phi, -1., 1.), permittivity)
+                    ionic = sum([z_i**2*c_i for z_i, c_i in zip(z, c)])
+                    with np.errstate(divide="ignore"):
+                        return np.sqrt(veps/np.maximum(ionic, 0.))
+                self.add_derived_field("debye_length", ["phi"] + species,
+                                       debye_length)
+
+        if "u" in fields:
+            self.add_derived_field(
+                "speed", ["u"],
+                lambda u: np.linalg.norm(u[:, :self.dim], axis=1))
+            self.add_derived_field("vorticity", ["u"], self.curl)
+
+        if "phi" in fields:
+            self.add_derived_field(
+                "interface", ["phi"],
+                lambda phi: 1.-np.clip(phi, -1., 1.)**2)
+
+    def _make_gradient_weights(self):
+        """ Gradients of the P1 basis functions in each element, and the
+        element volumes. """
+        self._grad_basis, self._elem_volume = basis_gradients(
+            self.nodes, self.elems)
+        self._node_volume = np.zeros(len(self.nodes))
+        for k in range(self.elems.shape[1]):
+            np.add.at(self._node_volume, self.elems[:, k], self._elem_volume)
+
+    def gradient(self, f_data):
+        """ Nodal gradient of nodal (P1) data, as the volume-weighted
+        average of the element gradients around each node. """
+        if not hasattr(self, "_grad_basis"):
+            self._make_gradient_weights()
+        f_data = np.asarray(f_data).reshape(len(self.nodes))
+        grad_elem = np.einsum("ek,ekd->ed", f_data[self.elems],
+                              self._grad_basis)
+        grad_elem *= self._elem_volume[:, None]
+        grad = np.zeros((len(self.nodes), grad_elem.shape[1]))
+        for k in range(self.elems.shape[1]):
+            np.add.at(grad, self.elems[:, k], grad_elem)
+        return grad/self._node_volume[:, None]
+
+    def curl(self, u_data):
+        """ Nodal vorticity of nodal velocity data. """
+        grads = [self.gradient(u_data[:, d]) for d in range(self.dim)]
+        if self.dim == 2:
+            return grads[1][:, 0] - grads[0][:, 1]
+        return np.array([grads[2][:, 1] - grads[1][:, 2],
+                         grads[0][:, 2] - grads[2][:, 0],
+                         grads[1][:, 0] - grads[0][:, 1]]).T
+
+    def probe_operator(self, x):
+        """ Sparse matrix interpolating nodal data to the points x. The
+        points are located once, and the matrix is reused. """
+        x = np.ascontiguousarray(x, dtype=float)
+        key = (x.shape, x.tobytes())
+        if key not in self.probe_operators:
+            P, found = interpolation_matrix(self.nodes, self.elems, x)
+            if not found.all():
+                info_warning("{} of {} probe points are outside the "
+                             "mesh.".format(len(found)-found.sum(),
+                                            len(found)))
+            self.probe_operators[key] = P
+        return self.probe_operators[key]
+
+    def probe(self, x, fields=None, steps=None):
+        """ Sample fields at the points x at the given steps. Returns a dict
+        from field to an array of shape (steps, points, components). The
+        snapshots are stacked, so that each field is sampled by a single
+        sparse matrix product per chunk of steps. """
+        P = self.probe_operator(x)
+        if fields is None:
+            fields = self.fields
+        if steps is None:
+            steps = range(len(self))
+        steps = list(steps)
+
+        probes = dict()
+        for field in fields:
+            data_0 = self[field, steps[0]]
+            num_comps = data_0.shape[1] if data_0.ndim > 1 else 1
+            if field == "u":
+                num_comps = self.dim
+            chunk_size = max(1, self.cache_size//max(data_0.nbytes, 1))
+            chunks = []
+            for i in range(0, len(steps), chunk_size):
+                data = np.hstack([
+                    self[field, step].reshape(
+                        len(self.nodes), -1)[:, :num_comps]
+                    for step in steps[i:i+chunk_size]])
+                chunks.append((P*data).reshape(
+                    P.shape[0], -1, num_comps).transpose(1, 0, 2))
+            probes[field] = np.concatenate(chunks, axis=0)
+        return probes
+
+    def mesh_hash(self):
+        if not hasattr(self, "_mesh_hash"):
+            self._mesh_hash = mesh_hash(self.nodes, self.elems)
+        return self._mesh_hash
+
+    def transfer_operator(self, ts_other):
+        """ Sparse matrix interpolating nodal data from this mesh to the
+        nodes of the mesh of ts_other. The matrix is stored in the .tmp
+        folder, keyed by the hashes of both meshes, and reused. """
+        transfer_file = os.path.join(
+            self.tmp_folder, "transfer_{}_{}.npz".format(
+                self.mesh_hash()[:16], ts_other.mesh_hash()[:16]))
+        comm.Barrier()
+        if os.path.exists(transfer_file):
+            return sp.load_npz(transfer_file)
+        P, found = interpolation_matrix(self.nodes, self.elems,
+                                        ts_other.nodes, extrapolate=True)
+        if rank == 0:
+            sp.save_npz(transfer_file, P)
+        comm.Barrier()
+        return P
+
+    def materialize(self, field, compression="gzip"):
+        """ Store a derived field (compressed) alongside the time series,
+        so that it is no longer recomputed. """
+        if not self.memory_modest:
+            self.add_field(field, [np.array(self[field, step])
+                                   for step in range(len(self))])
+            return
+        data_file = os.path.join(self.tmp_folder, field + ".h5")
+        dset_addresses = [field + "/" + str(step)
+                          for step in range(len(self))]
+        if rank == 0:
+            with h5py.File(data_file, "w") as h5f:
+                for step, dset_address in enumerate(dset_addresses):
+                    h5f.create_dataset(dset_address, data=self[field, step],
+                                       compression=compression)
+        comm.Barrier()
+        self[field] = [(data_file, dset_address)
+                       for dset_address in dset_addresses]
+        self.fields = self.datasets.keys()
 
     def function(self, field):
         if field == "u":
@@ -315,17 +615,9 @@ class TimeSeries:
         self.fields = self.datasets.keys()
 
     def compute_charge(self):
-        """ Computing charge datasets by summing over all species. """
-        solutes = self.get_parameter("solutes")
-        charge_datasets = []
-        for step in range(len(self)):
-            charge_loc = np.zeros_like(self[solutes[0][0], step])
-            for solute in solutes:
-                field = solute[0]
-                z = solute[1]
-                charge_loc[:, :] += z*self[field, step]
-            charge_datasets.append(charge_loc)
-        self.add_field("charge", charge_datasets)
+        """ Store the charge, summed over all species. The charge is also
+        available on demand as a derived field without this. """
+        self.materialize("charge")
 
     def nodal_values(self, f):
         """ Convert dolfin function to nodal values. """
@@ -337,7 +629,7 @@ class TimeSeries:
         arr_loc = np.zeros_like(arr)
         for i, fval in zip(self.indices, farray):
             arr_loc[i, :] = fval
-        comm.Allreduce(arr_loc, arr, op=MPI.SUM)
+        self.comm.Allreduce(arr_loc, arr, op=MPI.SUM)
 
         return arr
 
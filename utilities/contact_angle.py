@@ -5,6 +5,12 @@ import argparse
 import matplotlib.pyplot as plt
 from scipy.optimize import curve_fit, leastsq
 import simplejson
+import sys
+# Find path to the BERNAISE root folder
+bernaise_path = "/" + os.path.join(*os.path.realpath(__file__).split("/")[:-2])
+# ...and append it to sys.path to get functionality from BERNAISE
+sys.path.append(bernaise_path)
+from utilities.level_set import load_polylines
 
 
 def parse_args():
@@ -43,24 +49,6 @@ def expfit(x, A, B, tau):
     return y
 
 
-def read_blocks(input_file):
-    empty_lines = 0
-    blocks = [[]]
-    for line in open(input_file):
-        # Check for empty/commented lines
-        if not line or line.startswith('#') or line.startswith('\n'):
-            # If 1st one: new block
-            if empty_lines == 0:
-                blocks.append([])
-            empty_lines += 1
-        # Non empty line: add line in current(last) block
-        else:
-            empty_lines = 0
-            line.replace("\n", "")
-            blocks[-1].append([float(e) for e in line.split(" ")])
-    return blocks
-
-
 def main():
     args = parse_args()
 
@@ -80,7 +68,7 @@ def main():
         fs = sorted(os.listdir(folder))
         for f in fs:
             infile = os.path.join(folder, f)
-            data = np.array(read_blocks(infile)[0])
+            data = load_polylines(infile)[0]
 
             x = data[:, 1]
             y = data[:, 0]
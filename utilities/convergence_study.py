@@ -0,0 +1,233 @@
+"""
+Convergence studies in BERNAISE.
+
+Usage:
+python utilities/convergence_study.py problem=... grid_spacing=[...] dt=[...]
+    [cores=... procs=... folder=... time=... ref=... norm=...]
+    [+optional arguments to sauce.py]
+
+The refinements (grid_spacing and dt are paired, or one of them is kept
+fixed) are run concurrently within a budget of cores, each run on procs
+processes, with the most expensive runs started first. The errors are
+computed against the analytic reference of the problem (if available, and
+unless ref=finest) or against the finest run, and the observed orders of
+convergence are tabulated.
+"""
+import os
+import sys
+import subprocess
+import importlib
+from time import sleep
+import numpy as np
+# Find path to the BERNAISE root folder
+bernaise_path = "/" + os.path.join(*os.path.realpath(__file__).split("/")[:-2])
+# ...and append it to sys.path to get functionality from BERNAISE
+sys.path.append(bernaise_path)
+from common import parse_command_line, info, info_cyan, info_split, \
+    info_on_red, info_yellow
+from utilities.TimeSeries import TimeSeries
+
+
+def to_cmd_arg(key, value):
+    """ Format a keyword argument for the command line. """
+    if isinstance(value, list):
+        value = "[" + ",".join([str(v) for v in value]) + "]"
+    return "{}={}".format(key, value)
+
+
+def get_runs(grid_spacing, dt):
+    """ List of runs given lists (or single values) of grid spacings and
+    time steps. """
+    if not isinstance(grid_spacing, list):
+        grid_spacing = [grid_spacing]
+    if not isinstance(dt, list):
+        dt = [dt]
+    num_runs = max(len(grid_spacing), len(dt))
+    if len(grid_spacing) == 1:
+        grid_spacing = grid_spacing*num_runs
+    if len(dt) == 1:
+        dt = dt*num_runs
+    if len(grid_spacing) != len(dt):
+        info_on_red("grid_spacing and dt must have the same length.")
+        exit()
+    return [dict(grid_spacing=h, dt=dt_i,
+                 label="h{}_dt{}".format(h, dt_i))
+            for h, dt_i in zip(grid_spacing, dt)]
+
+
+def run_cost(run, dim=2):
+    """ Estimated cost of a run. """
+    return run["grid_spacing"]**(-dim)/run["dt"]
+
+
+def run_order(runs, dim=2):
+    """ The runs in the order they are started: the most expensive (the
+    finest) first. """
+    return sorted(runs, key=lambda run: run_cost(run, dim), reverse=True)
+
+
+def newest_subfolder(folder):
+    """ The newest numbered results folder of a run. """
+    numbers = [int(entry) for entry in os.listdir(folder) if entry.isdigit()]
+    if len(numbers) == 0:
+        return None
+    return os.path.join(folder, str(max(numbers)))
+
+
+def schedule_runs(runs, cmd_args, base_folder, cores=1, procs=1, dim=2):
+    """ Run sauce.py for all runs, with at most cores processes in total.
+    The most expensive runs are started first, which keeps the total
+    time close to that of the most expensive run. """
+    queue = run_order(runs, dim)
+    # Do not let the runs inherit the MPI environment of this process.
+    env = dict([(key, value) for key, value in os.environ.items()
+                if not key.startswith(("OMPI_", "PMIX_", "PMI_", "HYDRA_"))])
+    running = []
+    while len(queue) > 0 or len(running) > 0:
+        while len(queue) > 0 and (len(running)+1)*procs <= max(cores, procs):
+            run = queue.pop(0)
+            run_folder = os.path.join(base_folder, run["label"])
+            if not os.path.exists(run_folder):
+                os.makedirs(run_folder)
+            args = ([sys.executable, "sauce.py",
+                     to_cmd_arg("folder", run_folder),
+                     to_cmd_arg("grid_spacing", run["grid_spacing"]),
+                     to_cmd_arg("dt", run["dt"])] + cmd_args)
+            if procs > 1:
+                args = ["mpiexec", "-n", str(procs)] + args
+            info_split("Starting run:", run["label"])
+            logfile = open(os.path.join(run_folder, "log.txt"), "w")
+            running.append((run, logfile, subprocess.Popen(
+                args, cwd=bernaise_path, env=env, stdout=logfile,
+                stderr=subprocess.STDOUT)))
+
+        sleep(1.)
+        for item in list(running):
+            run, logfile, process = item
+            if process.poll() is not None:
+                logfile.close()
+                running.remove(item)
+                if process.returncode != 0:
+                    info_on_red("Run " + run["label"] + " failed. See " +
+                                os.path.join(base_folder, run["label"],
+                                             "log.txt"))
+                else:
+                    info_split("Finished run:", run["label"])
+
+
+def observed_orders(x, errors):
+    """ Observed orders between consecutive refinements, and the order
+    fitted to all of them. """
+    x = np.asarray(x, dtype=float)
+    errors = np.asarray(errors, dtype=float)
+    pairwise = np.log(errors[:-1]/errors[1:])/np.log(x[:-1]/x[1:])
+    valid = errors > 0.
+    if valid.sum() > 1:
+        fitted = np.polyfit(np.log(x[valid]), np.log(errors[valid]), 1)[0]
+    else:
+        fitted = np.nan
+    return pairwise, fitted
+
+
+def main():
+    info_yellow("BERNAISE: Convergence study")
+    cmd_kwargs = parse_command_line()
+
+    if cmd_kwargs.get("help", False):
+        info(__doc__)
+        exit()
+
+    problem = cmd_kwargs.pop("problem", None)
+    if problem is None:
+        info_on_red("No problem(=...) specified.")
+        exit()
+    grid_spacing = cmd_kwargs.pop("grid_spacing", 1./16)
+    dt = cmd_kwargs.pop("dt", 0.01)
+    cores = cmd_kwargs.pop("cores", 1)
+    procs = cmd_kwargs.pop("procs", 1)
+    base_folder = os.path.abspath(cmd_kwargs.pop(
+        "folder", os.path.join("results_convergence", problem)))
+    time = cmd_kwargs.pop("time", None)
+    ref = cmd_kwargs.pop("ref", "analytic")
+    norm_type = cmd_kwargs.pop("norm", "L2")
+    compute_only = cmd_kwargs.pop("compute_only", False)
+
+    runs = get_runs(grid_spacing, dt)
+    cmd_args = [to_cmd_arg("problem", problem)] + [
+        to_cmd_arg(key, value) for key, value in cmd_kwargs.items()]
+
+    if not compute_only:
+        info_cyan("Running {} refinements on {} cores.".format(
+            len(runs), cores))
+        schedule_runs(runs, cmd_args, base_folder, cores=cores, procs=procs)
+
+    info_cyan("Computing errors.")
+    ts = dict()
+    for run in runs:
+        folder = newest_subfolder(os.path.join(base_folder, run["label"]))
+        if folder is None:
+            info_on_red("No results for run " + run["label"] + ".")
+            exit()
+        ts[run["label"]] = TimeSeries(folder)
+
+    finest = min(runs, key=lambda run: (run["grid_spacing"], run["dt"]))
+    ts_finest = ts[finest["label"]]
+    if time is None:
+        time = ts_finest.times[-1]
+
+    problem_module = importlib.import_module("problems.{}".format(problem))
+    if ref == "analytic" and "reference" in problem_module.__dict__:
+        from analysis_scripts.analytic_reference import error_norms
+        info_split("Reference:", "analytic")
+        compared_runs = runs
+        norms = dict([(run["label"], error_norms(
+            ts[run["label"]],
+            [ts[run["label"]].get_nearest_step_and_time(time)]))
+                      for run in compared_runs])
+    else:
+        from analysis_scripts.reference import error_norms
+        info_split("Reference:", "finest run (" + finest["label"] + ")")
+        compared_runs = [run for run in runs if run is not finest]
+        norms = dict([(run["label"], error_norms(
+            ts[run["label"]], ts_finest, [time])[0])
+                      for run in compared_runs])
+
+    if len(set([run["grid_spacing"] for run in compared_runs])) > 1:
+        refined = "grid_spacing"
+    else:
+        refined = "dt"
+    compared_runs = sorted(compared_runs, key=lambda run: -run[refined])
+    x = [run[refined] for run in compared_runs]
+
+    fields = sorted(norms[compared_runs[0]["label"]].keys())
+    headers = ["grid_spacing", "dt"]
+    columns = []
+    fitted = []
+    for field in fields:
+        errors = [norms[run["label"]][field][norm_type][0]
+                  for run in compared_runs]
+        pairwise, fitted_field = observed_orders(x, errors)
+        headers.extend([field, "order"])
+        columns.append(errors)
+        columns.append([np.nan] + list(pairwise))
+        fitted.extend([np.nan, fitted_field])
+
+    table = [[run["grid_spacing"], run["dt"]] +
+             [column[i] for column in columns]
+             for i, run in enumerate(compared_runs)]
+    table.append(["fit", ""] + fitted)
+
+    from tabulate import tabulate
+    tab_string = tabulate(table, headers, floatfmt="e")
+    info_split("Norm:", norm_type)
+    info_split("Time:", str(time))
+    info("\n" + tab_string + "\n")
+    save_file = os.path.join(base_folder,
+                             "convergence_{}.dat".format(norm_type))
+    info_split("Saving to file:", save_file)
+    with open(save_file, "w") as outfile:
+        outfile.write(tab_string)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,137 @@
+"""
+Droplet labeling and tracking on simplicial meshes.
+
+The dispersed phase (phi < 0) is split into droplets, i.e. connected
+components of elements sharing facets, and the droplets are followed from
+step to step by their overlap. Everything is vectorized over the elements.
+"""
+import numpy as np
+import scipy.sparse as sp
+from scipy.sparse.csgraph import connected_components
+from .level_set import simplex_volumes
+
+
+def element_neighbours(elems):
+    """ Pairs (2, num_pairs) of elements sharing a facet. """
+    num_elems, num_verts = elems.shape
+    facets = np.vstack([np.sort(np.delete(elems, i, axis=1), axis=1)
+                        for i in range(num_verts)])
+    owners = np.tile(np.arange(num_elems), num_verts)
+    _, index = np.unique(facets, axis=0, return_inverse=True)
+    index = index.reshape(-1)
+    order = np.argsort(index, kind="stable")
+    shared = index[order][1:] == index[order][:-1]
+    return np.vstack((owners[order][:-1][shared], owners[order][1:][shared]))
+
+
+def label_droplets(neighbours, dispersed):
+    """ Connected components of the dispersed elements (boolean mask).
+    Returns the indices of the dispersed elements and their labels. """
+    elements = np.flatnonzero(dispersed)
+    local = -np.ones(len(dispersed), dtype=int)
+    local[elements] = np.arange(len(elements))
+    keep = dispersed[neighbours[0]] & dispersed[neighbours[1]]
+    graph = sp.coo_matrix(
+        (np.ones(keep.sum()), (local[neighbours[0][keep]],
+                               local[neighbours[1][keep]])),
+        shape=(len(elements), len(elements)))
+    _, labels = connected_components(graph, directed=False)
+    return elements, labels
+
+
+def droplet_integrals(elems, volumes, elements, labels, values):
+    """ Integrals over each droplet of the nodal (P1) fields in values
+    (num_nodes, num_fields), using the given droplet elements. Returns an
+    array (num_droplets, num_fields). """
+    num_droplets = labels.max()+1 if len(labels) > 0 else 0
+    element_means = values[elems[elements]].mean(axis=1)
+    weighted = volumes[elements, None]*element_means
+    return np.vstack([np.bincount(labels, weights=weighted[:, j],
+                                  minlength=num_droplets)
+                      for j in range(values.shape[1])]).T
+
+
+def match_droplets(elements_prev, ids_prev, elements, labels, volumes,
+                   next_id):
+    """ Identities of the current droplets, given the (dispersed) elements
+    and droplet ids at the previous step. A droplet inherits the id of the
+    previous droplet it overlaps the most. If several droplets overlap the
+    same previous one (breakup), the largest overlap keeps the id. Droplets
+    without an id get new ones, starting at next_id. Returns the ids and
+    the next free id. """
+    num_droplets = labels.max()+1 if len(labels) > 0 else 0
+    ids = -np.ones(num_droplets, dtype=int)
+    if len(elements_prev) > 0 and num_droplets > 0:
+        common, i_prev, i_cur = np.intersect1d(
+            elements_prev, elements, assume_unique=True, return_indices=True)
+        if len(common) > 0:
+            overlap = sp.coo_matrix(
+                (volumes[common], (labels[i_cur], ids_prev[i_prev])),
+                shape=(num_droplets, ids_prev.max()+1)).tocsr()
+            best = np.asarray(overlap.argmax(axis=1)).reshape(-1)
+            best_overlap = np.asarray(
+                overlap.max(axis=1).todense()).reshape(-1)
+            # Resolve conflicts in favour of the largest overlap.
+            order = np.argsort(-best_overlap, kind="stable")
+            order = order[best_overlap[order] > 0.]
+            _, first = np.unique(best[order], return_index=True)
+            winners = order[first]
+            ids[winners] = best[winners]
+    new = np.flatnonzero(ids < 0)
+    ids[new] = next_id + np.arange(len(new))
+    return ids, next_id + len(new)
+
+
+class DropletTracker:
+    """ Labels the droplets of a sequence of phase fields on a fixed mesh,
+    and keeps their identities from step to step. """
+    def __init__(self, nodes, elems):
+        dim = elems.shape[1]-1
+        self.nodes = nodes[:, :dim]
+        self.elems = elems
+        self.volumes = simplex_volumes(self.nodes[elems])
+        self.neighbours = element_neighbours(elems)
+        self.reset()
+
+    def reset(self):
+        """ Forget the previous droplets; ids start again at 0. """
+        self.elements = np.zeros(0, dtype=int)
+        self.ids = np.zeros(0, dtype=int)
+        self.next_id = 0
+
+    def label(self, phi):
+        """ Dispersed elements (with mean phi < 0) and their droplet
+        labels. """
+        dispersed = np.asarray(phi).reshape(-1)[self.elems].mean(axis=1) < 0.
+        return label_droplets(self.neighbours, dispersed)
+
+    def properties(self, elements, labels, phi, u=None, charge=None):
+        """ Volume, centroid and velocity of each droplet, weighted by the
+        mask (1-phi)/2 over the droplet elements, and the total charge in
+        the droplet elements. """
+        dim = self.nodes.shape[1]
+        mask = np.clip(0.5*(1.-np.asarray(phi).reshape(-1)), 0., 1.)
+        if u is None:
+            u = np.zeros((len(mask), dim))
+        if charge is None:
+            charge = np.zeros(len(mask))
+        values = np.hstack((mask[:, None],
+                            mask[:, None]*self.nodes,
+                            mask[:, None]*u[:, :dim],
+                            np.asarray(charge).reshape(-1, 1)))
+        integrals = droplet_integrals(self.elems, self.volumes, elements,
+                                      labels, values)
+        volume = integrals[:, 0]
+        return dict(volume=volume,
+                    centroid=integrals[:, 1:dim+1]/volume[:, None],
+                    velocity=integrals[:, dim+1:2*dim+1]/volume[:, None],
+                    charge=integrals[:, 2*dim+1])
+
+    def track(self, elements, labels):
+        """ Droplet ids of the labels, continuing from the previous call. """
+        ids, self.next_id = match_droplets(
+            self.elements, self.ids, elements, labels, self.volumes,
+            self.next_id)
+        self.elements = elements
+        self.ids = ids[labels]
+        return ids
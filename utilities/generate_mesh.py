@@ -142,16 +142,23 @@ def numpy_to_dolfin_old(nodes, elements):
     return mesh
 
 
-def numpy_to_dolfin(nodes, elements):
-    """ Convert nodes and elements to a dolfin mesh object. """
-    tmpfile = "tmp.h5"
+def numpy_to_dolfin(nodes, elements, comm=comm):
+    """ Convert nodes and elements to a dolfin mesh object.
+
+    If comm is a serial communicator, e.g. COMM_SELF, every process
+    builds its own copy of the full mesh. """
+    mesh_rank = comm.Get_rank()
+    if comm.Get_size() == 1 and size > 1:
+        tmpfile = "tmp_{}.h5".format(rank)
+    else:
+        tmpfile = "tmp.h5"
 
     dim = elements.shape[1]-1
     cell_type = "triangle"
     if dim == 3:
         cell_type = "tetrahedron"
 
-    if rank == 0:
+    if mesh_rank == 0:
         with h5py.File(tmpfile, "w") as h5f:
             cell_indices = h5f.create_dataset(
                 "mesh/cell_indices", data=np.arange(len(elements)),
@@ -165,14 +172,15 @@ def numpy_to_dolfin(nodes, elements):
 
     comm.Barrier()
 
-    mesh = df.Mesh()
-    h5f = df.HDF5File(mesh.mpi_comm(), tmpfile, "r")
+    mesh = df.Mesh(comm)
+    h5f = df.HDF5File(comm, tmpfile, "r")
     h5f.read(mesh, "mesh", False)
     h5f.close()
 
     comm.Barrier()
 
-    remove_safe(tmpfile)
+    if mesh_rank == 0 and os.path.exists(tmpfile):
+        os.remove(tmpfile)
     return mesh
 
 
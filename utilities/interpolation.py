@@ -0,0 +1,169 @@
+import numpy as np
+from scipy.spatial import cKDTree
+import scipy.sparse as sp
+import hashlib
+
+
+def barycentric_coordinates(x_elem, x):
+    """ Barycentric coordinates of points x (n, dim) in the simplices with
+    vertex coordinates x_elem (n, dim+1, dim). """
+    E = np.transpose(x_elem[:, 1:, :] - x_elem[:, :1, :], (0, 2, 1))
+    xi = np.linalg.solve(E, (x - x_elem[:, 0, :])[:, :, None])[:, :, 0]
+    return np.hstack((1.-xi.sum(axis=1, keepdims=True), xi))
+
+
+def locate_points(nodes, elems, x, tol=1e-8, num_candidates=8,
+                  extrapolate=False):
+    """ Find the element containing each point, and the barycentric
+    coordinates of the point in that element. The num_candidates nearest
+    elements (by centroid) are tried first. The remaining points are only
+    tried against the elements whose bounding sphere (about the centroid)
+    holds them; these are found per class of element size, so that large
+    elements do not widen the search among the small ones. Points outside
+    the mesh get cell -1, or are assigned to the nearest of the
+    num_candidates nearest elements (with clipped weights) if
+    extrapolate. """
+    dim = elems.shape[1]-1
+    x = np.asarray(x, dtype=float)
+    x = x.reshape(len(x), -1)[:, :dim]
+    x_elems = nodes[elems, :dim]
+
+    cells = -np.ones(len(x), dtype=int)
+    weights = np.zeros((len(x), dim+1))
+
+    centroids = x_elems.mean(axis=1)
+    radii = np.sqrt(((x_elems-centroids[:, None, :])**2).sum(
+        axis=2)).max(axis=1)
+    radii = radii*(1.+1e-6) + tol*radii.max()
+    tree = cKDTree(centroids)
+
+    num_candidates = min(num_candidates, len(elems))
+    _, candidates = tree.query(x, k=num_candidates)
+    candidates = candidates.reshape(len(x), num_candidates)
+
+    for j in range(num_candidates):
+        ids = np.flatnonzero(cells < 0)
+        if len(ids) == 0:
+            break
+        cands = candidates[ids, j]
+        lam = barycentric_coordinates(x_elems[cands], x[ids])
+        inside = lam.min(axis=1) >= -tol
+        cells[ids[inside]] = cands[inside]
+        weights[ids[inside]] = lam[inside]
+
+    # Elements grouped by bounding radius, in factors of two
+    size_class = np.floor(np.log2(radii/radii.min())).astype(int)
+    ids = np.flatnonzero(cells < 0)
+    if len(ids) > 0:
+        tree_x = cKDTree(x[ids])
+    for c in np.unique(size_class):
+        if len(ids) == 0:
+            break
+        elems_c = np.flatnonzero(size_class == c)
+        pairs = tree_x.sparse_distance_matrix(
+            cKDTree(centroids[elems_c]), radii[elems_c].max(),
+            output_type="ndarray")
+        pts = ids[pairs["i"]]
+        cands = elems_c[pairs["j"]]
+        near = (cells[pts] < 0) & (pairs["v"] <= radii[cands])
+        pts, cands = pts[near], cands[near]
+        lam = barycentric_coordinates(x_elems[cands], x[pts])
+        inside = np.flatnonzero(lam.min(axis=1) >= -tol)
+        # One element per point, if it lies on a shared facet
+        _, first = np.unique(pts[inside], return_index=True)
+        inside = inside[first]
+        cells[pts[inside]] = cands[inside]
+        weights[pts[inside]] = lam[inside]
+
+    outside = np.flatnonzero(cells < 0)
+    if extrapolate and len(outside) > 0:
+        lam_best = -np.inf*np.ones(len(outside))
+        for j in range(num_candidates):
+            cands = candidates[outside, j]
+            lam = barycentric_coordinates(x_elems[cands], x[outside])
+            better = lam.min(axis=1) > lam_best
+            lam_best[better] = lam[better].min(axis=1)
+            lam_k = np.maximum(lam[better], 0.)
+            cells[outside[better]] = cands[better]
+            weights[outside[better]] = lam_k/lam_k.sum(axis=1, keepdims=True)
+
+    return cells, weights
+
+
+def interpolation_matrix(nodes, elems, x, tol=1e-8, extrapolate=False):
+    """ Sparse matrix that interpolates nodal (P1) data to the points x.
+    Rows of points outside the mesh are zero unless extrapolate. Returns
+    the matrix and a boolean array telling which points were found. """
+    cells, weights = locate_points(nodes, elems, x, tol=tol,
+                                   extrapolate=extrapolate)
+    found = cells >= 0
+    num_verts = elems.shape[1]
+    rows = np.repeat(np.flatnonzero(found), num_verts)
+    cols = elems[cells[found]].flatten()
+    vals = weights[found].flatten()
+    P = sp.csr_matrix((vals, (rows, cols)), shape=(len(cells), len(nodes)))
+    return P, found
+
+
+def mesh_hash(nodes, elems):
+    """ Hash identifying a mesh. """
+    md5 = hashlib.md5()
+    md5.update(np.ascontiguousarray(nodes, dtype=float).tobytes())
+    md5.update(np.ascontiguousarray(elems, dtype=np.int64).tobytes())
+    return md5.hexdigest()
+
+
+def basis_gradients(nodes, elems):
+    """ Gradients of the P1 basis functions in each element (elems, dim+1,
+    dim), and the element volumes. """
+    dim = elems.shape[1]-1
+    x_elems = nodes[elems, :dim]
+    E = np.transpose(x_elems[:, 1:, :] - x_elems[:, :1, :], (0, 2, 1))
+    grad_xi = np.linalg.inv(E)
+    grad_basis = np.concatenate(
+        (-grad_xi.sum(axis=1, keepdims=True), grad_xi), axis=1)
+    volume = np.abs(np.linalg.det(E))/np.prod(np.arange(1, dim+1))
+    return grad_basis, volume
+
+
+def mass_stiffness_matrices(nodes, elems):
+    """ P1 mass and stiffness matrices, assembled from the numpy mesh. """
+    dim = elems.shape[1]-1
+    grad_basis, volume = basis_gradients(nodes, elems)
+
+    # Element matrices
+    M_loc = (np.ones((dim+1, dim+1)) + np.eye(dim+1))/((dim+1)*(dim+2))
+    M_elem = volume[:, None, None]*M_loc[None, :, :]
+    K_elem = volume[:, None, None]*np.einsum("eid,ejd->eij",
+                                             grad_basis, grad_basis)
+
+    rows = np.repeat(elems, dim+1, axis=1).flatten()
+    cols = np.tile(elems, (1, dim+1)).flatten()
+    shape = (len(nodes), len(nodes))
+    M = sp.csr_matrix((M_elem.flatten(), (rows, cols)), shape=shape)
+    K = sp.csr_matrix((K_elem.flatten(), (rows, cols)), shape=shape)
+    return M, K
+
+
+def line_points(x_a, x_b, dx):
+    """ Equidistant points from x_a to x_b (both included), with spacing at
+    most dx. """
+    x_a = np.asarray(x_a, dtype=float)
+    x_b = np.asarray(x_b, dtype=float)
+    N = max(int(np.ceil(np.linalg.norm(x_b-x_a)/dx)), 1)
+    s = np.linspace(0., 1., N+1)
+    return x_a[None, :] + s[:, None]*(x_b-x_a)[None, :]
+
+
+def plane_points(x_a, x_b, x_c, dx):
+    """ Regular grid of points in the parallelogram spanned by x_b-x_a and
+    x_c-x_a, with spacing at most dx. """
+    x_a = np.asarray(x_a, dtype=float)
+    e_b = np.asarray(x_b, dtype=float) - x_a
+    e_c = np.asarray(x_c, dtype=float) - x_a
+    N_b = max(int(np.ceil(np.linalg.norm(e_b)/dx)), 1)
+    N_c = max(int(np.ceil(np.linalg.norm(e_c)/dx)), 1)
+    s, t = np.meshgrid(np.linspace(0., 1., N_b+1),
+                       np.linspace(0., 1., N_c+1))
+    return (x_a[None, :] + s.reshape(-1, 1)*e_b[None, :]
+            + t.reshape(-1, 1)*e_c[None, :])
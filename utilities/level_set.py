@@ -0,0 +1,267 @@
+"""
+Level set extraction directly on simplicial (P1) meshes.
+
+Marching triangles (2D) and marching tetrahedra (3D) are done for all
+elements at once in numpy. Crossing points are identified by the mesh edge
+they lie on, so that neighbouring elements share them exactly. Values
+exactly at the level count as below it, so that every crossing lies on an
+edge with one vertex strictly above; crossings at such nodes give
+coincident points joined by segments of zero length, but the level set
+keeps the topology of a curve (surface).
+"""
+import numpy as np
+
+
+def simplex_volumes(x):
+    """ Volumes (areas) of simplices given their vertices (e, d+1, d). """
+    dim = x.shape[2]
+    if dim == 2:
+        a = x[:, 1, :]-x[:, 0, :]
+        b = x[:, 2, :]-x[:, 0, :]
+        return 0.5*np.abs(a[:, 0]*b[:, 1]-a[:, 1]*b[:, 0])
+    return np.abs(np.linalg.det(x[:, 1:, :]-x[:, :1, :]))/6.
+
+
+def edge_crossings(nodes, vals, edges, level=0.):
+    """ Unique crossing points on the given node pairs (n, 2), each with one
+    node above the level and one not. Returns the points and the index of
+    the point of each pair. """
+    edges = np.sort(edges, axis=1)
+    edges_u, index = np.unique(edges, axis=0, return_inverse=True)
+    v_a = vals[edges_u[:, 0]]
+    v_b = vals[edges_u[:, 1]]
+    t = (level-v_a)/(v_b-v_a)
+    points = ((1.-t)[:, None]*nodes[edges_u[:, 0]]
+              + t[:, None]*nodes[edges_u[:, 1]])
+    return points, index.reshape(-1)
+
+
+def marching_triangles(nodes, elems, vals, level=0.):
+    """ Level set of the P1 function vals on a triangle mesh.
+
+    Returns the crossing points and the segments (pairs of point indices),
+    oriented such that the region vals > level is on the left.
+    """
+    above = vals[elems] > level
+    num_above = above.sum(axis=1)
+    cut = (num_above == 1) | (num_above == 2)
+    elems_c = elems[cut]
+    above_c = above[cut]
+
+    # The lone vertex (the one on its own side) and the two others, in
+    # the order of the element.
+    lone = np.where(num_above[cut] == 1,
+                    np.argmax(above_c, axis=1),
+                    np.argmin(above_c, axis=1))
+    i_0 = elems_c[np.arange(len(elems_c)), lone]
+    i_1 = elems_c[np.arange(len(elems_c)), (lone+1) % 3]
+    i_2 = elems_c[np.arange(len(elems_c)), (lone+2) % 3]
+
+    points, index = edge_crossings(
+        nodes, vals, np.vstack((np.vstack((i_0, i_1)).T,
+                                np.vstack((i_0, i_2)).T)), level)
+    segments = index.reshape(2, -1).T
+
+    # Orient with the region above the level on the left. From the edge
+    # (i_0, i_1) to the edge (i_0, i_2), i_0 is on the left if the element
+    # is counter-clockwise. This does not depend on the (possibly
+    # coincident) crossing points.
+    a = nodes[i_1]-nodes[i_0]
+    b = nodes[i_2]-nodes[i_0]
+    ccw = a[:, 0]*b[:, 1]-a[:, 1]*b[:, 0] > 0
+    flip = ccw != (num_above[cut] == 1)
+    segments[flip] = segments[flip][:, ::-1]
+    return points, segments
+
+
+def marching_tetrahedra(nodes, elems, vals, level=0.):
+    """ Level set of the P1 function vals on a tetrahedral mesh.
+
+    Returns the crossing points and the triangles (triples of point
+    indices), with normals pointing towards the region vals > level.
+    """
+    above = vals[elems] > level
+    num_above = above.sum(axis=1)
+    # Vertices of each element ordered with those above the level first.
+    order = np.argsort(~above, axis=1, kind="stable")
+    elems_o = np.take_along_axis(elems, order, axis=1)
+
+    pairs = []
+    # One vertex on its own side: one triangle.
+    single_a = elems_o[num_above == 1]
+    single_b = elems_o[num_above == 3][:, ::-1]
+    single = np.vstack((single_a, single_b))
+    for j in range(1, 4):
+        pairs.append(single[:, [0, j]])
+    # Two vertices on each side: a quadrilateral, split in two triangles.
+    double = elems_o[num_above == 2]
+    for a, b in [(0, 2), (0, 3), (1, 3), (1, 2)]:
+        pairs.append(double[:, [a, b]])
+
+    points, index = edge_crossings(
+        nodes, vals, np.vstack(pairs).reshape(-1, 2), level)
+    n_s = len(single)
+    n_d = len(double)
+    index_s = index[:3*n_s].reshape(3, n_s).T
+    index_d = index[3*n_s:].reshape(4, n_d).T
+    triangles = np.vstack((index_s,
+                           index_d[:, [0, 1, 2]],
+                           index_d[:, [0, 2, 3]]))
+
+    # Direction towards the region above the level.
+    towards = np.vstack((
+        nodes[single_a[:, 0]] - nodes[single_a[:, 1:]].mean(axis=1),
+        nodes[single_b[:, 1:]].mean(axis=1) - nodes[single_b[:, 0]]))
+    towards_d = (nodes[double[:, :2]].mean(axis=1)
+                 - nodes[double[:, 2:]].mean(axis=1))
+    towards = np.vstack((towards, towards_d, towards_d))
+
+    x = points[triangles]
+    normals = np.cross(x[:, 1]-x[:, 0], x[:, 2]-x[:, 0])
+    flip = (normals*towards).sum(axis=1) < 0.
+    triangles[flip] = triangles[flip][:, ::-1]
+    return points, triangles
+
+
+def extract_level_set(nodes, elems, vals, level=0.):
+    """ Level set of the P1 function vals: points and segments (2D) or
+    triangles (3D). """
+    vals = np.asarray(vals).reshape(-1)
+    if elems.shape[1] == 3:
+        return marching_triangles(nodes[:, :2], elems, vals, level)
+    return marching_tetrahedra(nodes, elems, vals, level)
+
+
+def interface_measure(points, cells):
+    """ Length (2D) or area (3D) of an extracted level set. """
+    x = points[cells]
+    if cells.shape[1] == 2:
+        return np.linalg.norm(x[:, 1]-x[:, 0], axis=1).sum()
+    return 0.5*np.linalg.norm(np.cross(x[:, 1]-x[:, 0], x[:, 2]-x[:, 0]),
+                              axis=1).sum()
+
+
+def enclosed_volume(nodes, elems, vals, level=0.):
+    """ Exact volume (area in 2D) of the region vals < level, with vals
+    linear in each element. """
+    vals = np.asarray(vals).reshape(-1)
+    dim = elems.shape[1]-1
+    x = nodes[:, :dim]
+    v = vals[elems]
+    below = v < level
+    num_below = below.sum(axis=1)
+    volumes = simplex_volumes(x[elems])
+    volume = volumes[num_below == dim+1].sum()
+
+    # One vertex on its own side: the corner simplex at the lone vertex
+    # is the product of the edge fractions.
+    lone_below = num_below == 1
+    lone_above = num_below == dim
+    for lone_mask, is_below in [(lone_below, True), (lone_above, False)]:
+        v_c = v[lone_mask]
+        if len(v_c) == 0:
+            continue
+        lone = np.argmax(below[lone_mask] == is_below, axis=1)
+        v_lone = v_c[np.arange(len(v_c)), lone]
+        fraction = np.ones(len(v_c))
+        for j in range(1, dim+1):
+            v_j = v_c[np.arange(len(v_c)), (lone+j) % (dim+1)]
+            fraction *= (level-v_lone)/(v_j-v_lone)
+        if is_below:
+            volume += (fraction*volumes[lone_mask]).sum()
+        else:
+            volume += ((1.-fraction)*volumes[lone_mask]).sum()
+
+    if dim == 3:
+        # Two vertices on each side: the part below is a prism with the
+        # edge between the two vertices below as one of its sides.
+        double = num_below == 2
+        order = np.argsort(~below[double], axis=1, kind="stable")
+        e_o = np.take_along_axis(elems[double], order, axis=1)
+
+        def crossing(a, b):
+            v_a = vals[e_o[:, a]]
+            v_b = vals[e_o[:, b]]
+            t = ((level-v_a)/(v_b-v_a))[:, None]
+            return (1.-t)*x[e_o[:, a]] + t*x[e_o[:, b]]
+
+        a_0, a_1, a_2 = x[e_o[:, 0]], crossing(0, 2), crossing(0, 3)
+        b_0, b_1, b_2 = x[e_o[:, 1]], crossing(1, 2), crossing(1, 3)
+        for tet in [(a_0, a_1, a_2, b_2), (a_0, a_1, b_1, b_2),
+                    (a_0, b_0, b_1, b_2)]:
+            volume += simplex_volumes(np.stack(tet, axis=1)).sum()
+    return volume
+
+
+def chain_segments(points, segments):
+    """ Chain oriented segments into polylines. Closed curves end with
+    their first point. Should several segments leave the same point, all of
+    them are used, each by one polyline. The polylines are sorted by
+    decreasing number of points. """
+    following = dict()
+    for i, j in segments:
+        following.setdefault(i, []).append(j)
+    starts = set(segments[:, 0]) - set(segments[:, 1])
+    polylines = []
+
+    def next_point(i):
+        j = following[i].pop()
+        if len(following[i]) == 0:
+            del following[i]
+        return j
+
+    def walk(start):
+        path = [start]
+        i = next_point(start)
+        while True:
+            path.append(i)
+            if i == start or i not in following:
+                break
+            i = next_point(i)
+        return path
+
+    # Open curves (ending on the boundary) first, then the closed ones.
+    for start in sorted(starts):
+        while start in following:
+            polylines.append(points[walk(start)])
+    while len(following) > 0:
+        polylines.append(points[walk(min(following))])
+    return sorted(polylines, key=len, reverse=True)
+
+
+def level_set_geometry(nodes, elems, vals, level=0.):
+    """ The level set and its geometry in one go. Returns a dict with the
+    polylines (2D) or the points and triangles (3D), the interface measure
+    (length in 2D, area in 3D) and the volume of the region vals < level.
+    """
+    points, cells = extract_level_set(nodes, elems, vals, level)
+    data = dict(points=points, cells=cells,
+                measure=interface_measure(points, cells),
+                volume=enclosed_volume(nodes, elems, vals, level))
+    if cells.shape[1] == 2:
+        data["polylines"] = chain_segments(points, cells)
+    return data
+
+
+def save_level_set(filename, data):
+    """ Store polylines as blocks separated by blank lines (2D), or the
+    triangle vertices (3D). """
+    with open(filename, "w") as f:
+        if "polylines" in data:
+            for path in data["polylines"]:
+                np.savetxt(f, path)
+                f.write("\n")
+        else:
+            np.savetxt(f, data["points"][data["cells"]].reshape(-1, 3))
+
+
+def load_polylines(filename):
+    """ Polylines stored by save_level_set. """
+    polylines = [[]]
+    for line in open(filename):
+        if line.strip() == "" or line.startswith("#"):
+            if len(polylines[-1]) > 0:
+                polylines.append([])
+        else:
+            polylines[-1].append([float(e) for e in line.split()])
+    return [np.array(path) for path in polylines if len(path) > 0]
@@ -8,13 +8,16 @@ from matplotlib.tri import TriContourSet
 from mpi4py.MPI import COMM_WORLD as comm
 import os
 import sys
+import copy
+import subprocess
+import shutil
 # Find path to the BERNAISE root folder
 bernaise_path = "/" + os.path.join(*os.path.realpath(__file__).split("/")[:-2])
 # ...and append it to sys.path to get functionality from BERNAISE
 sys.path.append(bernaise_path)
 from common import remove_safe, info
-from skimage import measure
-from scipy.interpolate import griddata
+from utilities.interpolation import interpolation_matrix
+from utilities.level_set import level_set_geometry, save_level_set
 from mpl_toolkits.mplot3d.art3d import Poly3DCollection
 
 """
@@ -231,6 +234,62 @@ def plot_streamlines(nodes, elems, vals, title=None, clabel=None,
                       linewidth=lw)
 
 
+def phase_colormap():
+    """ Colormap which is transparent for phi < 0 and black for phi > 0. """
+    cmap = copy.copy(plt.get_cmap('Greys'))
+    cmap._init()
+    cmap._lut[:, :] = 0.
+    length = len(cmap._lut[:, -1])
+
+    # cmap._lut[:, -1] = np.linspace(0., 1.0, length)
+    cmap._lut[:length//2, -1] = 0.
+    cmap._lut[length//2:, -1] = 1.
+    return cmap
+
+
+def streamline_grid(nodes, num_intp=100):
+    """ Regular grid for streamlines, inset from the bounding box. """
+    Lx = nodes[:, 0].max()-nodes[:, 0].min()
+    Ly = nodes[:, 1].max()-nodes[:, 1].min()
+    dx = max(Lx, Ly)/num_intp
+    Nx = int(Lx/dx)
+    Ny = int(Ly/dx)
+
+    return np.meshgrid(
+        np.linspace(dx+nodes[:, 0].min(),
+                    nodes[:, 0].max()-dx, Nx),
+        np.linspace(dx+nodes[:, 1].min(),
+                    nodes[:, 1].max()-dx, Ny))
+
+
+def plot_phase_streamlines(ax, x_i, y_i, ux_i, uy_i, phi_i):
+    """ Streamlines, black in phase phi < 0 and white in phase phi > 0. """
+    u_norm = np.sqrt(ux_i**2 + uy_i**2)
+
+    lw = np.zeros_like(ux_i)
+    lw[:] += 5*u_norm/(u_norm.max() + 1e-10)
+
+    mask = np.zeros(ux_i.shape, dtype=bool)
+    mask[phi_i > 0.] = True
+    ux_i_2 = np.ma.array(ux_i, mask=mask)
+
+    ax.streamplot(x_i, y_i,
+                  ux_i_2, uy_i,
+                  color="k",
+                  density=0.6,
+                  linewidth=lw)
+
+    mask = np.zeros(ux_i.shape, dtype=bool)
+    mask[phi_i < 0.] = True
+    ux_i_2 = np.ma.array(ux_i, mask=mask)
+
+    ax.streamplot(x_i, y_i,
+                  ux_i_2, uy_i,
+                  color="w",
+                  density=0.6,
+                  linewidth=lw)
+
+
 def plot_fancy(nodes, elems, phi=None, charge=None, u=None, charge_max=None,
                show=False, save=None, num_intp=100, title=None, clabel=None,
                animation_mode=True, latex=False):
@@ -252,17 +311,9 @@ def plot_fancy(nodes, elems, phi=None, charge=None, u=None, charge_max=None,
     if charge_max is None:
         charge_max = max(np.max(np.abs(charge)), 1e-10)
 
-    cmap = plt.cm.get_cmap('Greys')
-    cmap._init()
-    cmap._lut[:, :] = 0.
-    length = len(cmap._lut[:, -1])
-
-    # cmap._lut[:, -1] = np.linspace(0., 1.0, length)
-    cmap._lut[:length//2, -1] = 0.
-    cmap._lut[length//2:, -1] = 1.
+    cmap = phase_colormap()
 
-    phi[phi > 1.] = 1.
-    phi[phi < -1.] = -1.
+    phi = np.clip(phi, -1., 1.)
 
     plt.tripcolor(nodes[:, 0], nodes[:, 1], elems, charge,
                   cmap=plt.get_cmap("coolwarm"), shading="gouraud",
@@ -271,17 +322,7 @@ def plot_fancy(nodes, elems, phi=None, charge=None, u=None, charge_max=None,
                     cmap=cmap, levels=[-2.0, 0., 2.0], antialiased=True)
 
     if u is not None:
-        Lx = nodes[:, 0].max()-nodes[:, 0].min()
-        Ly = nodes[:, 1].max()-nodes[:, 1].min()
-        dx = max(Lx, Ly)/num_intp
-        Nx = int(Lx/dx)
-        Ny = int(Ly/dx)
-
-        x_i, y_i = np.meshgrid(
-            np.linspace(dx+nodes[:, 0].min(),
-                        nodes[:, 0].max()-dx, Nx),
-            np.linspace(dx+nodes[:, 1].min(),
-                        nodes[:, 1].max()-dx, Ny))
+        x_i, y_i = streamline_grid(nodes, num_intp)
         triang = mtri.Triangulation(nodes[:, 0], nodes[:, 1], elems)
         ux_interp = mtri.LinearTriInterpolator(triang, u[:, 0])
         uy_interp = mtri.LinearTriInterpolator(triang, u[:, 1])
@@ -294,32 +335,120 @@ def plot_fancy(nodes, elems, phi=None, charge=None, u=None, charge_max=None,
         uy_i = np.array(uy_i.filled(0.))
         phi_i = np.array(phi_i.filled(0.))
 
-        u_norm = np.sqrt(ux_i**2 + uy_i**2)
-
-        lw = np.zeros_like(ux_i)
-        lw[:] += 5*u_norm/(u_norm.max() + 1e-10)
+        plot_phase_streamlines(fig.ax, x_i, y_i, ux_i, uy_i, phi_i)
 
-        mask = np.zeros(ux_i.shape, dtype=bool)
-        mask[phi_i > 0.] = True
-        ux_i_2 = np.ma.array(ux_i, mask=mask)
-
-        fig.ax.streamplot(x_i, y_i,
-                          ux_i_2, uy_i,
-                          color="k",
-                          density=0.6,
-                          linewidth=lw)
-
-        mask = np.zeros(ux_i.shape, dtype=bool)
-        mask[phi_i < 0.] = True
-        ux_i_2 = np.ma.array(ux_i, mask=mask)
+    return fig
 
-        fig.ax.streamplot(x_i, y_i,
-                          ux_i_2, uy_i,
-                          color="w",
-                          density=0.6,
-                          linewidth=lw)
 
-    return fig
+class FancyPlotter:
+    """ Renders frames like plot_fancy (in animation mode) to image arrays.
+    The figure, the triangulation and the interpolation to the streamline
+    grid are set up once and reused for all frames. """
+    def __init__(self, nodes, elems, charge_max, num_intp=100, width=6.,
+                 dpi=100):
+        self.charge_max = charge_max
+        self.triang = mtri.Triangulation(nodes[:, 0], nodes[:, 1], elems)
+        self.cmap_phase = phase_colormap()
+        self.cmap_charge = plt.get_cmap("coolwarm")
+
+        self.x_lim = (nodes[:, 0].min(), nodes[:, 0].max())
+        self.y_lim = (nodes[:, 1].min(), nodes[:, 1].max())
+        aspect = (self.y_lim[1]-self.y_lim[0])/(self.x_lim[1]-self.x_lim[0])
+        self.fig = plt.figure(figsize=(width, width*aspect), dpi=dpi)
+        self.ax = self.fig.add_axes([0., 0., 1., 1.])
+
+        self.x_i, self.y_i = streamline_grid(nodes, num_intp)
+        self.P_i, _ = interpolation_matrix(
+            nodes, elems, np.vstack((self.x_i.flatten(),
+                                     self.y_i.flatten())).T)
+
+    def interpolate(self, values):
+        """ Interpolate nodal values to the streamline grid (zero outside
+        the mesh). """
+        return (self.P_i*values).reshape(self.x_i.shape)
+
+    def render(self, phi, charge, u=None):
+        """ Render frame to an RGB image array. """
+        ax = self.ax
+        ax.clear()
+        ax.set_axis_off()
+        ax.set_aspect("equal")
+        ax.set_xlim(*self.x_lim)
+        ax.set_ylim(*self.y_lim)
+
+        phi = np.clip(phi, -1., 1.)
+
+        ax.tripcolor(self.triang, charge, cmap=self.cmap_charge,
+                     shading="gouraud",
+                     vmin=-self.charge_max, vmax=self.charge_max)
+        ax.tricontourf(self.triang, phi, cmap=self.cmap_phase,
+                       levels=[-2.0, 0., 2.0], antialiased=True)
+
+        if u is not None:
+            plot_phase_streamlines(ax, self.x_i, self.y_i,
+                                   self.interpolate(u[:, 0]),
+                                   self.interpolate(u[:, 1]),
+                                   self.interpolate(phi))
+
+        self.fig.canvas.draw()
+        return np.array(self.fig.canvas.buffer_rgba())[:, :, :3]
+
+
+# Plotter of the current process, for rendering in a process pool.
+_plotter = None
+
+
+def init_plotter(plotter_class, *args):
+    global _plotter
+    _plotter = plotter_class(*args)
+
+
+def render_frame(args):
+    return _plotter.render(*args)
+
+
+def save_image(filename, image):
+    """ Write image array to file. """
+    plt.imsave(filename, image)
+
+
+def ffmpeg_available():
+    """ Whether the ffmpeg executable, needed by AnimationWriter, is found. """
+    return shutil.which("ffmpeg") is not None
+
+
+class AnimationWriter:
+    """ Streams RGB frames to ffmpeg, which encodes them as a GIF or (for
+    other file extensions) an MP4/H.264 video, without temporary image
+    files. """
+    def __init__(self, filename, fps=25):
+        self.filename = filename
+        self.fps = fps
+        self.process = None
+
+    def write(self, frame):
+        if self.process is None:
+            height, width = frame.shape[:2]
+            args = ["ffmpeg", "-y", "-loglevel", "error",
+                    "-f", "rawvideo", "-pix_fmt", "rgb24",
+                    "-s", "{}x{}".format(width, height),
+                    "-r", str(self.fps), "-i", "-"]
+            if self.filename.endswith(".gif"):
+                args += ["-filter_complex",
+                         "split[a][b];[a]palettegen[p];[b][p]paletteuse",
+                         "-loop", "0"]
+            else:
+                args += ["-vf", "pad=ceil(iw/2)*2:ceil(ih/2)*2",
+                         "-pix_fmt", "yuv420p", "-vcodec", "libx264"]
+            self.process = subprocess.Popen(args + [self.filename],
+                                            stdin=subprocess.PIPE)
+        self.process.stdin.write(
+            np.ascontiguousarray(frame, dtype=np.uint8).tobytes())
+
+    def close(self):
+        if self.process is not None:
+            self.process.stdin.close()
+            self.process.wait()
 
 
 def plot_any_field(nodes, elems, values, save=None, show=True, label=None,
@@ -337,62 +466,31 @@ def plot_any_field(nodes, elems, values, save=None, show=True, label=None,
                      show=show, latex=latex)
 
 
-def zero_level_set(nodes, elems, vals, show=False, save_file=False, num_intp=32):
+def zero_level_set(nodes, elems, vals, show=False, save_file=False):
     """ Returns the zero level set of the phase field, i.e. the phase boundary.
+    It is extracted directly on the mesh (marching triangles/tetrahedra).
+    In 2D, a list of polylines (longest first); in 3D, the triangle vertices
+    (num_triangles, 3, 3).
     GL: Possibly not a plot function?
     """
     dim = elems.shape[1]-1
+    data = level_set_geometry(nodes, elems, vals)
     if dim == 2:
-        fig = plt.figure()
-        ax = fig.add_subplot(1, 1, 1)
-        cs = ax.tricontour(nodes[:, 0], nodes[:, 1], elems, vals, levels=[0.])
-        paths = cs.collections[0].get_paths()
-        x, y = zip(*paths[0].vertices)
-        plt.close(fig)
-
         if rank == 0 and show:
             fig = plt.figure()
             ax = fig.add_subplot(1, 1, 1)
             ax.set_aspect('equal')
-            ax.plot(x, y, '*-')
+            for path in data["polylines"]:
+                ax.plot(path[:, 0], path[:, 1], '*-')
             plt.show()
 
     elif dim == 3:
-        Lx = nodes[:, 0].max()-nodes[:, 0].min()
-        Ly = nodes[:, 1].max()-nodes[:, 1].min()
-        Lz = nodes[:, 2].max()-nodes[:, 2].min()
-        dx = max([Lx, Ly, Lz])/num_intp
-        Nx = int(Lx/dx)
-        Ny = int(Ly/dx)
-        Nz = int(Lz/dx)
-
-        x_i, y_i, z_i = np.meshgrid(
-            np.linspace(nodes[:, 0].min(),
-                        nodes[:, 0].max(), Nx),
-            np.linspace(nodes[:, 1].min(),
-                        nodes[:, 1].max(), Ny),
-            np.linspace(nodes[:, 2].min(),
-                        nodes[:, 2].max(), Nz))
-
-        phi_i = griddata(nodes, vals, (x_i, y_i, z_i), method="nearest")
-
-        verts, faces, normals, values = measure.marching_cubes(phi_i, 0.)
-
-        verts[:, 0] = ((nodes[:, 0].max() -
-                        nodes[:, 0].min())*verts[:, 0]/Nx
-                       + nodes[:, 0].min())
-        verts[:, 1] = ((nodes[:, 1].max() -
-                        nodes[:, 1].min())*verts[:, 1]/Ny
-                       + nodes[:, 1].min())
-        verts[:, 2] = ((nodes[:, 2].max() -
-                        nodes[:, 2].min())*verts[:, 2]/Nz
-                       + nodes[:, 2].min())
-
+        triangles = data["points"][data["cells"]]
         if rank == 0 and show:
             fig = plt.figure(figsize=(10, 10))
             ax = fig.add_subplot(111, projection='3d')
 
-            mesh = Poly3DCollection(verts[faces])
+            mesh = Poly3DCollection(triangles)
             mesh.set_edgecolor('k')
             ax.add_collection3d(mesh)
 
@@ -404,22 +502,12 @@ def zero_level_set(nodes, elems, vals, show=False, save_file=False, num_intp=32)
             plt.show()
 
     if rank == 0 and save_file:
-        remove_safe(save_file)
-        with open(save_file, "a") as f:
-            if dim == 2:
-                for path in paths:
-                    np.savetxt(f, path.vertices)
-                    f.write("\n")
-            elif dim == 3:
-                np.savetxt(f, verts)
+        save_level_set(save_file, data)
 
     if dim == 2:
-        paths_out = []
-        for path in paths:
-            paths_out.append(path.vertices)
-        return paths_out
+        return data["polylines"]
     elif dim == 3:
-        return verts[faces]
+        return triangles
 
 
 if __name__ == "__main__":
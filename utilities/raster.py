@@ -0,0 +1,77 @@
+import numpy as np
+import os
+import matplotlib.pyplot as plt
+from .interpolation import locate_points, mesh_hash
+
+
+class RasterRenderer:
+    """ Renders nodal fields on a triangular mesh directly to image arrays.
+
+    Which triangle each pixel lies in, and its barycentric weights, are
+    computed once per mesh and resolution (and optionally stored in
+    cache_folder). Each frame is then a single vectorized gather, which
+    scales to meshes where tripcolor/tricontourf are too slow.
+    """
+    def __init__(self, nodes, elems, charge_max=1., width=800,
+                 cache_folder=None):
+        self.charge_max = charge_max
+
+        x_min, x_max = nodes[:, 0].min(), nodes[:, 0].max()
+        y_min, y_max = nodes[:, 1].min(), nodes[:, 1].max()
+        dx = (x_max-x_min)/width
+        height = max(int(np.round((y_max-y_min)/dx)), 1)
+        self.shape = (height, width)
+
+        cache_file = None
+        if cache_folder is not None:
+            cache_file = os.path.join(
+                cache_folder, "raster_{}_{}x{}.npz".format(
+                    mesh_hash(nodes, elems)[:16], width, height))
+
+        if cache_file is not None and os.path.exists(cache_file):
+            data = np.load(cache_file)
+            self.vertices = data["vertices"]
+            self.weights = data["weights"]
+            self.inside = data["inside"]
+        else:
+            # Pixel centres, with the first row at the top.
+            x, y = np.meshgrid(x_min + (np.arange(width)+0.5)*dx,
+                               y_max - (np.arange(height)+0.5)*dx)
+            cells, self.weights = locate_points(
+                nodes, elems, np.vstack((x.flatten(), y.flatten())).T)
+            self.inside = cells >= 0
+            self.vertices = elems[np.maximum(cells, 0)]
+            if cache_file is not None:
+                # Write atomically, since several processes may do this.
+                tmp_file = cache_file[:-4] + "_{}.npz".format(os.getpid())
+                np.savez(tmp_file, vertices=self.vertices,
+                         weights=self.weights, inside=self.inside)
+                os.rename(tmp_file, cache_file)
+
+        self.charge_colors = np.round(255*plt.get_cmap("coolwarm")(
+            np.linspace(0., 1., 256))[:, :3]).astype(np.uint8)
+        self.background = np.array([255, 255, 255], dtype=np.uint8)
+        self.phase_color = np.array([0, 0, 0], dtype=np.uint8)
+
+    def interpolate(self, values):
+        """ Values at the pixels, interpolated from the nodal values. """
+        values = np.asarray(values).reshape(-1)
+        return (values[self.vertices]*self.weights).sum(axis=1)
+
+    def render(self, phi=None, charge=None, u=None):
+        """ Image array (height, width, 3) of the charge, coloured as in
+        plot_fancy, with the phase phi > 0 masked in black. Streamlines (u)
+        are not drawn. """
+        image = np.empty((len(self.inside), 3), dtype=np.uint8)
+        image[:] = self.background
+        if charge is not None:
+            c = self.interpolate(charge)
+            index = np.clip(np.round(
+                255*0.5*(1.+c/self.charge_max)), 0, 255).astype(int)
+            image[self.inside] = self.charge_colors[index[self.inside]]
+        else:
+            image[self.inside] = self.charge_colors[128]
+        if phi is not None:
+            image[self.inside & (self.interpolate(phi) > 0.)] = \
+                self.phase_color
+        return image.reshape(self.shape + (3,))